@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+localhost_scanner_bench.py
+
+Reproducible benchmark for run_scan() in "localhost scanner.py" (stdlib only).
+
+- Spawns local asyncio stand-in servers on a port window: plain HTTP, HTTPS (with a
+  throwaway self-signed cert from the openssl CLI; skipped without it), slow-to-answer, slow-body, reset-on-accept and silent ports (everything
+  else in the window stays closed)
+- Runs the scanner over the window for every --concurrency x --timeouts setting,
+  each run in a fresh process so peak RSS is per run
+- Reports ports/sec, p50/p99 probe latency, peak RSS and the false-negative rate
+  (responding ports the scan missed), and writes them as JSON
+- --baseline compares against an earlier JSON and exits 1 on a regression
+
+Example:
+  python "localhost scanner bench.py" --ports 20000-21999 --concurrency 200,600 \\
+      --timeouts 0.2,0.5 --out bench.json --baseline bench-main.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import socket
+import ssl
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from typing import Optional, Sequence, Tuple
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCANNER_PATH = os.path.join(HERE, "localhost scanner.py")
+
+BEHAVIORS = ("http", "https", "latency", "slow", "reset", "silent")
+
+
+def load_scanner():
+    """The scanner module (its file name has a space, so no plain import)."""
+    spec = importlib.util.spec_from_file_location("localhost_scanner", SCANNER_PATH)
+    mod = importlib.util.module_from_spec(spec)
+    sys.modules["localhost_scanner"] = mod
+    spec.loader.exec_module(mod)
+    return mod
+
+
+# ----------------------------
+# Stand-in servers
+# ----------------------------
+
+@dataclass
+class Layout:
+    start: int
+    end: int
+    ports: dict[int, str]   # port -> behavior; ports not listed stay closed
+    latency_ms: float
+    slow_chunk_ms: float
+    tls: Optional[Tuple[str, str]] = None  # (cert PEM, key PEM) for the https stand-ins
+
+    def expected(self, timeout: float) -> set[int]:
+        """Ports a correct scan with this per-read timeout must report."""
+        want = set()
+        for port, kind in self.ports.items():
+            if kind in ("http", "https"):
+                want.add(port)
+            elif kind == "latency" and self.latency_ms / 1000.0 < timeout:
+                want.add(port)
+            elif kind == "slow" and self.slow_chunk_ms / 1000.0 < timeout:
+                want.add(port)
+        return want
+
+
+def make_layout(start: int, end: int, counts: dict[str, int], latency_ms: float, slow_chunk_ms: float,
+                seed: int) -> Layout:
+    """Spread the behaviors over the window at seeded random ports."""
+    need = sum(counts.values())
+    if need > end - start + 1:
+        raise ValueError(f"{need} servers don't fit in {start}-{end}")
+    picked = random.Random(seed).sample(range(start, end + 1), need)
+    ports: dict[int, str] = {}
+    i = 0
+    for kind in BEHAVIORS:
+        for _ in range(counts.get(kind, 0)):
+            ports[picked[i]] = kind
+            i += 1
+    return Layout(start, end, ports, latency_ms, slow_chunk_ms)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> bool:
+    """Read one request head; False if it wasn't HTTP (e.g. a TLS ClientHello on a plain port)."""
+    try:
+        first = await asyncio.wait_for(reader.readexactly(1), timeout=10)
+        if first == b"\x16":
+            return False
+        await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=10)
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+        return False
+    return True
+
+
+def _response(body: bytes, length: bool = True) -> bytes:
+    head = "HTTP/1.1 200 OK\r\nServer: bench-standin\r\nContent-Type: text/plain\r\nConnection: close\r\n"
+    if length:
+        head += f"Content-Length: {len(body)}\r\n"
+    return head.encode("ascii") + b"\r\n" + body
+
+
+def make_cert() -> Optional[Tuple[str, str]]:
+    """(cert PEM, key PEM) of a fresh self-signed localhost cert from the openssl CLI, or None without it."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+        try:
+            subprocess.run(
+                ["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                 "-nodes", "-keyout", key, "-out", cert, "-days", "1", "-subj", "/CN=localhost"],
+                check=True, capture_output=True, timeout=30,
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        with open(cert) as f_cert, open(key) as f_key:
+            return f_cert.read(), f_key.read()
+
+
+async def _serve(layout: Layout, ready, stop) -> None:
+    tls = None
+    if layout.tls:
+        tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        with tempfile.TemporaryDirectory() as tmp:
+            cert, key = os.path.join(tmp, "cert.pem"), os.path.join(tmp, "key.pem")
+            for path, pem in ((cert, layout.tls[0]), (key, layout.tls[1])):
+                with open(path, "w") as f:
+                    f.write(pem)
+            tls.load_cert_chain(cert, key)
+
+    held: set[asyncio.StreamWriter] = set()
+
+    def handler(kind: str):
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            try:
+                if kind == "reset":
+                    sock = writer.get_extra_info("socket")
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                    writer.transport.abort()
+                    return
+                if kind == "silent":
+                    held.add(writer)  # never answer; closed at shutdown
+                    await reader.read()
+                    return
+                if not await _read_request(reader):
+                    # Answer like a real server would, so a wrong-scheme probe fails fast.
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nConnection: close\r\nContent-Length: 0\r\n\r\n")
+                    await writer.drain()
+                    return
+                if kind == "latency":
+                    await asyncio.sleep(layout.latency_ms / 1000.0)
+                if kind == "slow":
+                    writer.write(_response(b"", length=False))
+                    for i in range(8):
+                        await writer.drain()
+                        await asyncio.sleep(layout.slow_chunk_ms / 1000.0)
+                        writer.write(f"chunk {i} of a slow body\n".encode())
+                else:
+                    writer.write(_response(f"{kind} stand-in\n".encode()))
+                await writer.drain()
+            except (ConnectionError, ssl.SSLError, OSError):
+                pass
+            finally:
+                held.discard(writer)
+                writer.close()
+        return handle
+
+    servers = []
+    for port, kind in layout.ports.items():
+        servers.append(await asyncio.start_server(
+            handler(kind), "127.0.0.1", port, ssl=tls if kind == "https" else None, backlog=1024,
+        ))
+    ready.set()
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+    for w in list(held):
+        w.close()
+    for s in servers:
+        s.close()
+
+
+def _server_main(layout: Layout, ready, stop) -> None:
+    asyncio.run(_serve(layout, ready, stop))
+
+
+# ----------------------------
+# One measured scan (runs in its own process)
+# ----------------------------
+
+def run_one(argv: Sequence[str]) -> dict:
+    """Scan with the scanner's own CLI parsing; time every probe_port() call."""
+    scanner = load_scanner()
+    args = scanner.parse_args(list(argv))
+
+    latencies: list[float] = []
+    probe_port = scanner.probe_port
+
+    async def timed_probe_port(*a, **kw):
+        t0 = time.perf_counter()
+        try:
+            return await probe_port(*a, **kw)
+        finally:
+            latencies.append(time.perf_counter() - t0)
+
+    scanner.probe_port = timed_probe_port  # run_scan looks it up at call time
+
+    stats: dict = {}
+    t0 = time.perf_counter()
+    hits = asyncio.run(scanner.run_scan(args, stats))
+    duration = time.perf_counter() - t0
+
+    latencies.sort()
+    return {
+        "duration_s": duration,
+        "hit_ports": sorted({h.port for h in hits}),
+        "probes": len(latencies),
+        "p50_ms": scanner.quantile(latencies, 0.50) * 1000.0,
+        "p99_ms": scanner.quantile(latencies, 0.99) * 1000.0,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,  # KiB on Linux
+    }
+
+
+@dataclass
+class Result:
+    concurrency: int
+    timeout: float
+    duration_s: float
+    ports_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    peak_rss_mib: float
+    probes: int
+    expected: int
+    found: int
+    false_negative_rate: float
+    false_positives: int
+
+
+def measure(layout: Layout, concurrency: int, timeout: float, extra: Sequence[str]) -> Result:
+    argv = [
+        "--range", f"{layout.start}-{layout.end}",
+        "--concurrency", str(concurrency),
+        "--timeout", str(timeout),
+        "--quiet",
+        *extra,
+    ]
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-one", json.dumps(argv)],
+        capture_output=True, text=True, check=True,
+    )
+    run = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    want = layout.expected(timeout)
+    got = set(run["hit_ports"])
+    total = layout.end - layout.start + 1
+    return Result(
+        concurrency=concurrency,
+        timeout=timeout,
+        duration_s=round(run["duration_s"], 3),
+        ports_per_sec=round(total / run["duration_s"], 1),
+        p50_ms=round(run["p50_ms"], 2),
+        p99_ms=round(run["p99_ms"], 2),
+        peak_rss_mib=round(run["peak_rss_mib"], 1),
+        probes=run["probes"],
+        expected=len(want),
+        found=len(want & got),
+        false_negative_rate=round(len(want - got) / len(want), 4) if want else 0.0,
+        false_positives=len(got - set(layout.ports)),
+    )
+
+
+# ----------------------------
+# Regression check
+# ----------------------------
+
+def compare(results: Sequence[Result], baseline: dict, tolerance: float) -> list[str]:
+    """Human-readable regressions against a baseline JSON (same settings only)."""
+    base = {(r["concurrency"], r["timeout"]): r for r in baseline.get("results", [])}
+    problems = []
+    for r in results:
+        b = base.get((r.concurrency, r.timeout))
+        if b is None:
+            continue
+        where = f"c={r.concurrency} t={r.timeout}"
+        if r.ports_per_sec < b["ports_per_sec"] * (1 - tolerance):
+            problems.append(f"{where}: ports/sec {b['ports_per_sec']} -> {r.ports_per_sec}")
+        if r.p99_ms > b["p99_ms"] * (1 + tolerance) and r.p99_ms - b["p99_ms"] > 1.0:
+            problems.append(f"{where}: p99 {b['p99_ms']}ms -> {r.p99_ms}ms")
+        if r.false_negative_rate > b["false_negative_rate"]:
+            problems.append(f"{where}: false negatives {b['false_negative_rate']} -> {r.false_negative_rate}")
+    return problems
+
+
+def parse_counts(raw: str) -> dict[str, int]:
+    counts: dict[str, int] = {}
+    for part in raw.split(","):
+        if not part.strip():
+            continue
+        kind, _, n = part.partition("=")
+        kind = kind.strip()
+        if kind not in BEHAVIORS or not n.strip().isdigit():
+            raise ValueError(f"bad layout entry {part!r} (kinds: {', '.join(BEHAVIORS)})")
+        counts[kind] = int(n)
+    return counts
+
+
+def parse_args(argv: Sequence[str]) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Benchmark the localhost scanner against local stand-in servers.")
+    ap.add_argument("--ports", default="20000-21999", help="Port window to scan (default: 20000-21999)")
+    ap.add_argument("--layout", default="http=40,https=10,latency=10,slow=5,reset=5,silent=5",
+                    help=f"Stand-in servers per kind ({', '.join(BEHAVIORS)}); the rest of the window is closed.")
+    ap.add_argument("--latency-ms", type=float, default=50.0, help="Delay before 'latency' servers answer (default: 50)")
+    ap.add_argument("--slow-chunk-ms", type=float, default=40.0,
+                    help="Gap between body chunks of 'slow' servers (default: 40)")
+    ap.add_argument("--concurrency", default="200,600", help="Comma list of --concurrency values (default: 200,600)")
+    ap.add_argument("--timeouts", default="0.2,0.5", help="Comma list of --timeout values (default: 0.2,0.5)")
+    ap.add_argument("--scanner-args", default="", help='Extra scanner flags for every run, e.g. "--schemes auto".')
+    ap.add_argument("--seed", type=int, default=1, help="Seed for where the stand-ins sit in the window (default: 1)")
+    ap.add_argument("--out", default=None, help="Write results JSON here.")
+    ap.add_argument("--baseline", default=None, help="Earlier results JSON; exit 1 if this run regressed.")
+    ap.add_argument("--tolerance", type=float, default=0.15,
+                    help="Allowed slowdown vs --baseline for ports/sec and p99 (default: 0.15)")
+    ap.add_argument("--run-one", default=None, help=argparse.SUPPRESS)
+    ns = ap.parse_args(argv)
+
+    if ns.run_one is None:
+        a, _, b = ns.ports.partition("-")
+        ns.start, ns.end = int(a), int(b or a)
+        try:
+            ns.counts = parse_counts(ns.layout)
+        except ValueError as e:
+            ap.error(str(e))
+        ns.concurrency = [int(x) for x in ns.concurrency.split(",") if x.strip()]
+        ns.timeouts = [float(x) for x in ns.timeouts.split(",") if x.strip()]
+    return ns
+
+
+def main() -> None:
+    args = parse_args(sys.argv[1:])
+
+    if args.run_one is not None:
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return
+
+    pem = make_cert() if args.counts.get("https") else None
+    if args.counts.get("https") and pem is None:
+        print("openssl not available: running without the https stand-ins", file=sys.stderr)
+        args.counts["https"] = 0
+    layout = make_layout(args.start, args.end, args.counts, args.latency_ms, args.slow_chunk_ms, args.seed)
+    layout.tls = pem
+    ctx = multiprocessing.get_context("spawn")
+    ready, stop = ctx.Event(), ctx.Event()
+    server = ctx.Process(target=_server_main, args=(layout, ready, stop), daemon=True)
+    server.start()
+    if not ready.wait(30):
+        sys.exit("stand-in servers didn't start")
+
+    extra = args.scanner_args.split()
+    results: list[Result] = []
+    try:
+        print(f"{'conc':>5} {'timeout':>7} {'ports/s':>9} {'p50 ms':>7} {'p99 ms':>8} {'RSS MiB':>8} {'FN rate':>7} {'FP':>3}")
+        for concurrency in args.concurrency:
+            for timeout in args.timeouts:
+                r = measure(layout, concurrency, timeout, extra)
+                results.append(r)
+                print(f"{r.concurrency:5d} {r.timeout:7.2f} {r.ports_per_sec:9,.0f} {r.p50_ms:7.2f} {r.p99_ms:8.2f} "
+                      f"{r.peak_rss_mib:8.1f} {r.false_negative_rate:7.2%} {r.false_positives:3d}")
+    finally:
+        stop.set()
+        server.join(5)
+
+    payload = {
+        "meta": {
+            "timestamp_unix": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "ports": f"{args.start}-{args.end}",
+            "layout": args.counts,
+            "latency_ms": args.latency_ms,
+            "slow_chunk_ms": args.slow_chunk_ms,
+            "scanner_args": extra,
+            "seed": args.seed,
+        },
+        "results": [asdict(r) for r in results],
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2)
+        print(f"\nWrote JSON: {args.out}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        if problems:
+            print("\nRegressions vs baseline:")
+            for p in problems:
+                print(f"  {p}")
+            sys.exit(1)
+        print("\nNo regressions vs baseline.")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,40 +6,113 @@ Fast, dependency-free (stdlib only) localhost port scanner for HTTP/HTTPS servic
 
 Features:
 - Interactive setup wizard (--interactive or no args)
-- Async scanner (efficient vs threads)
+- Async scanner (efficient vs threads): fixed worker pool over a lazy target iterator
+- Multiple hosts / CIDR blocks / host files, randomized (host, port) order, per-host caps
+- Priority order (past hits + common HTTP ports first) with --first N / --stop-when-match early exit
 - Live logging / progress in terminal (what it's doing right now)
 - Ignore status code classes (2xx/3xx/4xx) and/or specific codes
 - Match required content in response (substring or regex) in headers/body
-- Multiple paths to probe (e.g., /, /api/health, /healthz)
-- Output: pretty terminal + optional JSON/CSV
+- --where filter expressions (status/header/body/latency/port rules), compiled once into one predicate
+- Tag hits against many literal/regex patterns (literals found as chunks arrive, each regex compiled once)
+- Two-phase scan: cheap TCP connect sweep first, HTTP/HTTPS probing only on open ports
+  (--engine raw: the sweep runs on one selectors/epoll loop in a thread, no asyncio objects per port)
+- Multiple paths to probe (e.g., /, /api/health, /healthz), optionally over one keep-alive connection
+- Output: pretty terminal + optional JSON/CSV, or NDJSON/CSV streamed hit by hit
+- Shared TLS context with per-(host, port) session resumption; ALPN recorded per hit
+- Service identification (product/version) from an indexed signature DB, optional favicon hashes
+- Adaptive mode: AIMD concurrency window + RTT-derived timeouts
+- Connection pacing: client ports held/in TIME_WAIT kept under the ephemeral range, --max-rate cap,
+  failed probes closed with RST; socket errors counted by errno
+- Per-phase timing histograms (connect/TLS/TTFB/read) and outcome counts; Prometheus file or /metrics
+- --profile: event-loop lag percentiles, slow callbacks, optional cProfile/sampled flame-graph stacks
+- Persistent SQLite state: change reports and --incremental rescans
+- --record an mmap-able archive of raw responses; --replay it offline with new filters/tags
+- --workers N: shard the targets across N processes, each with its own event loop
+- Watch mode: rescan on a schedule in one process, emit NDJSON change events (stdout or Unix socket)
+- Library API: `async for hit in scan(ScanConfig(...))` inside your own event loop (no prints, no signal handlers)
 - QoL: presets (dev/common/full), exclusions, retries, max-bytes, scheme order
 
 Counts a port as “has content” if it speaks HTTP (any status) AND passes your filters.
+
+As a library (the file name has a space, so load it by path):
+    spec = importlib.util.spec_from_file_location("localhost_scanner", PATH)
+    mod = importlib.util.module_from_spec(spec); sys.modules[spec.name] = mod; spec.loader.exec_module(mod)
+    async for hit in mod.scan(mod.ScanConfig(ports="3000-9999")): ...
 """
 
 from __future__ import annotations
 
 import argparse
 import asyncio
+import base64
+import bisect
+import contextlib
+import cProfile
 import csv
+import errno
+import hashlib
+import heapq
+import html
+import ipaddress
 import json
+import mmap
+import multiprocessing
+import os
+import queue
+import random
 import re
+import selectors
 import signal
+import socket
+import sqlite3
+import ssl
+import struct
 import sys
+import threading
 import time
-from dataclasses import asdict, dataclass
-from typing import Iterable, Optional, Sequence, Tuple
+from collections import deque
+from itertools import chain, islice
+from dataclasses import asdict, dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, Optional, Sequence, Tuple
 
 
 @dataclass
 class Hit:
+    host: str
     port: int
-    scheme: str                 # "http" or "https"
+    scheme: str                 # "http" or "https" (detected when --schemes auto)
     path: str
     status: Optional[int]       # parsed HTTP status code
     reason: str                 # parsed reason phrase (best-effort)
     matched: bool               # whether content match requirement passed
     sample: str                 # short snippet of body (best-effort)
+    alpn: Optional[str] = None  # ALPN protocol negotiated over TLS (https only)
+    fingerprint: str = ""       # stable response fingerprint (see response_fingerprint)
+    tags: list[str] = field(default_factory=list)  # --tag / --builtin-tags patterns found in the response
+    product: Optional[str] = None     # identified service (see FingerprintDB)
+    version: Optional[str] = None     # its version, when the response gives one away
+    favicon_hash: Optional[int] = None  # Shodan-style favicon hash (--favicon)
+
+
+@dataclass
+class ProbeResult:
+    scheme: str
+    path: str
+    status: Optional[int]
+    reason: str
+    headers_text: str
+    snippet: str
+    alpn: Optional[str] = None
+    ttfb: Optional[float] = None    # seconds from request sent to first response byte
+    tags: Sequence[str] = ()
+    title: str = ""
+    body: bytes = b""               # body bytes as read (up to max_bytes)
+    ranged: bool = False            # answered a --shape auto ranged GET (see filter_status)
+
+    @property
+    def filter_status(self) -> Optional[int]:
+        """The status filters judge: a 206 to our own Range request counts as the 200 a plain GET gets."""
+        return 200 if self.ranged and self.status == 206 else self.status
 
 
 # ----------------------------
@@ -87,16 +160,141 @@ def status_ignored(
     return cls in ignore_classes
 
 
-def content_matches(
-    haystack: str,
-    match_substring: Optional[str],
-    match_regex: Optional[re.Pattern[str]],
-) -> bool:
-    if match_substring is not None:
-        return match_substring in haystack
-    if match_regex is not None:
-        return bool(match_regex.search(haystack))
-    return True  # no requirement => passes
+# Built-in --builtin-tags set: (tag, pattern, is_regex). Literals are case-sensitive.
+BUILTIN_TAGS: list[Tuple[str, str, bool]] = [
+    ("health-json", r'(?i)"status"\s*:\s*"(?:ok|up|healthy|pass)"', True),
+    ("admin-panel", r"(?i)<title>[^<]*\b(?:admin|dashboard|login|sign in)\b[^<]*</title>", True),
+    ("directory-listing", "Directory listing for", False),
+    ("express", "X-Powered-By: Express", False),
+    ("php", "X-Powered-By: PHP", False),
+    ("nextjs", "__NEXT_DATA__", False),
+    ("vite", "/@vite/client", False),
+    ("webpack-dev-server", "webpack-dev-server", False),
+    ("spring-boot", "Whitelabel Error Page", False),
+    ("django-debug", "DEBUG = True", False),
+    ("werkzeug-debugger", "Werkzeug Debugger", False),
+    ("jupyter", "jupyter", False),
+    ("grafana", "grafana", False),
+    ("prometheus", "Prometheus Time Series", False),
+    ("swagger-ui", "swagger-ui", False),
+    ("graphiql", "GraphiQL", False),
+]
+
+
+def parse_tag_spec(spec: str) -> Tuple[str, str, bool]:
+    """"name=literal" or "name~regex" -> (name, pattern, is_regex)."""
+    m = re.match(r"\s*([\w.-]+)\s*([=~])(.*)$", spec)
+    if not m or not m.group(3):
+        raise ValueError(f"bad tag spec {spec!r} (want name=literal or name~regex)")
+    return m.group(1), m.group(3), m.group(2) == "~"
+
+
+class PatternSet:
+    """
+    Named patterns compiled once per scan. Literals are searched chunk by chunk as
+    the response arrives (PatternScan); each regex is compiled on its own (like
+    --match-regex, so backreferences, named groups and global flags work) and
+    searched once over the final buffer, skipping tags another pattern already set.
+    """
+
+    def __init__(self, specs: Sequence[Tuple[str, str, bool]]):
+        self.names: list[str] = list(dict.fromkeys(name for name, _, _ in specs))
+        self.literals = [(name, pattern.encode("utf-8")) for name, pattern, is_regex in specs if not is_regex]
+        # bytes kept between chunks so a literal split across two reads still matches
+        self.overlap = max((len(lit) for _, lit in self.literals), default=1) - 1
+
+        self.regexes = [
+            (name, re.compile(pattern.encode("utf-8"))) for name, pattern, is_regex in specs if is_regex
+        ]
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def scan(self) -> "PatternScan":
+        return PatternScan(self)
+
+    def search(self, data: bytes) -> list[str]:
+        """Tags found in one complete buffer."""
+        sc = PatternScan(self)
+        sc.feed(data)
+        return sc.tags(data)
+
+    def regex_tags(self, data, found: Optional[set[str]] = None) -> set[str]:
+        """Tags of the regexes that occur in data; names already in found aren't searched again."""
+        found = found or set()
+        return {name for name, rx in self.regexes if name not in found and rx.search(data)}
+
+
+class PatternScan:
+    """
+    Literal matching state for one response. Each chunk is searched (with the tail
+    of the previous one) only for the literals not found yet, so the work shrinks
+    as tags are found. bytes.find per literal runs in C; a pure-Python automaton
+    walking the body byte by byte was about 20x slower for a few dozen patterns.
+    """
+
+    def __init__(self, patterns: PatternSet):
+        self.patterns = patterns
+        self.pending = list(patterns.literals)
+        self.found: set[str] = set()
+        self._tail = b""
+
+    def feed(self, chunk) -> None:
+        if not self.pending:
+            return
+        window = self._tail + bytes(chunk)
+        pending = []
+        for name, lit in self.pending:
+            if name in self.found:
+                continue
+            if lit in window:
+                self.found.add(name)
+            else:
+                pending.append((name, lit))
+        self.pending = pending
+        overlap = self.patterns.overlap
+        self._tail = window[-overlap:] if overlap else b""
+
+    @property
+    def complete(self) -> bool:
+        """Every tag already found: nothing more to learn from further data."""
+        return len(self.found) == len(self.patterns)
+
+    def tags(self, data) -> list[str]:
+        """Final tags, in the order they were declared; data is the whole buffer (for the regexes)."""
+        found = self.found
+        if not self.complete:
+            found = found | self.patterns.regex_tags(data, found)
+        return [n for n in self.patterns.names if n in found]
+
+
+def header_value(headers_text: str, name: str) -> str:
+    """First value of header `name` (case-insensitive) in a raw header block, or ""."""
+    prefix = name.lower() + ":"
+    for line in headers_text.split("\r\n")[1:]:
+        if line[: len(prefix)].lower() == prefix:
+            return line[len(prefix):].strip()
+    return ""
+
+
+_DIGITS_RE = re.compile(r"\d+")
+
+
+def response_fingerprint(status: Optional[int], headers_text: str, snippet: str) -> str:
+    """
+    Short hash of what identifies a service: status, Server, Content-Type and the body
+    snippet with digit runs blanked (so clocks/counters/ids don't read as changes).
+    """
+    h = hashlib.sha1()
+    for part in (
+        str(status),
+        header_value(headers_text, "server"),
+        header_value(headers_text, "content-type"),
+        _DIGITS_RE.sub("#", snippet),
+    ):
+        h.update(part.encode("utf-8", "replace"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
 
 
 def chunked_ranges_from_preset(preset: str) -> list[Tuple[int, int]]:
@@ -124,372 +322,4404 @@ def chunked_ranges_from_preset(preset: str) -> list[Tuple[int, int]]:
     return [(1, 65535)]
 
 
-def iter_ports(ranges: Sequence[Tuple[int, int]], exclude: set[int]) -> list[int]:
-    ports: list[int] = []
-    for a, b in ranges:
-        a = max(1, int(a))
-        b = min(65535, int(b))
-        if b < a:
-            a, b = b, a
-        for p in range(a, b + 1):
-            if p not in exclude:
-                ports.append(p)
-    return ports
+def _normalize_range(a: int, b: int) -> Tuple[int, int]:
+    a = max(1, int(a))
+    b = min(65535, int(b))
+    if b < a:
+        a, b = b, a
+    return a, b
+
+
+# ----------------------------
+# Filters: one compiled keep/drop predicate
+# ----------------------------
+
+_WHERE_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<cls>[1-5]xx)\b
+      | (?P<num>\d+(?:\.\d+)?)
+      | (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<op>==|!=|<=|>=|!~|\.\.|[<>~(),\[\]])
+      | (?P<name>[A-Za-z_][\w.-]*)
+    )""", re.VERBOSE)
+
+# Field -> Python expression over (host, port, r: ProbeResult) in the compiled predicate.
+_WHERE_FIELDS = {
+    "status": "r.filter_status",
+    "port": "port",
+    "host": "host",
+    "scheme": "r.scheme",
+    "path": "r.path",
+    "reason": "r.reason",
+    "body": "r.snippet",
+    "headers": "r.headers_text",
+    "alpn": "r.alpn",
+    "ttfb": "(r.ttfb * 1000.0 if r.ttfb is not None else None)",  # milliseconds
+    "tag": "r.tags",
+}
+_NUMERIC_FIELDS = {"status", "port", "ttfb"}
+
+WHERE_HELP = (
+    'Filter expression, e.g. \'status in 200..299 and header.server ~ "nginx"\'. '
+    "Fields: status port host scheme path reason body (snippet) headers alpn ttfb (ms) "
+    "tag header.NAME. Ops: == != < <= > >= ~ !~ (regex) in / not in (a..b, 2xx, (a, b, ...)). "
+    "Combine with and/or/not and parentheses."
+)
+
+
+def _tokenize_where(text: str) -> list[Tuple[str, object]]:
+    tokens: list[Tuple[str, object]] = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _WHERE_TOKEN_RE.match(text, pos)
+        if not m or m.end() == pos:
+            raise ValueError(f"unexpected input at {pos}: {text[pos:pos + 12]!r}")
+        pos = m.end()
+        kind = m.lastgroup
+        raw = m.group(kind)
+        if kind == "cls":
+            base = int(raw[0]) * 100
+            tokens.append(("range", (base, base + 99)))
+        elif kind == "num":
+            tokens.append(("num", float(raw) if "." in raw else int(raw)))
+        elif kind == "str":
+            tokens.append(("str", re.sub(r"\\(.)", r"\1", raw[1:-1])))
+        elif kind == "name" and raw.lower() in ("and", "or", "not", "in"):
+            tokens.append(("kw", raw.lower()))
+        else:
+            tokens.append((kind, raw))
+    return tokens
+
+
+class _WhereParser:
+    """
+    Recursive descent over the --where tokens into a small tuple AST:
+    ("and"|"or", a, b), ("not", a), ("cmp", field, op, value).
+    """
+
+    def __init__(self, text: str):
+        self.tokens = _tokenize_where(text)
+        self.i = 0
+
+    def peek(self, kind: str, value: object = None) -> bool:
+        if self.i >= len(self.tokens):
+            return False
+        k, v = self.tokens[self.i]
+        return k == kind and (value is None or v == value)
+
+    def take(self, kind: str, value: object = None) -> object:
+        if not self.peek(kind, value):
+            got = self.tokens[self.i][1] if self.i < len(self.tokens) else "end of expression"
+            raise ValueError(f"expected {value or kind}, got {got!r}")
+        self.i += 1
+        return self.tokens[self.i - 1][1]
+
+    def parse(self) -> tuple:
+        node = self.expr()
+        if self.i != len(self.tokens):
+            raise ValueError(f"unexpected {self.tokens[self.i][1]!r}")
+        return node
+
+    def expr(self) -> tuple:
+        node = self.conj()
+        while self.peek("kw", "or"):
+            self.i += 1
+            node = ("or", node, self.conj())
+        return node
+
+    def conj(self) -> tuple:
+        node = self.unary()
+        while self.peek("kw", "and"):
+            self.i += 1
+            node = ("and", node, self.unary())
+        return node
+
+    def unary(self) -> tuple:
+        if self.peek("kw", "not"):
+            self.i += 1
+            return ("not", self.unary())
+        if self.peek("op", "("):
+            self.i += 1
+            node = self.expr()
+            self.take("op", ")")
+            return node
+        return self.comparison()
+
+    def comparison(self) -> tuple:
+        field = str(self.take("name")).lower()
+        if field not in _WHERE_FIELDS and not field.startswith("header."):
+            raise ValueError(f"unknown field {field!r}")
+        if self.peek("kw", "not"):
+            self.i += 1
+            self.take("kw", "in")
+            op = "not in"
+        elif self.peek("kw", "in"):
+            self.i += 1
+            op = "in"
+        else:
+            op = str(self.take("op"))
+            if op not in ("==", "!=", "<", "<=", ">", ">=", "~", "!~"):
+                raise ValueError(f"unexpected {op!r} after {field}")
+
+        if op in ("in", "not in"):
+            value = self.collection()
+        elif self.peek("range"):
+            value = self.take("range")
+            op = {"==": "in", "!=": "not in"}.get(op, op)
+            if op not in ("in", "not in"):
+                raise ValueError(f"{op} can't take a status class")
+        else:
+            value = self.scalar()
+        return ("cmp", field, op, value)
+
+    def scalar(self) -> object:
+        if self.peek("num"):
+            return self.take("num")
+        return self.take("str")
+
+    def collection(self) -> object:
+        if self.peek("range"):
+            return self.take("range")
+        if self.peek("op", "(") or self.peek("op", "["):
+            close = ")" if self.take("op") == "(" else "]"
+            items = [self.scalar()]
+            while self.peek("op", ","):
+                self.i += 1
+                items.append(self.scalar())
+            self.take("op", close)
+            return frozenset(items)
+        low = self.take("num")
+        self.take("op", "..")
+        return (low, self.take("num"))
+
+
+def _header_dict(headers_text: str) -> dict[str, str]:
+    """Lowercased name -> first value, parsed once per result when --where looks at headers."""
+    headers: dict[str, str] = {}
+    for line in headers_text.split("\r\n")[1:]:
+        name, sep, value = line.partition(":")
+        if sep:
+            headers.setdefault(name.strip().lower(), value.strip())
+    return headers
+
+
+def _where_fields(node: tuple) -> set[str]:
+    if node[0] == "cmp":
+        return {node[1]}
+    return set().union(*(_where_fields(n) for n in node[1:]))
+
+
+def _where_conjuncts(node: tuple) -> list[tuple]:
+    if node[0] == "and":
+        return _where_conjuncts(node[1]) + _where_conjuncts(node[2])
+    return [node]
+
+
+class HitFilter:
+    """
+    Every keep/drop rule for a probe result (--ignore-status-*, --match-*, --where)
+    compiled once per scan into one Python function, so a hit costs one call no
+    matter how many rules there are. Rules that only look at the status are folded
+    into a 1000-entry table: the predicate starts with one index lookup, and
+    skips_status() lets the reader stop before the body when the status already
+    decides a drop.
+    """
+
+    def __init__(
+        self,
+        ignore_classes: Iterable[int] = (),
+        ignore_codes: Iterable[int] = (),
+        match_substring: Optional[str] = None,
+        match_regex: Optional[str] = None,
+        match_in_headers: bool = False,
+        where: Optional[str] = None,
+    ):
+        ignore_classes, ignore_codes = set(ignore_classes), set(ignore_codes)
+        self.status_ok = [not status_ignored(s, ignore_classes, ignore_codes) for s in range(1000)]
+        self._consts: dict[str, object] = {"_headers": _header_dict}
+        self._uses_headers = False
+
+        terms: list[str] = []
+        # whether any rule looks at the body snippet (--shape auto can skip the body otherwise)
+        self.reads_body = match_substring is not None or match_regex is not None
+        if where:
+            tree = _WhereParser(where).parse()
+            self.reads_body = self.reads_body or "body" in _where_fields(tree)
+            for node in _where_conjuncts(tree):
+                if _where_fields(node) == {"status"}:
+                    # status-only: evaluate for every code now, AND into the table
+                    test = self._function("status", self._emit(node, status_var="status"))
+                    self.status_ok = [ok and test(s) for s, ok in enumerate(self.status_ok)]
+                else:
+                    terms.append(self._emit(node))
+
+        if match_substring is not None or match_regex is not None:
+            if match_in_headers:
+                hay = '(r.headers_text + "\\n\\n" + r.snippet)'
+            else:
+                hay = "r.snippet"
+            if match_substring is not None:
+                terms.insert(0, f"({self._const(match_substring)} in {hay})")
+            else:
+                terms.insert(0, f"({self._const(re.compile(match_regex))}.search({hay}) is not None)")
+
+        self.prunes_status = not all(self.status_ok)
+        self._consts["_status_ok"] = self.status_ok
+        body = " and ".join(terms) or "True"
+        if self._uses_headers:
+            body = f"_headers(r.headers_text) if _status_ok[r.filter_status] else None\n    return h is not None and {body}"
+            self.accepts: Callable[[str, int, ProbeResult], bool] = self._function("host, port, r", body, "h = ")
+        else:
+            self.accepts = self._function("host, port, r", f"_status_ok[r.filter_status] and {body}")
+
+    def skips_status(self, status: int) -> bool:
+        return not self.status_ok[status]
+
+    def _const(self, value: object) -> str:
+        name = f"_c{len(self._consts)}"
+        self._consts[name] = value
+        return name
+
+    def _function(self, params: str, body: str, first: str = "return ") -> Callable:
+        ns = dict(self._consts)
+        exec(f"def _f({params}):\n    {first}{body}\n", ns)
+        return ns["_f"]
+
+    def _emit(self, node: tuple, status_var: str = "r.filter_status") -> str:
+        kind = node[0]
+        if kind in ("and", "or"):
+            return f"({self._emit(node[1], status_var)} {kind} {self._emit(node[2], status_var)})"
+        if kind == "not":
+            return f"(not {self._emit(node[1], status_var)})"
+
+        _, field, op, value = node
+        numeric = field in _NUMERIC_FIELDS
+        if field.startswith("header."):
+            self._uses_headers = True
+            expr = f"h.get({self._const(field[7:])}, \"\")"
+        elif field == "status":
+            expr = status_var
+        else:
+            expr = _WHERE_FIELDS[field]
+
+        if isinstance(value, tuple) or (isinstance(value, frozenset) and all(isinstance(v, (int, float)) for v in value)):
+            if not numeric:
+                raise ValueError(f"{field} is text; compare it to strings")
+        elif isinstance(value, (int, float)) and not numeric:
+            raise ValueError(f"{field} is text; compare it to a string")
+        elif isinstance(value, str) and numeric and op not in ("~", "!~"):
+            raise ValueError(f"{field} is a number; compare it to numbers")
+
+        if field == "tag":
+            if op in ("==", "!="):
+                test = f"({self._const(value)} in {expr})"
+            elif op in ("in", "not in"):
+                test = f"(not {self._const(value)}.isdisjoint({expr}))"
+            elif op in ("~", "!~"):
+                rx = self._const(re.compile(str(value)))
+                test = f"any({rx}.search(t) for t in {expr})"
+            else:
+                raise ValueError(f"tag doesn't support {op}")
+            return f"(not {test})" if op in ("!=", "not in", "!~") else test
+
+        if op in ("~", "!~"):
+            rx = self._const(re.compile(str(value)))
+            subject = f"str({expr})" if numeric else expr
+            test = f"({expr} is not None and {rx}.search({subject}) is not None)"
+            return f"(not {test})" if op == "!~" else test
+        if op in ("in", "not in"):
+            if isinstance(value, tuple):
+                low, high = value
+                test = f"({expr} is not None and {low!r} <= {expr} <= {high!r})"
+            else:
+                test = f"({expr} in {self._const(value)})"
+            return f"(not {test})" if op == "not in" else test
+        if op in ("==", "!="):
+            return f"({expr} {op} {self._const(value)})"
+        return f"({expr} is not None and {expr} {op} {value!r})"
+
+
+# ----------------------------
+# Service fingerprints
+# ----------------------------
+
+# Signature schema (also the --signatures JSON format): every field given must match.
+#   product   name reported on the hit
+#   server    regex on the Server header; a (?P<version>...) group becomes the version
+#   headers   {header name: regex}; a header that must merely exist can use ""
+#   title     regex on the HTML <title>
+#   body      literal markers that must all occur in the body read
+#   version   regex on the body for the version, when no matching field captured one
+#   favicon   Shodan-style favicon hashes (mmh3 of base64); a hash match alone identifies
+BUILTIN_SIGNATURES: list[dict] = [
+    {"product": "Vite dev server", "body": ["/@vite/client"]},
+    {"product": "Next.js dev server", "body": ["/_next/static/", "webpack"], "headers": {"x-powered-by": r"Next\.js"}},
+    {"product": "Next.js", "headers": {"x-powered-by": r"Next\.js"}},
+    {"product": "Next.js", "body": ["__NEXT_DATA__"]},
+    {"product": "webpack-dev-server", "body": ["webpack-dev-server"]},
+    {"product": "Create React App dev server", "body": ["You need to enable JavaScript to run this app.", "/static/js/bundle.js"]},
+    {"product": "Angular dev server", "body": ["<app-root>", "ng-version"]},
+    {"product": "Storybook", "title": r"(?i)storybook"},
+    {"product": "Jupyter", "title": r"(?i)jupyter"},
+    {"product": "Jupyter", "body": ["jupyter-config-data"]},
+    {"product": "Grafana", "title": r"(?i)grafana", "version": r'"version"\s*:\s*"(?P<version>\d+\.\d+[\w.-]*)"'},
+    {"product": "Grafana", "body": ["grafanaBootData"], "version": r'"version"\s*:\s*"(?P<version>\d+\.\d+[\w.-]*)"'},
+    {"product": "Prometheus", "title": r"Prometheus Time Series Collection"},
+    {"product": "Prometheus exporter", "body": ["# HELP ", "# TYPE "]},
+    {"product": "Kibana", "headers": {"kbn-version": r"(?P<version>[\d.]+)"}},
+    {"product": "Elasticsearch", "body": ["You Know, for Search"], "version": r'"number"\s*:\s*"(?P<version>[\d.]+)"'},
+    {"product": "CouchDB", "server": r"CouchDB/(?P<version>[\d.]+)"},
+    {"product": "RabbitMQ management", "title": r"RabbitMQ Management"},
+    {"product": "MinIO", "server": r"MinIO"},
+    {"product": "Docker registry", "headers": {"docker-distribution-api-version": ""}},
+    {"product": "PostgREST", "server": r"postgrest/(?P<version>[\d.]+)"},
+    {"product": "pgAdmin", "title": r"pgAdmin"},
+    {"product": "Postgres error page", "body": ["PostgreSQL"], "title": r"(?i)error"},
+    {"product": "Hasura", "headers": {"x-hasura-role": ""}},
+    {"product": "Ollama", "body": ["Ollama is running"]},
+    {"product": "Spring Boot", "body": ["Whitelabel Error Page"]},
+    {"product": "Django (DEBUG)", "body": ["DEBUG = True"]},
+    {"product": "Werkzeug debugger", "body": ["Werkzeug Debugger"]},
+    {"product": "Werkzeug", "server": r"Werkzeug/(?P<version>[\d.]+)"},
+    {"product": "Express", "headers": {"x-powered-by": r"^Express"}},
+    {"product": "PHP", "headers": {"x-powered-by": r"PHP/(?P<version>[\d.]+)"}},
+    {"product": "Python http.server", "server": r"SimpleHTTP/[\d.]+ Python/(?P<version>[\d.]+)"},
+    {"product": "uvicorn", "server": r"uvicorn"},
+    {"product": "gunicorn", "server": r"gunicorn(?:/(?P<version>[\d.]+))?"},
+    {"product": "Tornado", "server": r"TornadoServer/(?P<version>[\d.]+)"},
+    {"product": "nginx", "server": r"nginx(?:/(?P<version>[\d.]+))?"},
+    {"product": "Apache httpd", "server": r"Apache(?:/(?P<version>[\d.]+))?"},
+    {"product": "Caddy", "server": r"Caddy"},
+    {"product": "Jetty", "server": r"Jetty\((?P<version>[^)]+)\)"},
+    {"product": "Kestrel", "server": r"Kestrel"},
+    {"product": "Microsoft IIS", "server": r"Microsoft-IIS/(?P<version>[\d.]+)"},
+    {"product": "lighttpd", "server": r"lighttpd/(?P<version>[\d.]+)"},
+]
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_TOKEN_START_RE = re.compile(r"[A-Za-z][A-Za-z0-9_-]*")
+_TITLE_RE = re.compile(r"<title[^>]*>(.*?)</title", re.IGNORECASE | re.DOTALL)
+
+
+def _leading_literal(pattern: str) -> str:
+    """First literal word of a regex (after inline flags / ^), lowercased, or "" if it starts with syntax."""
+    pattern = re.sub(r"^(?:\(\?[aiLmsux]+\))?\^?", "", pattern)
+    m = _TOKEN_START_RE.match(pattern)
+    if not m:
+        return ""
+    word = m.group(0)
+    # a quantifier or group right after the word means the literal may be shorter
+    nxt = pattern[m.end():m.end() + 1]
+    if nxt in ("?", "*", "{", "|"):
+        word = word[:-1]
+    return word.lower()
+
+
+def server_token(server: str) -> str:
+    m = _TOKEN_START_RE.match(server.strip())
+    return m.group(0).lower() if m else ""
+
+
+def html_title(body: bytes) -> str:
+    m = _TITLE_RE.search(body.decode("utf-8", "replace"))
+    return " ".join(html.unescape(m.group(1)).split())[:200] if m else ""
+
+
+def murmur3_32(data: bytes, seed: int = 0) -> int:
+    """MurmurHash3 x86 32-bit, signed like the mmh3 package (what favicon hashes use)."""
+    c1, c2 = 0xCC9E2D51, 0x1B873593
+    h = seed & 0xFFFFFFFF
+    n = len(data) & ~3
+    for (k,) in struct.iter_unpack("<I", data[:n]):
+        k = (k * c1) & 0xFFFFFFFF
+        k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+        k = (k * c2) & 0xFFFFFFFF
+        h ^= k
+        h = ((h << 13) | (h >> 19)) & 0xFFFFFFFF
+        h = (h * 5 + 0xE6546B64) & 0xFFFFFFFF
+    tail = data[n:]
+    if tail:
+        k = int.from_bytes(tail, "little")
+        k = (k * c1) & 0xFFFFFFFF
+        k = ((k << 15) | (k >> 17)) & 0xFFFFFFFF
+        h ^= (k * c2) & 0xFFFFFFFF
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & 0xFFFFFFFF
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & 0xFFFFFFFF
+    h ^= h >> 16
+    return h - (1 << 32) if h & 0x80000000 else h
+
+
+def favicon_hash(data: bytes) -> int:
+    """Shodan's http.favicon.hash: mmh3 over the base64 text with its 76-column newlines."""
+    return murmur3_32(base64.encodebytes(data))
+
+
+@dataclass
+class Signature:
+    product: str
+    server: Optional[re.Pattern[str]] = None
+    headers: dict[str, Optional[re.Pattern[str]]] = field(default_factory=dict)
+    title: Optional[re.Pattern[str]] = None
+    body: Sequence[bytes] = ()
+    version: Optional[re.Pattern[bytes]] = None
+    favicon: frozenset[int] = frozenset()
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Signature":
+        if not d.get("product"):
+            raise ValueError(f"signature without a product: {d!r}")
+        return cls(
+            product=d["product"],
+            server=re.compile(d["server"]) if d.get("server") else None,
+            headers={k.lower(): re.compile(v) if v else None for k, v in (d.get("headers") or {}).items()},
+            title=re.compile(d["title"]) if d.get("title") else None,
+            body=tuple(m.encode("utf-8") for m in d.get("body") or ()),
+            version=re.compile(d["version"].encode("utf-8")) if d.get("version") else None,
+            favicon=frozenset(int(x) for x in d.get("favicon") or ()),
+        )
+
+    def match(self, headers: dict[str, str], title: str, body: bytes, favicon: Optional[int]) -> Optional[str]:
+        """The version ("" if unknown) when the response matches, else None."""
+        if favicon is not None and favicon in self.favicon:
+            return self._body_version(body)
+        if self.server is None and not self.headers and self.title is None and not self.body:
+            return None
+
+        version = ""
+        checks = [(self.server, headers.get("server"))]
+        for name, rx in self.headers.items():
+            if name not in headers:
+                return None
+            checks.append((rx, headers[name]))
+        checks.append((self.title, title))
+        for rx, value in checks:
+            if rx is None:
+                continue
+            m = rx.search(value) if value is not None else None
+            if m is None:
+                return None
+            version = version or (m.groupdict().get("version") or "")
+        if not all(marker in body for marker in self.body):
+            return None
+        return version or self._body_version(body)
+
+    def _body_version(self, body: bytes) -> str:
+        if self.version is None:
+            return ""
+        m = self.version.search(body)
+        if m is None:
+            return ""
+        v = m.groupdict().get("version") or (m.group(1) if m.groups() else m.group(0))
+        return v.decode("utf-8", "replace")
+
+
+class FingerprintDB:
+    """
+    Signatures indexed by their cheapest distinguishing feature: Server token,
+    a required header name, a title word (prefix), a favicon hash, or (last
+    resort) their longest body marker. identify() only runs the signatures whose key the response
+    carries, so the cost per hit stays flat as signatures are added; body-keyed
+    ones cost one bytes search each.
+    """
+
+    def __init__(self, signatures: Sequence[Signature]):
+        self.signatures = list(signatures)
+        self.by_server: dict[str, list[int]] = {}
+        self.by_header: dict[str, list[int]] = {}
+        self.by_title: dict[str, list[int]] = {}
+        self.by_favicon: dict[int, list[int]] = {}
+        self.by_marker: dict[bytes, list[int]] = {}
+        self.unindexed: list[int] = []
+        for i, sig in enumerate(self.signatures):
+            for h in sig.favicon:
+                self.by_favicon.setdefault(h, []).append(i)
+            token = _leading_literal(sig.server.pattern) if sig.server else ""
+            word = _leading_literal(sig.title.pattern) if sig.title else ""
+            if token:
+                self.by_server.setdefault(token, []).append(i)
+            elif sig.headers:
+                self.by_header.setdefault(next(iter(sig.headers)), []).append(i)
+            elif word:
+                self.by_title.setdefault(word, []).append(i)
+            elif sig.body:
+                self.by_marker.setdefault(max(sig.body, key=len), []).append(i)
+            elif not sig.favicon:
+                self.unindexed.append(i)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, builtin: bool = True) -> "FingerprintDB":
+        specs = list(BUILTIN_SIGNATURES) if builtin else []
+        if path:
+            with open(path, encoding="utf-8") as f:
+                specs = json.load(f) + specs  # user signatures win ties
+        return cls([Signature.from_dict(d) for d in specs])
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def identify(
+        self, headers_text: str, title: str, body: bytes, favicon: Optional[int] = None
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """(product, version) of the first matching signature in declaration order, or (None, None)."""
+        headers = _header_dict(headers_text)
+        candidates = set(self.unindexed)
+        candidates.update(self.by_server.get(server_token(headers.get("server", "")), ()))
+        for name in headers:
+            candidates.update(self.by_header.get(name, ()))
+        if title and self.by_title:
+            # keys are the first literal word of the title regex; it may be a prefix ("jupyter" in "JupyterLab")
+            for word in set(_WORD_RE.findall(title.lower())):
+                for n in range(1, len(word) + 1):
+                    candidates.update(self.by_title.get(word[:n], ()))
+        if favicon is not None:
+            candidates.update(self.by_favicon.get(favicon, ()))
+        for marker, ids in self.by_marker.items():
+            if marker in body:
+                candidates.update(ids)
+
+        for i in sorted(candidates):
+            version = self.signatures[i].match(headers, title, body, favicon)
+            if version is not None:
+                return self.signatures[i].product, version or None
+        return None, None
+
+
+# ----------------------------
+# Targets: hosts x ports, lazily
+# ----------------------------
+
+class PortSpace:
+    """Ports from ranges minus exclusions, indexable and iterable without materializing them."""
+
+    def __init__(self, ranges: Sequence[Tuple[int, int]], exclude: set[int]):
+        self.segments: list[Tuple[int, int]] = []
+        for a, b in ranges:
+            a, b = _normalize_range(a, b)
+            start = a
+            for x in sorted(p for p in exclude if a <= p <= b):
+                if x > start:
+                    self.segments.append((start, x - 1))
+                start = x + 1
+            if start <= b:
+                self.segments.append((start, b))
+
+        self.offsets: list[int] = []
+        self.size = 0
+        for a, b in self.segments:
+            self.offsets.append(self.size)
+            self.size += b - a + 1
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> int:
+        j = bisect.bisect_right(self.offsets, i) - 1
+        return self.segments[j][0] + (i - self.offsets[j])
+
+    def __contains__(self, port: int) -> bool:
+        return any(a <= port <= b for a, b in self.segments)
+
+    def __iter__(self) -> Iterator[int]:
+        for a, b in self.segments:
+            yield from range(a, b + 1)
+
+
+class HostSpace:
+    """
+    Hosts from names, IP literals and CIDR blocks, indexable without expanding the
+    blocks. IPv4 networks wider than /31 skip their network and broadcast addresses.
+    Repeats are dropped: blocks nested in another listed block, and single hosts
+    that a listed block already covers.
+    """
+
+    def __init__(self, specs: Sequence[str]):
+        # (first index, count, network or None, single host or None)
+        self.items: list[Tuple[int, int, Optional[ipaddress._BaseNetwork], Optional[str]]] = []
+        self.offsets: list[int] = []
+        self.size = 0
+
+        names: dict[str, None] = {}
+        nets: dict[ipaddress._BaseNetwork, None] = {}
+        for spec in specs:
+            try:
+                net = ipaddress.ip_network(spec, strict=False)
+            except ValueError:
+                names[spec] = None
+                continue
+            if net.num_addresses == 1:
+                names[str(net.network_address)] = None
+            else:
+                nets[net] = None
+
+        blocks = [
+            n for n in nets
+            if not any(o != n and o.version == n.version and n.subnet_of(o) for o in nets)
+        ]
+        for net in blocks:
+            if net.version == 4 and net.prefixlen < 31:
+                self._add((1, net.num_addresses - 2, net, None))
+            else:
+                self._add((0, net.num_addresses, net, None))
+        covered = self.__contains__
+        for name in names:
+            if not covered(name):
+                self._add((0, 1, None, name))
+
+    def _add(self, item) -> None:
+        self.items.append(item)
+        self.offsets.append(self.size)
+        self.size += item[1]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> str:
+        j = bisect.bisect_right(self.offsets, i) - 1
+        first, _, net, host = self.items[j]
+        if net is None:
+            return host
+        return str(net[first + i - self.offsets[j]])
+
+    def __contains__(self, host: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            ip = None
+        for first, count, net, single in self.items:
+            if net is None:
+                if host == single:
+                    return True
+            elif ip is not None and ip in net:
+                idx = int(ip) - int(net.network_address)
+                if first <= idx < first + count:
+                    return True
+        return False
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(self.size):
+            yield self[i]
+
+
+def cyclic_permutation(n: int, seed: Optional[int] = None) -> Iterator[int]:
+    """
+    Every integer in [0, n) exactly once, in scrambled order, with O(1) memory:
+    a full-period LCG over the next power of two (c odd, a = 1 mod 4), skipping
+    values >= n, which costs less than 2x steps.
+    """
+    if n <= 0:
+        return
+    m = 1
+    while m < n:
+        m <<= 1
+    rng = random.Random(seed)
+    a = (rng.randrange(m) & ~3) | 1
+    c = rng.randrange(m) | 1
+    x = rng.randrange(m)
+    mask = m - 1
+    for _ in range(m):
+        x = (a * x + c) & mask
+        if x < n:
+            yield x
+
+
+# --order priority: ports that most often serve HTTP, most common first (web defaults,
+# dev servers and frameworks, then admin UIs, dashboards and infrastructure APIs).
+COMMON_PORTS = (
+    80, 443, 8080, 3000, 8000, 5000, 8443, 8888, 5173, 4200, 3001, 8081, 9000, 9090, 8001, 5001,
+    8008, 4000, 7000, 8082, 8090, 3002, 3003, 4173, 5174, 8501, 7860, 11434, 6006, 5500, 5050, 4040,
+    1313, 4321, 8088, 8089, 9443, 10000, 9001, 8002, 8003, 8010, 8085, 8181, 8880, 8800, 81, 9200,
+    5601, 15672, 8500, 8200, 6443, 2375, 2376, 9100, 9093, 3100, 16686, 9411, 8086, 5984, 7474, 8983,
+    8161, 4444, 19999, 8123, 2368, 8069, 3030, 3333, 4567, 5555, 6060, 7070, 7777, 8099, 8444, 8765,
+    9091, 9191, 9292, 9999, 18080, 8180, 8280, 9080, 7001, 8843, 4443, 10443, 1337, 24678, 50070, 591,
+)
+
+
+class TargetSpace:
+    """
+    The (host, port) cross product. Index i maps to host i % H and port i // H, so
+    consecutive indices hit different hosts: load is spread across hosts even in
+    sequential order, and a single host keeps today's ascending port order.
+    """
+
+    def __init__(self, hosts: HostSpace, ports: PortSpace):
+        self.hosts = hosts
+        self.ports = ports
+
+    def __len__(self) -> int:
+        return len(self.hosts) * len(self.ports)
+
+    def __getitem__(self, i: int) -> Tuple[str, int]:
+        h = len(self.hosts)
+        return self.hosts[i % h], self.ports[i // h]
+
+    def __contains__(self, target: Tuple[str, int]) -> bool:
+        host, port = target
+        return port in self.ports and host in self.hosts
+
+    def iter(
+        self,
+        order: str = "sequential",
+        seed: Optional[int] = None,
+        history: Optional[dict[str, dict[int, int]]] = None,
+    ) -> Iterator[Tuple[str, int]]:
+        if order == "priority":
+            yield from self._priority(history or {})
+            return
+        indices = cyclic_permutation(len(self), seed) if order == "random" else range(len(self))
+        for i in indices:
+            yield self[i]
+
+    def _priority(self, history: dict[str, dict[int, int]]) -> Iterator[Tuple[str, int]]:
+        """
+        Each host's own past hit ports (most hits first), then COMMON_PORTS, round-robin
+        over hosts one rank at a time; then every other target in sequential order.
+        """
+        common = [p for p in COMMON_PORTS if p in self.ports]
+        common_set = set(common)
+        own = {
+            h: [p for p, _ in sorted(ports.items(), key=lambda x: (-x[1], x[0])) if p in self.ports]
+            for h, ports in history.items() if h in self.hosts
+        }
+        own_sets = {h: set(v) for h, v in own.items()}
+        longest = max((len(v) for v in own.values()), default=0)
+        for rank in range(longest + len(common)):
+            for host in self.hosts:
+                mine = own.get(host, ())
+                if rank < len(mine):
+                    yield host, mine[rank]
+                elif rank - len(mine) < len(common):
+                    port = common[rank - len(mine)]
+                    if port not in own_sets.get(host, ()):
+                        yield host, port
+        for host, port in self.iter("sequential"):
+            if port not in common_set and port not in own_sets.get(host, ()):
+                yield host, port
+
+
+def parse_targets(raw: str) -> list[str]:
+    """
+    Comma-separated hosts, IPs and CIDR blocks; "@path" reads more of the same from
+    a file (one or more per line, "#" comments allowed).
+    """
+    specs: list[str] = []
+    for part in raw.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if part.startswith("@"):
+            with open(part[1:], encoding="utf-8") as f:
+                for line in f:
+                    line = line.split("#", 1)[0]
+                    specs.extend(x for x in re.split(r"[\s,]+", line) if x)
+        else:
+            specs.append(part)
+    return specs
+
+
+def host_sort_key(host: str) -> Tuple:
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return (1, 0, host)
+    return (0, ip.version, int(ip))
+
+
+class HostLimiter:
+    """Per-host cap on concurrent connects/probes on top of the global limit; idle hosts cost nothing."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._hosts: dict[str, list] = {}  # host -> [Semaphore, users]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str):
+        if self.limit <= 0:
+            yield
+            return
+        entry = self._hosts.get(host)
+        if entry is None:
+            entry = self._hosts[host] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._hosts[host]
+
+
+# ----------------------------
+# Connection pacing: local ports + token bucket
+# ----------------------------
+
+# Linux keeps an actively closed connection in TIME_WAIT for 60s (TCP_TIMEWAIT_LEN).
+TIME_WAIT_SECONDS = 60.0
+_RST_LINGER = struct.pack("ii", 1, 0)
+
+
+def ephemeral_port_range() -> Tuple[int, int]:
+    """The OS client port range (Linux /proc; elsewhere the IANA default 49152-65535)."""
+    try:
+        with open("/proc/sys/net/ipv4/ip_local_port_range") as f:
+            lo, hi = (int(x) for x in f.read().split())
+        return lo, hi
+    except (OSError, ValueError):
+        return 49152, 65535
+
+
+def set_rst_close(sock) -> None:
+    """SO_LINGER 0: close() sends RST and leaves no TIME_WAIT entry behind."""
+    with contextlib.suppress(OSError):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, _RST_LINGER)
+
+
+class ConnectPacer:
+    """
+    Paces outgoing connects so a scan can't run the box out of client ports.
+
+    Ports held = connections open now + our graceful closes younger than
+    TIME_WAIT_SECONDS (the side that closes first keeps its port in TIME_WAIT).
+    acquire() waits while that would pass `share` of the ephemeral range and, with
+    max_rate > 0, for a token from a bucket refilled at max_rate/s (burst: one second's
+    worth). Failed probes and sweep connects are closed with RST, which holds nothing
+    afterwards: release(graceful=False).
+    """
+
+    def __init__(self, max_rate: float = 0.0, share: float = 0.8):
+        lo, hi = ephemeral_port_range()
+        self.port_range = (lo, hi)
+        self.limit = max(64, int((hi - lo + 1) * share))
+        self.rate = max_rate
+        self.capacity = max(1.0, max_rate)
+        self.tokens = self.capacity
+        self.stamp = time.monotonic()
+        self._lock = threading.Lock()  # the --engine raw sweep thread takes tokens too
+
+        self.open = 0
+        self.time_wait: deque[float] = deque()
+        self.peak_held = 0
+        self.waits = 0
+        self.waited = 0.0
+        self.graceful = 0
+        self.aborted = 0
+
+    def take(self) -> float:
+        """Take a token and return 0.0, or return the seconds until one is due (nothing taken)."""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1.0:
+                self.tokens -= 1.0
+                return 0.0
+            return (1.0 - self.tokens) / self.rate
+
+    def room(self) -> float:
+        """0.0 if one more port can be held now, else the seconds to wait before asking again."""
+        now = time.monotonic()
+        while self.time_wait and now - self.time_wait[0] >= TIME_WAIT_SECONDS:
+            self.time_wait.popleft()
+        if self.open + len(self.time_wait) < self.limit:
+            return 0.0
+        if self.time_wait:
+            return TIME_WAIT_SECONDS - (now - self.time_wait[0])
+        return 0.05  # every held port is an open connection: poll until one closes
+
+    async def acquire(self) -> None:
+        t0 = None
+        while True:
+            wait = self.room() or self.take()
+            if not wait:
+                break
+            if t0 is None:
+                t0 = time.perf_counter()
+                self.waits += 1
+            await asyncio.sleep(wait)
+        if t0 is not None:
+            self.waited += time.perf_counter() - t0
+        self.open += 1
+        self.peak_held = max(self.peak_held, self.open + len(self.time_wait))
+
+    def release(self, graceful: bool) -> None:
+        self.open -= 1
+        if graceful:
+            self.graceful += 1
+            self.time_wait.append(time.monotonic())
+        else:
+            self.aborted += 1
+
+    def summary(self) -> dict:
+        return {
+            "ephemeral_ports": f"{self.port_range[0]}-{self.port_range[1]}",
+            "port_limit": self.limit,
+            "max_rate": self.rate,
+            "peak_held": self.peak_held,
+            "waits": self.waits,
+            "waited_seconds": self.waited,
+            "graceful_closes": self.graceful,
+            "rst_closes": self.aborted,
+        }
+
+
+# ----------------------------
+# Networking: async probe
+# ----------------------------
+
+def resolve_host(host: str) -> list[Tuple[int, str]]:
+    """
+    Resolve host once per scan -> [(family, ip), ...] (deduplicated, resolver order).
+    Falls back to the raw host string so an unresolvable name just yields no open ports.
+    """
+    try:
+        infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    except OSError:
+        return [(socket.AF_INET, host)]
+    addrs: list[Tuple[int, str]] = []
+    for family, _, _, _, sockaddr in infos:
+        item = (family, sockaddr[0])
+        if item not in addrs:
+            addrs.append(item)
+    return addrs
+
+
+# Failures that say "we are overloaded", not "the port is closed".
+_LOCAL_RESOURCE_ERRNOS = {errno.EMFILE, errno.ENFILE, errno.EADDRNOTAVAIL, errno.ENOBUFS, errno.EAGAIN}
+
+
+async def tcp_alive(
+    addrs: Sequence[Tuple[int, str]],
+    port: int,
+    timeout: float,
+    pacer: Optional[ConnectPacer] = None,
+    metrics: Optional[ProbeMetrics] = None,
+) -> str:
+    """
+    Phase-1 liveness check: bare non-blocking TCP connect (no streams, no TLS, no request).
+    Returns "open", "closed" (refused/unreachable), "timeout", or "error" when the
+    local side ran out of resources (fds, ephemeral ports, buffers).
+    Open connections are closed with RST, so the sweep leaves no TIME_WAIT behind.
+    """
+    loop = asyncio.get_running_loop()
+    result = "closed"
+    for family, ip in addrs:
+        if pacer:
+            await pacer.acquire()
+        sock = None
+        try:
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout=timeout)
+            return "open"
+        except asyncio.TimeoutError:
+            result = "timeout"
+        except OSError as e:
+            if e.errno in _LOCAL_RESOURCE_ERRNOS:
+                result = "error"
+            if metrics and e.errno:
+                metrics.socket_error(e.errno)
+        finally:
+            if sock is not None:
+                set_rst_close(sock)
+                sock.close()
+            if pacer:
+                pacer.release(graceful=False)
+    return result
+
+
+def build_request(host: str, port: int, path: str, keep_alive: bool = False, shape: str = "get") -> bytes:
+    """shape: "get", "head" (HEAD, no body) or "range" (GET of the first SHAPE_RANGE_BYTES of the body)."""
+    return (
+        f"{'HEAD' if shape == 'head' else 'GET'} {path} HTTP/1.1\r\n"
+        f"Host: {host}:{port}\r\n"
+        f"User-Agent: localhost-port-scanner/2.0\r\n"
+        f"Accept: */*\r\n"
+        + (f"Range: bytes=0-{SHAPE_RANGE_BYTES - 1}\r\n" if shape == "range" else "")
+        + f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+    ).encode("utf-8", "ignore")
+
+
+# summarize_response() keeps this many characters of whitespace-collapsed body.
+_SNIPPET_CHARS = 160
+
+
+class ResponseBuffer:
+    """
+    One growing bytearray per probe, parsed as it fills: the status line is checked
+    from the first bytes, headers as soon as the blank line arrives. feed() returns
+    True once more data can't change the probe result: not HTTP, a status the
+    filters drop, the body complete per Content-Length, or enough body for the
+    snippet (which is all content matching and the fingerprint look at). With
+    patterns, the snippet isn't enough: reading goes on until every tag is found
+    or the body ends. full_body (the favicon fetch) always reads to the body's end.
+    no_body (a HEAD request, or nothing looks past the headers) stops at the end of
+    the headers; body bytes that arrived with them still make the snippet.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        skip_status: Optional[Callable[[int], bool]] = None,
+        patterns: Optional[PatternSet] = None,
+        full_body: bool = False,
+        no_body: bool = False,
+    ):
+        self.buf = bytearray()
+        self.full_body = full_body
+        self.no_body = no_body
+        self.scan = patterns.scan() if patterns else None
+        self.max_bytes = max_bytes
+        self.skip_status = skip_status
+        self.status: Optional[int] = None
+        self.reason = ""
+        self.body_start = -1
+        self.content_length: Optional[int] = None
+        self._scanned = 0  # where the next search for the blank line starts
+
+    def room(self) -> int:
+        return max(1, self.max_bytes - len(self.buf))
+
+    def feed(self, chunk: bytes) -> bool:
+        self.buf += chunk
+        if self.scan is not None:
+            self.scan.feed(chunk)
+        if len(self.buf) >= self.max_bytes:
+            return True
+
+        if self.body_start < 0:
+            start = self.buf[:16].lstrip()
+            if len(start) >= 5 and start[:5].upper() != b"HTTP/":
+                return True  # not HTTP; parts() reports status None
+            i = self.buf.find(b"\r\n\r\n", max(0, self._scanned - 3))
+            if i < 0:
+                self._scanned = len(self.buf)
+                return False
+            self.body_start = i + 4
+            self.status, self.reason, head, _ = parse_http_response(bytes(memoryview(self.buf)[:i]))
+            if self.status is None:
+                return True
+            if self.no_body or (self.skip_status is not None and self.skip_status(self.status)):
+                return True
+            length = header_value(head.decode("latin-1", "replace"), "content-length")
+            if length.isdigit():
+                self.content_length = int(length)
+
+        body = memoryview(self.buf)[self.body_start:]
+        if self.content_length is not None and len(body) >= self.content_length:
+            return True
+        if self.full_body or (self.scan is not None and not self.scan.complete):
+            return False
+        # a few extra characters so a split UTF-8 sequence or word at the cut can't change the snippet
+        text = bytes(body[: 4 * _SNIPPET_CHARS]).decode("utf-8", "replace")
+        return len(" ".join(text.split())) >= _SNIPPET_CHARS + 4
+
+    def parts(self) -> Tuple[Optional[int], str, bytes, bytes]:
+        """(status, reason, headers_bytes, body_bytes) like parse_http_response()."""
+        if self.body_start < 0:
+            return parse_http_response(bytes(self.buf))
+        view = memoryview(self.buf)
+        return self.status, self.reason, bytes(view[: self.body_start - 4]), bytes(view[self.body_start:])
+
+    def tags(self) -> list[str]:
+        return self.scan.tags(self.buf) if self.scan is not None else []
+
+
+def summarize_response(
+    scheme: str,
+    path: str,
+    status: int,
+    reason: str,
+    headers_b: bytes,
+    body_b: bytes,
+    alpn: Optional[str] = None,
+    ttfb: Optional[float] = None,
+    tags: Sequence[str] = (),
+) -> ProbeResult:
+    headers_text = headers_b.decode("latin-1", "replace")
+    body_text = body_b.decode("utf-8", "replace")
+
+    # small snippet for display
+    snippet = " ".join(body_text.strip().split())
+    snippet = snippet[:_SNIPPET_CHARS]
+
+    return ProbeResult(scheme, path, status, reason, headers_text, snippet, alpn, ttfb, tags, html_title(body_b), body_b)
+
+
+# ----------------------------
+# Probe shaping (--shape auto)
+# ----------------------------
+
+# Body bytes a "range" probe asks for: the snippet reads at most 4 bytes per character it keeps.
+SHAPE_RANGE_BYTES = 4 * _SNIPPET_CHARS
+
+# Answers that mean "this server doesn't do that request shape"; the port falls back to a plain GET.
+_SHAPE_REJECTED = {"head": {405, 501}, "range": {405, 416, 501}}
+
+
+def probe_shape(shape: str, reads_body: bool, need_full_body: bool) -> str:
+    """
+    The request shape for a scan: "head" when nothing reads the body, "range" when only
+    its start is read (--match-*, a --where body rule, identification), "get" when more
+    may be (tags, --record) or with --shape get.
+    """
+    if shape == "get" or need_full_body:
+        return "get"
+    return "range" if reads_body else "head"
+
+
+class ProbeShaper:
+    """
+    Per-scan request shape plus the (host, port, scheme) keys that rejected it:
+    once a port answers a HEAD or ranged GET with 405/501 (416 for ranges), it gets
+    plain GETs for the rest of the scan.
+    """
+
+    def __init__(self, shape: str):
+        self.shape = shape
+        self.fallback: set[Tuple[str, int, str]] = set()
+        self.shaped = 0
+        self.rejected = 0
+
+    def for_port(self, host: str, port: int, scheme: str) -> str:
+        if self.shape == "get" or (host, port, scheme) in self.fallback:
+            return "get"
+        self.shaped += 1
+        return self.shape
+
+    def rejects(self, host: str, port: int, scheme: str, shape: str, status: int) -> bool:
+        """True (and the port is remembered) if status says to repeat the probe as a plain GET."""
+        if status not in _SHAPE_REJECTED.get(shape, ()):
+            return False
+        self.fallback.add((host, port, scheme))
+        self.rejected += 1
+        return True
+
+    def summary(self) -> dict:
+        return {"shape": self.shape, "shaped_requests": self.shaped, "fallbacks": self.rejected}
+
+
+# ----------------------------
+# Raw sweep engine (--engine raw)
+# ----------------------------
+
+_CONNECT_PENDING = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY}
+
+
+def raw_sweep(
+    targets: Iterator[Tuple[str, int]],
+    addrs_for: Callable[[str], Sequence[Tuple[int, str]]],
+    timeout: float,
+    window: int,
+    per_host: int,
+    deliver: Callable[[list], None],
+    stopped: Callable[[], bool],
+    pacer: Optional[ConnectPacer] = None,
+) -> None:
+    """
+    The connect sweep without asyncio: up to `window` non-blocking connects in flight on
+    one selectors (epoll/kqueue) instance, completions taken from SO_ERROR, and timeouts
+    expired from a FIFO (every connect gets the same timeout, so start order is deadline order).
+    No futures, tasks or transports per port. Blocking: run it in a worker thread.
+
+    Results go to deliver() once per select() round as [(host, port, result, seconds, errno), ...]
+    with result as in tcp_alive(), including its try-the-next-address behaviour, and errno
+    the last connect error of that target (0 if none). per_host > 0 caps connects in flight
+    per host; held-back targets start as slots free up. pacer's token bucket (--max-rate)
+    gates new connects; open sockets are closed with RST like in tcp_alive().
+    """
+    sel = selectors.DefaultSelector()
+    deadlines: deque[Tuple[float, socket.socket]] = deque()
+    busy: dict[str, int] = {}
+    held: dict[str, deque[int]] = {}
+    freed: deque[str] = deque()  # hosts with held targets that just got a slot back
+    n_held = 0
+    in_flight = 0
+    batch: list[Tuple[str, int, str, float, int]] = []
+
+    def finish(host: str, port: int, result: str, t0: float, err: int) -> None:
+        nonlocal in_flight
+        batch.append((host, port, result, time.perf_counter() - t0, err))
+        in_flight -= 1
+        busy[host] -= 1
+        if held.get(host):
+            freed.append(host)
+
+    def attempt(host: str, port: int, addrs: Sequence[Tuple[int, str]], i: int, result: str, t0: float,
+                err: int = 0) -> None:
+        # Try addresses from i on until one is pending; immediate answers are handled inline.
+        while i < len(addrs):
+            family, ip = addrs[i]
+            try:
+                sock = socket.socket(family, socket.SOCK_STREAM)
+            except OSError as e:
+                finish(host, port, "error" if e.errno in _LOCAL_RESOURCE_ERRNOS else result, t0, e.errno or 0)
+                return
+            sock.setblocking(False)
+            code = sock.connect_ex((ip, port))
+            if code in _CONNECT_PENDING:
+                sel.register(sock, selectors.EVENT_WRITE, (host, port, addrs, i, result, t0, err))
+                deadlines.append((time.monotonic() + timeout, sock))
+                return
+            if code == 0:
+                set_rst_close(sock)
+                sock.close()
+                finish(host, port, "open", t0, err)
+                return
+            sock.close()
+            err = code
+            if code in _LOCAL_RESOURCE_ERRNOS:
+                result = "error"
+            i += 1
+        finish(host, port, result, t0, err)
+
+    def begin(host: str, port: int) -> None:
+        nonlocal in_flight
+        in_flight += 1
+        busy[host] = busy.get(host, 0) + 1
+        attempt(host, port, addrs_for(host), 0, "closed", time.perf_counter())
+
+    def settle(key: selectors.SelectorKey, timed_out: bool) -> None:
+        sock = key.fileobj
+        sel.unregister(sock)
+        code = 0 if timed_out else sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if not timed_out and code == 0 and sock.getsockname() == sock.getpeername():
+            # Sweeping the ephemeral range can hit our own source port: a TCP self-connect, not a listener.
+            code = errno.ECONNREFUSED
+        set_rst_close(sock)
+        sock.close()
+        host, port, addrs, i, result, t0, err = key.data
+        if not timed_out and code == 0:
+            finish(host, port, "open", t0, err)
+            return
+        if timed_out:
+            result = "timeout"
+        else:
+            err = code
+            if code in _LOCAL_RESOURCE_ERRNOS:
+                result = "error"
+        attempt(host, port, addrs, i + 1, result, t0, err)
+
+    if pacer:
+        window = min(window, pacer.limit)  # every connect in flight holds a client port
+    exhausted = False
+    try:
+        while not stopped():
+            paced = 0.0
+            while freed and in_flight < window:
+                paced = pacer.take() if pacer else 0.0
+                if paced:
+                    break
+                host = freed.popleft()
+                if held[host] and busy[host] < per_host:
+                    n_held -= 1
+                    begin(host, held[host].popleft())
+            while not paced and not exhausted and in_flight < window and n_held < window:
+                paced = pacer.take() if pacer else 0.0
+                if paced:
+                    break
+                target = next(targets, None)
+                if target is None:
+                    exhausted = True
+                    break
+                host, port = target
+                if per_host and busy.get(host, 0) >= per_host:
+                    held.setdefault(host, deque()).append(port)
+                    n_held += 1
+                else:
+                    begin(host, port)
+
+            if in_flight == 0 and exhausted and not freed:
+                break
+            wait = max(0.0, deadlines[0][0] - time.monotonic()) if deadlines else paced
+            for key, _ in sel.select(min(wait, paced or 0.05)):
+                settle(key, False)
+
+            now = time.monotonic()
+            while deadlines and deadlines[0][0] <= now:
+                _, sock = deadlines.popleft()
+                if sock.fileno() != -1:  # still pending; completed sockets are already closed
+                    settle(sel.get_key(sock), True)
+
+            if batch:
+                deliver(batch)
+                batch = []
+    finally:
+        for key in list(sel.get_map().values()):
+            key.fileobj.close()
+        sel.close()
+        if batch:
+            deliver(batch)
+
+
+# ----------------------------
+# TLS: shared context + session cache
+# ----------------------------
+
+class TLSStream:
+    """
+    TLS over a plain asyncio stream via memory BIOs. asyncio's own SSL transport
+    can't take a saved session, so this is what makes resumption possible.
+    Acts as both the reader and the writer handed to the probe code.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, sslobj: ssl.SSLObject,
+                 incoming: ssl.MemoryBIO, outgoing: ssl.MemoryBIO):
+        self._reader = reader
+        self._writer = writer
+        self.sslobj = sslobj
+        self._in = incoming
+        self._out = outgoing
+
+    def _flush(self) -> None:
+        data = self._out.read()
+        if data:
+            self._writer.write(data)
+
+    async def _recv(self) -> bool:
+        self._flush()
+        await self._writer.drain()
+        data = await self._reader.read(65536)
+        if not data:
+            self._in.write_eof()
+            return False
+        self._in.write(data)
+        return True
+
+    async def handshake(self) -> None:
+        while True:
+            try:
+                self.sslobj.do_handshake()
+                break
+            except ssl.SSLWantReadError:
+                if not await self._recv():
+                    raise ConnectionResetError("EOF during TLS handshake")
+        self._flush()
+        await self._writer.drain()
+
+    async def read(self, n: int = -1) -> bytes:
+        n = 65536 if n < 0 else n
+        while True:
+            try:
+                return self.sslobj.read(n)
+            except ssl.SSLWantReadError:
+                if not await self._recv():
+                    continue  # BIO now at EOF; the next read raises
+            except (ssl.SSLZeroReturnError, ssl.SSLEOFError):
+                # clean close_notify or the (very common) abrupt close
+                return b""
+
+    def write(self, data: bytes) -> None:
+        self.sslobj.write(data)
+        self._flush()
+
+    async def drain(self) -> None:
+        await self._writer.drain()
+
+    def get_extra_info(self, name: str, default=None):
+        if name == "ssl_object":
+            return self.sslobj
+        return self._writer.get_extra_info(name, default)
+
+    def close(self) -> None:
+        self._writer.close()
+
+    async def wait_closed(self) -> None:
+        await self._writer.wait_closed()
+
+
+class TLSClient:
+    """
+    One unverified client context per scan plus a per-(host, port) session cache,
+    so retries, extra paths and rescans resume instead of doing full handshakes.
+    No trust store is loaded: dev certs are often self-signed and we never verify.
+    """
+
+    def __init__(self) -> None:
+        self.ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.ctx.check_hostname = False
+        self.ctx.verify_mode = ssl.CERT_NONE
+        self.ctx.set_alpn_protocols(["http/1.1"])
+        self.sessions: dict[Tuple[str, int], ssl.SSLSession] = {}
+
+        self.handshakes = 0
+        self.resumed = 0
+        self.failures = 0
+        self.handshake_seconds = 0.0
+
+    async def wrap(self, host: str, port: int, reader: asyncio.StreamReader,
+                   writer: asyncio.StreamWriter) -> TLSStream:
+        incoming, outgoing = ssl.MemoryBIO(), ssl.MemoryBIO()
+        session = self.sessions.get((host, port))
+        try:
+            sslobj = self.ctx.wrap_bio(incoming, outgoing, server_hostname=host, session=session)
+        except ssl.SSLError:
+            # stale/incompatible session: fall back to a full handshake
+            sslobj = self.ctx.wrap_bio(incoming, outgoing, server_hostname=host)
+        stream = TLSStream(reader, writer, sslobj, incoming, outgoing)
+
+        t0 = time.perf_counter()
+        try:
+            await stream.handshake()
+        except BaseException:
+            self.failures += 1
+            self.sessions.pop((host, port), None)
+            raise
+        self.handshake_seconds += time.perf_counter() - t0
+        self.handshakes += 1
+        if sslobj.session_reused:
+            self.resumed += 1
+        return stream
+
+    def remember(self, host: str, port: int, stream: TLSStream) -> None:
+        # TLS 1.3 tickets arrive after the handshake, so grab the session once data flowed.
+        session = stream.sslobj.session
+        if session is not None:
+            self.sessions[(host, port)] = session
+
+    def summary(self) -> dict:
+        n = self.handshakes
+        return {
+            "handshakes": n,
+            "resumed": self.resumed,
+            "resumption_rate": (self.resumed / n) if n else 0.0,
+            "failures": self.failures,
+            "handshake_ms_avg": (self.handshake_seconds / n * 1000.0) if n else 0.0,
+            "handshake_ms_total": self.handshake_seconds * 1000.0,
+        }
+
+
+def negotiated_alpn(writer) -> Optional[str]:
+    sslobj = writer.get_extra_info("ssl_object")
+    return sslobj.selected_alpn_protocol() if sslobj is not None else None
+
+
+async def connect_addrs(host: str, port: int, addrs: Optional[Sequence[Tuple[int, str]]] = None):
+    """
+    asyncio.open_connection() to the scan's already resolved addrs, tried in order like
+    tcp_alive(); host is only resolved here when addrs isn't given. A failure raises the
+    last address's error, so a name whose every address refuses gives ConnectionRefusedError
+    (asyncio's own fallback raises a bare OSError("Multiple exceptions") without an errno).
+    """
+    if not addrs:
+        return await asyncio.open_connection(host=host, port=port)
+    err: Optional[OSError] = None
+    for family, ip in addrs:
+        try:
+            return await asyncio.open_connection(host=ip, port=port, family=family)
+        except OSError as e:
+            err = e
+    raise err
+
+
+async def open_stream(
+    host: str,
+    port: int,
+    scheme: str,
+    timeout: float,
+    tls: Optional[TLSClient] = None,
+    metrics: Optional[ProbeMetrics] = None,
+    pacer: Optional[ConnectPacer] = None,
+    addrs: Optional[Sequence[Tuple[int, str]]] = None,
+):
+    """
+    (reader, writer) for scheme. For https both are the same TLSStream.
+    addrs: host's addresses from resolve_host(); the Host header and SNI still use host.
+    With a pacer, the port it hands out is released by close_stream()/abort_stream(),
+    or here if the connect or handshake fails. asyncio's transports already set
+    TCP_NODELAY, so small requests aren't held back by Nagle.
+    """
+    if pacer:
+        await pacer.acquire()
+    t0 = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(connect_addrs(host, port, addrs), timeout=timeout)
+    except BaseException:
+        if pacer:
+            pacer.release(graceful=False)
+        raise
+    t1 = time.perf_counter()
+    if metrics:
+        metrics.observe("connect", t1 - t0)
+    if scheme != "https":
+        return reader, writer
+
+    tls = tls or TLSClient()
+    try:
+        stream = await asyncio.wait_for(tls.wrap(host, port, reader, writer), timeout=timeout)
+    except BaseException:
+        abort_stream(writer, pacer)
+        raise
+    if metrics:
+        metrics.observe("tls", time.perf_counter() - t1)
+    return stream, stream
+
+
+async def close_stream(
+    writer,
+    host: str = "",
+    port: int = 0,
+    tls: Optional[TLSClient] = None,
+    pacer: Optional[ConnectPacer] = None,
+) -> None:
+    """Orderly close (FIN) of a connection that did its job; its local port may sit in TIME_WAIT."""
+    if tls is not None and isinstance(writer, TLSStream):
+        tls.remember(host, port, writer)
+    try:
+        writer.close()
+        await writer.wait_closed()
+    except Exception:
+        pass
+    finally:
+        if pacer:
+            pacer.release(graceful=True)
+
+
+def abort_stream(writer, pacer: Optional[ConnectPacer] = None) -> None:
+    """Close with RST: for failed or abandoned probes, so they leave no TIME_WAIT behind."""
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        set_rst_close(sock)
+    try:
+        writer.close()
+    except Exception:
+        pass
+    if pacer:
+        pacer.release(graceful=False)
+
+
+async def probe_once(
+    host: str,
+    port: int,
+    scheme: str,
+    path: str,
+    timeout: float,
+    max_bytes: int,
+    tls: Optional[TLSClient] = None,
+    skip_status: Optional[Callable[[int], bool]] = None,
+    patterns: Optional[PatternSet] = None,
+    full_body: bool = False,
+    metrics: Optional[ProbeMetrics] = None,
+    pacer: Optional[ConnectPacer] = None,
+    shaper: Optional[ProbeShaper] = None,
+    addrs: Optional[Sequence[Tuple[int, str]]] = None,
+    read_body: bool = True,
+) -> Tuple[Optional[ProbeResult], str]:
+    """
+    Returns (ProbeResult, "http") for an HTTP-like response, else (None, outcome) with
+    outcome one of OUTCOMES saying why (refused, timeout, reset, tls, non_http, error).
+    skip_status(status) -> True means the hit will be filtered out, so the body isn't read.
+    read_body=False (no filter, tag or fingerprint looks at it) stops at the headers too.
+    A read timeout once the headers are in returns what arrived, so a streaming body
+    (SSE, long polling) is still a hit.
+    With a shaper the request may be a HEAD or a ranged GET; a port that rejects those
+    is probed again with a plain GET.
+    """
+    shape = shaper.for_port(host, port, scheme) if shaper else "get"
+    req = build_request(host, port, path, shape=shape)
+    writer = None
+
+    try:
+        reader, writer = await open_stream(host, port, scheme, timeout, tls, metrics, pacer, addrs)
+        writer.write(req)
+        await asyncio.wait_for(writer.drain(), timeout=timeout)
+
+        skip = skip_status
+        if shape == "range" and skip_status is not None:
+            skip = lambda st: skip_status(200 if st == 206 else st)  # judged like a plain GET's answer
+        resp = ResponseBuffer(max_bytes, skip, patterns, full_body, no_body=shape == "head" or not read_body)
+        t_sent = time.perf_counter()
+        ttfb = None
+        # Read until the result can't change any more, EOF, max_bytes, or a stall after the headers
+        while True:
+            try:
+                chunk = await asyncio.wait_for(reader.read(resp.room()), timeout=timeout)
+            except asyncio.TimeoutError:
+                if resp.status is None:
+                    raise
+                break
+            if not chunk:
+                break
+            if ttfb is None:
+                ttfb = time.perf_counter() - t_sent
+            if resp.feed(chunk):
+                break
+        if metrics and ttfb is not None:
+            metrics.observe("ttfb", ttfb)
+            metrics.observe("read", time.perf_counter() - t_sent - ttfb)
+
+        alpn = negotiated_alpn(writer)
+        status = None
+        if resp.buf:
+            status, reason, headers_b, body_b = resp.parts()
+        if status is None:
+            abort_stream(writer, pacer)
+            writer = None
+            if metrics:
+                metrics.outcome("non_http")
+            return None, "non_http"
+        await close_stream(writer, host, port, tls, pacer)
+        writer = None
+
+        if shape != "get" and shaper.rejects(host, port, scheme, shape, status):
+            return await probe_once(
+                host, port, scheme, path, timeout, max_bytes, tls, skip_status, patterns, full_body, metrics,
+                pacer, shaper, addrs, read_body,
+            )
+        r = summarize_response(scheme, path, status, reason, headers_b, body_b, alpn, ttfb, resp.tags())
+        r.ranged = shape == "range"
+        if metrics:
+            metrics.outcome("http")
+        return r, "http"
+
+    except Exception as e:
+        if writer is not None:
+            abort_stream(writer, pacer)
+        if metrics:
+            metrics.failed(e)
+        return None, classify_failure(e)
+
+
+# Bodies larger than this are not drained to keep a connection reusable; we close instead.
+_KEEPALIVE_DRAIN_LIMIT = 1 << 20
+
+
+class ResponseFramer:
+    """
+    Splits consecutive HTTP/1.x responses off one stream using Content-Length or
+    chunked framing, so several requests can share a keep-alive connection.
+    Keeps at most max_bytes of each body; the rest is drained and discarded.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, timeout: float, max_bytes: int):
+        self.reader = reader
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.buf = bytearray()
+
+    async def _fill(self) -> bool:
+        chunk = await asyncio.wait_for(self.reader.read(65536), timeout=self.timeout)
+        if not chunk:
+            return False
+        self.buf += chunk
+        return True
+
+    async def peek(self, n: int) -> bytes:
+        """First n buffered bytes (fewer if the stream ends), without consuming them."""
+        while len(self.buf) < n:
+            if not await self._fill():
+                break
+        return bytes(self.buf[:n])
+
+    async def _read_line(self) -> Optional[bytes]:
+        while True:
+            i = self.buf.find(b"\r\n")
+            if i >= 0:
+                line = bytes(self.buf[:i])
+                del self.buf[: i + 2]
+                return line
+            if len(self.buf) > 8192 or not await self._fill():
+                return None
+
+    async def _read_exact(self, n: int, keep: bytearray) -> bool:
+        """Consume n bytes, appending what fits under max_bytes to keep."""
+        while n > 0:
+            if not self.buf and not await self._fill():
+                return False
+            take = min(n, len(self.buf))
+            room = self.max_bytes - len(keep)
+            if room > 0:
+                keep += self.buf[: min(take, room)]
+            del self.buf[:take]
+            n -= take
+        return True
+
+    async def read_response(self) -> Optional[Tuple[int, str, bytes, bytes, bool]]:
+        """
+        Returns (status, reason, headers_bytes, body_bytes, reusable) or None if the
+        stream closed or didn't speak HTTP. reusable=False means the next request
+        needs a new connection.
+        """
+        while True:
+            i = self.buf.find(b"\r\n\r\n")
+            if i >= 0:
+                break
+            if len(self.buf) > 65536 or not await self._fill():
+                return None
+        head = bytes(self.buf[:i])
+        del self.buf[: i + 4]
+
+        status, reason, _, _ = parse_http_response(head)
+        if status is None:
+            return None
+
+        headers: dict[str, str] = {}
+        for line in head.split(b"\r\n")[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower().decode("latin-1")] = value.strip().decode("latin-1")
+
+        version = head[:8].upper()
+        conn = headers.get("connection", "").lower()
+        reusable = ("close" not in conn) and (version == b"HTTP/1.1" or "keep-alive" in conn)
+
+        body = bytearray()
+        if status < 200 or status in (204, 304):
+            pass
+        elif "chunked" in headers.get("transfer-encoding", "").lower():
+            total = 0
+            while True:
+                size_line = await self._read_line()
+                if size_line is None:
+                    return None
+                try:
+                    size = int(size_line.split(b";", 1)[0].strip(), 16)
+                except ValueError:
+                    return None
+                if size == 0:
+                    # trailers, terminated by an empty line
+                    while True:
+                        trailer = await self._read_line()
+                        if trailer is None:
+                            reusable = False
+                            break
+                        if not trailer:
+                            break
+                    break
+                total += size
+                if total > _KEEPALIVE_DRAIN_LIMIT:
+                    reusable = False
+                    break
+                if not await self._read_exact(size, body) or await self._read_line() is None:
+                    reusable = False
+                    break
+        elif "content-length" in headers:
+            try:
+                length = int(headers["content-length"])
+            except ValueError:
+                return None
+            if length > _KEEPALIVE_DRAIN_LIMIT:
+                await self._read_exact(min(length, self.max_bytes), body)
+                reusable = False
+            elif not await self._read_exact(length, body):
+                reusable = False
+        else:
+            # No framing: the body runs until the server closes the connection.
+            reusable = False
+            while len(body) < self.max_bytes:
+                if not self.buf and not await self._fill():
+                    break
+                take = min(len(self.buf), self.max_bytes - len(body))
+                body += self.buf[:take]
+                del self.buf[:take]
+
+        return status, reason, head, bytes(body), reusable
+
+
+def framed_tags(patterns: Optional[PatternSet], head: bytes, body: bytes) -> list[str]:
+    """Tags for a response the framer already read whole (head + blank line + body, as on the wire)."""
+    return patterns.search(head + b"\r\n\r\n" + body) if patterns else []
+
+
+async def _keepalive_loop(
+    host: str,
+    port: int,
+    scheme: str,
+    paths: Sequence[str],
+    writer,
+    framer: ResponseFramer,
+    results: list[ProbeResult],
+    patterns: Optional[PatternSet] = None,
+    metrics: Optional[ProbeMetrics] = None,
+) -> list[str]:
+    """Runs paths over an open connection, appending to results. Returns the paths left for fallback."""
+    alpn = negotiated_alpn(writer)
+    for i, path in enumerate(paths):
+        t0 = time.perf_counter()
+        writer.write(build_request(host, port, path, keep_alive=True))
+        await asyncio.wait_for(writer.drain(), timeout=framer.timeout)
+        await framer.peek(1)
+        ttfb = time.perf_counter() - t0
+        resp = await framer.read_response()
+        if metrics:
+            metrics.observe("ttfb", ttfb)
+            metrics.observe("read", time.perf_counter() - t0 - ttfb)
+            metrics.outcome("non_http" if resp is None else "http")
+        if resp is None:
+            return list(paths[i:]) if results else []
+        status, reason, headers_b, body_b, reusable = resp
+        results.append(summarize_response(
+            scheme, path, status, reason, headers_b, body_b, alpn, ttfb, framed_tags(patterns, headers_b, body_b)
+        ))
+        if not reusable:
+            return list(paths[i + 1:])
+    return []
+
+
+async def probe_keepalive(
+    host: str,
+    port: int,
+    scheme: str,
+    paths: Sequence[str],
+    timeout: float,
+    max_bytes: int,
+    tls: Optional[TLSClient] = None,
+    patterns: Optional[PatternSet] = None,
+    metrics: Optional[ProbeMetrics] = None,
+    pacer: Optional[ConnectPacer] = None,
+    addrs: Optional[Sequence[Tuple[int, str]]] = None,
+) -> Tuple[list[ProbeResult], list[str], str]:
+    """
+    Sends the paths as sequential requests over one keep-alive connection.
+    Returns ([ProbeResult, ...], paths_left, outcome).
+
+    paths_left is non-empty only when the server answered at least once and then
+    closed the connection; those paths are meant to fall back to probe_once().
+    If the first exchange fails, the port doesn't speak this scheme, nothing is left
+    and outcome says why (as in probe_once); otherwise it is "http".
+    """
+    results: list[ProbeResult] = []
+    writer = None
+    try:
+        reader, writer = await open_stream(host, port, scheme, timeout, tls, metrics, pacer, addrs)
+        framer = ResponseFramer(reader, timeout, max_bytes)
+        left = await _keepalive_loop(host, port, scheme, paths, writer, framer, results, patterns, metrics)
+        return results, left, "http" if results else "non_http"
+    except Exception as e:
+        if metrics:
+            metrics.failed(e)
+        if results:
+            return results, list(paths[len(results):]), "http"
+        return results, [], classify_failure(e)
+    finally:
+        if writer is not None:
+            if results:
+                await close_stream(writer, host, port, tls, pacer)
+            else:
+                abort_stream(writer, pacer)
+
+
+# Plaintext error pages servers send when an HTTP request hits their TLS port.
+_PLAIN_TO_TLS_MARKERS = (
+    b"plain http request was sent to https port",        # nginx
+    b"client sent an http request to an https server",   # Go net/http
+    b"speaking plain http to an ssl-enabled server",     # Apache
+    b"combination of host and port requires tls",        # Apache 2.4
+)
+
+
+def looks_like_tls(first: bytes) -> bool:
+    """TLS record header: content type alert(21)/handshake(22), major version 3."""
+    return len(first) >= 2 and first[0] in (0x15, 0x16) and first[1] == 0x03
+
+
+async def probe_auto(
+    host: str,
+    port: int,
+    paths: Sequence[str],
+    timeout: float,
+    max_bytes: int,
+    keep_alive: bool = False,
+    patterns: Optional[PatternSet] = None,
+    metrics: Optional[ProbeMetrics] = None,
+    pacer: Optional[ConnectPacer] = None,
+    addrs: Optional[Sequence[Tuple[int, str]]] = None,
+) -> Tuple[Optional[str], list[ProbeResult], list[str], str]:
+    """
+    Decides http vs https from the server's reaction to one plaintext request:
+    an HTTP status line means http (and the response is kept), while a TLS record,
+    a reset/immediate close, or a "plain HTTP sent to HTTPS port" error page means https.
+    The decision comes from the first bytes, so neither case waits out the timeout.
+
+    Returns (scheme, results, paths_left, outcome). scheme is None if the port speaks
+    neither, and outcome then says why (as in probe_once); once a scheme is known it is "http".
+    For "http", results holds the paths already answered on this connection
+    (all of them with keep_alive, unless the server closed early).
+    For "https", results is empty and the caller probes every path over TLS.
+    """
+    results: list[ProbeResult] = []
+    multi = keep_alive and len(paths) > 1
+    writer = None
+    try:
+        reader, writer = await open_stream(host, port, "http", timeout, metrics=metrics, pacer=pacer, addrs=addrs)
+        t0 = time.perf_counter()
+        writer.write(build_request(host, port, paths[0], keep_alive=multi))
+        await asyncio.wait_for(writer.drain(), timeout=timeout)
+
+        framer = ResponseFramer(reader, timeout, max_bytes)
+        first = await framer.peek(5)
+        ttfb = time.perf_counter() - t0
+        if not first or looks_like_tls(first):
+            return "https", [], list(paths), "http"
+
+        resp = await framer.read_response()
+        if resp is None:
+            if metrics:
+                metrics.outcome("non_http")
+            return None, [], [], "non_http"
+        status, reason, headers_b, body_b, reusable = resp
+        if status == 400:
+            text = (reason.encode("latin-1", "replace") + b" " + body_b).lower()
+            if any(m in text for m in _PLAIN_TO_TLS_MARKERS):
+                return "https", [], list(paths), "http"
+
+        # A sniff that says "https" isn't counted; the TLS probes that follow are.
+        if metrics:
+            metrics.observe("ttfb", ttfb)
+            metrics.observe("read", time.perf_counter() - t0 - ttfb)
+            metrics.outcome("http")
+        results.append(summarize_response(
+            "http", paths[0], status, reason, headers_b, body_b, None, ttfb, framed_tags(patterns, headers_b, body_b)
+        ))
+        rest = list(paths[1:])
+        if multi and reusable:
+            rest = await _keepalive_loop(host, port, "http", rest, writer, framer, results, patterns, metrics)
+        return "http", results, rest, "http"
+    except (ConnectionResetError, BrokenPipeError):
+        # TLS servers commonly reset on bytes that aren't a ClientHello.
+        if results:
+            return "http", results, list(paths[len(results):]), "http"
+        return "https", [], list(paths), "http"
+    except Exception as e:
+        if metrics:
+            metrics.failed(e)
+        if results:
+            return "http", results, list(paths[len(results):]), "http"
+        return None, [], [], classify_failure(e)
+    finally:
+        if writer is not None:
+            # Only a plaintext exchange that produced hits is closed politely.
+            if results:
+                await close_stream(writer, pacer=pacer)
+            else:
+                abort_stream(writer, pacer)
+
+
+# Outcomes a second attempt can change. refused, tls and non_http say what the port is.
+TRANSIENT_OUTCOMES = ("timeout", "reset", "error")
+
+
+def retry_delay(attempt: int, base: float, cap: float = 1.0) -> float:
+    """Full-jitter exponential backoff before retry `attempt` (1-based): uniform(0, base * 2^(attempt-1)), capped."""
+    return random.uniform(0.0, min(cap, base * 2 ** (attempt - 1)))
+
+
+async def retrying(
+    probe: Callable[[], Awaitable[tuple]],
+    retries: int,
+    backoff: float,
+    metrics: Optional[ProbeMetrics] = None,
+) -> tuple:
+    """
+    Awaits probe() (a tuple whose last item is the outcome) again while the outcome is
+    transient and retries are left, sleeping retry_delay() in between. Returns the last tuple.
+    """
+    attempt = 0
+    while True:
+        res = await probe()
+        outcome = res[-1]
+        if outcome not in TRANSIENT_OUTCOMES or attempt >= retries:
+            if metrics and attempt and outcome == "http":
+                metrics.recovered += 1
+            return res
+        attempt += 1
+        if metrics:
+            metrics.retried[outcome] += 1
+        if backoff > 0:
+            await asyncio.sleep(retry_delay(attempt, backoff))
+
+
+async def probe_port(
+    host: str,
+    port: int,
+    schemes: Sequence[str],
+    paths: Sequence[str],
+    timeout: float,
+    max_bytes: int,
+    retries: int,
+    keep_alive: bool = False,
+    tls: Optional[TLSClient] = None,
+    skip_status: Optional[Callable[[int], bool]] = None,
+    patterns: Optional[PatternSet] = None,
+    full_body: bool = False,
+    metrics: Optional[ProbeMetrics] = None,
+    pacer: Optional[ConnectPacer] = None,
+    retry_backoff: float = 0.05,
+    shaper: Optional[ProbeShaper] = None,
+    addrs: Optional[Sequence[Tuple[int, str]]] = None,
+    read_body: bool = True,
+) -> list[ProbeResult]:
+    """
+    Try schemes and paths. Returns list of successful HTTP hits for this port.
+    addrs (from resolve_host()) saves a name lookup per connect and keeps every probe on
+    the addresses the scan resolved once.
+    Only transient failures are retried (see retrying()); a refused connect ends the
+    port, since no other scheme or path can get through either.
+    """
+    results: list[ProbeResult] = []
+    for scheme in schemes:
+        todo = list(paths)
+        sniffed = False
+        if scheme == "auto":
+            detected, got, left, outcome = await retrying(
+                lambda: probe_auto(
+                    host, port, paths, timeout, max_bytes, keep_alive, patterns, metrics, pacer, addrs
+                ),
+                retries, retry_backoff, metrics,
+            )
+            if outcome == "refused":
+                return results
+            if detected is None:
+                continue
+            scheme = detected
+            results.extend(got)
+            # The plaintext connection already carried the http exchange; https still needs its own.
+            sniffed = scheme == "http"
+            todo = left
+
+        if keep_alive and len(todo) > 1 and not sniffed:
+            got, left, outcome = await retrying(
+                lambda: probe_keepalive(
+                    host, port, scheme, todo, timeout, max_bytes, tls, patterns, metrics, pacer, addrs
+                ),
+                retries, retry_backoff, metrics,
+            )
+            if outcome == "refused":
+                return results
+            results.extend(got)
+            todo = left
+
+        for path in todo:
+            resp, outcome = await retrying(
+                lambda: probe_once(
+                    host, port, scheme, path, timeout, max_bytes, tls, skip_status, patterns, full_body, metrics,
+                    pacer, shaper, addrs, read_body,
+                ),
+                retries, retry_backoff, metrics,
+            )
+            if resp is not None:
+                results.append(resp)
+            elif outcome == "refused":
+                return results
+    return results
+
+
+# ----------------------------
+# Adaptive concurrency/timeout (AIMD)
+# ----------------------------
+
+def quantile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank quantile of an already sorted sequence (0.0 if empty)."""
+    if not sorted_values:
+        return 0.0
+    i = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[i]
+
+
+class AdaptiveController:
+    """
+    --adaptive: an AIMD concurrency window plus timeouts derived from measured RTTs.
+
+    Every epoch (about one window of completions) the timeout/error rate is compared
+    with the best rate seen so far. More than `slack` above it halves the window
+    (multiplicative decrease); otherwise the window grows by `step` (additive increase).
+    Comparing against the best rate keeps hosts that silently drop closed ports from
+    looking permanently congested.
+
+    Timeouts are `mult` x the p99 of recent connect / first-byte RTTs, clamped to
+    [min_timeout, max_timeout]. RTTs include event-loop queueing, so a loaded box
+    stretches its own timeouts instead of producing false negatives.
+    """
+
+    def __init__(
+        self,
+        start_timeout: float,
+        max_window: int,
+        max_timeout: float,
+        min_window: int = 16,
+        min_timeout: float = 0.05,
+        step: int = 8,
+        slack: float = 0.02,
+        mult: float = 4.0,
+    ):
+        self.max_window = max(1, max_window)
+        self.min_window = min(min_window, self.max_window)
+        self.window = float(max(self.min_window, self.max_window // 4))
+        self.min_timeout = min_timeout
+        self.max_timeout = max(max_timeout, min_timeout)
+        self.step = step
+        self.slack = slack
+        self.mult = mult
+
+        self.start_timeout = start_timeout
+        self.connect_timeout = start_timeout
+        self.probe_timeout = start_timeout
+        self._connect: deque[float] = deque(maxlen=512)
+        self._ttfb: deque[float] = deque(maxlen=512)
+
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+
+        self._epoch_done = 0
+        self._epoch_bad = 0
+        self._best_rate = 1.0
+        self.increases = 0
+        self.decreases = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < int(self.window))
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            async with self._cond:
+                self._cond.notify(max(1, int(self.window) - self._in_flight))
+
+    def record_connect(self, rtt: float) -> None:
+        self._connect.append(rtt)
+        self._tick(False)
+
+    def record_ttfb(self, rtt: float) -> None:
+        self._ttfb.append(rtt)
+        self._tick(False)
+
+    def record_ok(self) -> None:
+        self._tick(False)
+
+    def record_timeout(self) -> None:
+        self.timeouts += 1
+        self._tick(True)
+
+    def record_error(self) -> None:
+        self.errors += 1
+        self._tick(True)
+
+    def _clamp(self, t: float) -> float:
+        return min(self.max_timeout, max(self.min_timeout, t))
+
+    def _tick(self, bad: bool) -> None:
+        self._epoch_done += 1
+        self._epoch_bad += int(bad)
+        if self._epoch_done < max(32, int(self.window)):
+            return
+
+        rate = self._epoch_bad / self._epoch_done
+        self._epoch_done = self._epoch_bad = 0
+        self._best_rate = min(self._best_rate, rate)
+        if rate > self._best_rate + self.slack:
+            self.window = max(float(self.min_window), self.window * 0.5)
+            self.decreases += 1
+        elif self.window < self.max_window:
+            self.window = min(float(self.max_window), self.window + self.step)
+            self.increases += 1
+
+        if len(self._connect) >= 32:
+            self.connect_timeout = self._clamp(self.mult * quantile(sorted(self._connect), 0.99))
+        if len(self._ttfb) >= 8:
+            probe = self._clamp(self.mult * quantile(sorted(self._ttfb), 0.99))
+        else:
+            probe = self.start_timeout
+        self.probe_timeout = max(probe, self.connect_timeout)
+
+    def summary(self) -> dict:
+        c = sorted(self._connect)
+        f = sorted(self._ttfb)
+        return {
+            "window": int(self.window),
+            "connect_timeout": self.connect_timeout,
+            "probe_timeout": self.probe_timeout,
+            "increases": self.increases,
+            "decreases": self.decreases,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "connect_rtt_p50": quantile(c, 0.50),
+            "connect_rtt_p99": quantile(c, 0.99),
+            "ttfb_p50": quantile(f, 0.50),
+            "ttfb_p99": quantile(f, 0.99),
+        }
+
+
+# ----------------------------
+# Probe metrics: phase histograms and outcomes
+# ----------------------------
+
+# Upper bounds (seconds) of the fixed histogram buckets; one more bucket catches the rest (+Inf).
+PHASE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# sweep: bare --sweep connect (any result); connect: a probe's TCP connect; tls: handshake;
+# ttfb: request sent -> first response byte; read: first byte -> response complete.
+PHASES = ("sweep", "connect", "tls", "ttfb", "read")
+
+# How a probe exchange ended. tls: the handshake failed; non_http: connected, but no HTTP
+# status line came back; error: anything else (local resources, DNS...).
+OUTCOMES = ("refused", "timeout", "reset", "tls", "non_http", "http", "error")
+
+
+def classify_failure(exc: BaseException) -> str:
+    """Outcome name for an exception raised while probing."""
+    if isinstance(exc, asyncio.TimeoutError):
+        return "timeout"
+    if isinstance(exc, ConnectionRefusedError):
+        return "refused"
+    if isinstance(exc, (ConnectionResetError, ConnectionAbortedError, BrokenPipeError, asyncio.IncompleteReadError)):
+        return "reset"
+    if isinstance(exc, ssl.SSLError):
+        return "tls"
+    return "error"
+
+
+class Histogram:
+    """Fixed-bucket histogram: counts[i] holds values <= buckets[i] (and > buckets[i-1])."""
+
+    def __init__(self, buckets: Sequence[float] = PHASE_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def add(self, summary: dict) -> None:
+        """Fold in another histogram's summary() (e.g. from a --workers process)."""
+        for i, n in enumerate(summary["counts"]):
+            self.counts[i] += n
+        self.sum += summary["sum"]
+        self.count += summary["count"]
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-quantile (the largest finite bound if it's past that)."""
+        if not self.count:
+            return 0.0
+        rank = max(1.0, q * self.count)
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg_ms": (self.sum / self.count * 1000.0) if self.count else 0.0,
+            "p50_ms": self.quantile(0.50) * 1000.0,
+            "p99_ms": self.quantile(0.99) * 1000.0,
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+        }
+
+
+class ProbeMetrics:
+    """Per-phase timing histograms plus outcome counts for one scan process."""
+
+    def __init__(self) -> None:
+        self.phases = {p: Histogram() for p in PHASES}
+        self.outcomes = dict.fromkeys(OUTCOMES, 0)
+        self.sweep = dict.fromkeys(("open", "closed", "timeout", "error"), 0)
+        self.socket_errors: dict[str, int] = {}  # errno name -> count, sweep and probes; not refusals
+        self.retried = dict.fromkeys(TRANSIENT_OUTCOMES, 0)  # retries issued, by the outcome retried
+        self.recovered = 0  # retries that got an HTTP answer
+
+    def observe(self, phase: str, seconds: float) -> None:
+        self.phases[phase].observe(seconds)
+
+    def outcome(self, name: str) -> None:
+        self.outcomes[name] += 1
+
+    def failed(self, exc: BaseException) -> None:
+        self.outcomes[classify_failure(exc)] += 1
+        # SSLError.errno is an OpenSSL code, not an errno
+        if isinstance(exc, OSError) and not isinstance(exc, ssl.SSLError) and exc.errno:
+            self.socket_error(exc.errno)
+
+    def socket_error(self, err: int) -> None:
+        if err == errno.ECONNREFUSED:
+            return  # a closed port answering, already counted as sweep "closed" / outcome "refused"
+        name = errno.errorcode.get(err, str(err))
+        self.socket_errors[name] = self.socket_errors.get(name, 0) + 1
+
+    def summary(self) -> dict:
+        return {
+            "phases": {p: h.summary() for p, h in self.phases.items()},
+            "outcomes": dict(self.outcomes),
+            "sweep": dict(self.sweep),
+            "socket_errors": dict(sorted(self.socket_errors.items(), key=lambda x: -x[1])),
+            "retries": dict(self.retried),
+            "retries_recovered": self.recovered,
+        }
+
+    @classmethod
+    def merged(cls, summaries: Iterable[dict]) -> "ProbeMetrics":
+        """One ProbeMetrics from several summary() dicts (--workers shards)."""
+        m = cls()
+        for s in summaries:
+            for p, h in s["phases"].items():
+                m.phases[p].add(h)
+            for k, n in s["outcomes"].items():
+                m.outcomes[k] += n
+            for k, n in s["sweep"].items():
+                m.sweep[k] += n
+            for k, n in s.get("socket_errors", {}).items():
+                m.socket_errors[k] = m.socket_errors.get(k, 0) + n
+            for k, n in s.get("retries", {}).items():
+                m.retried[k] += n
+            m.recovered += s.get("retries_recovered", 0)
+        return m
+
+
+def metrics_line(summary: dict) -> str:
+    """One-line phase p50/p99 + outcome breakdown for the terminal summary."""
+    phases = " ".join(
+        f"{p} {h['p50_ms']:g}/{h['p99_ms']:g}ms" for p, h in summary["phases"].items() if h["count"]
+    )
+    outcomes = " ".join(f"{k}:{n}" for k, n in summary["outcomes"].items() if n)
+    errors = " ".join(f"{k}:{n}" for k, n in summary["socket_errors"].items())
+    line = f"p50/p99 {phases or '-'} | outcomes {outcomes or '-'} | socket errors {errors or '-'}"
+    retried = " ".join(f"{k}:{n}" for k, n in summary["retries"].items() if n)
+    if retried:
+        line += f" | retries {retried} (recovered {summary['retries_recovered']})"
+    return line
+
+
+# ----------------------------
+# Live progress/logging
+# ----------------------------
+
+class LiveState:
+    def __init__(self, total: int, verbose: bool, log_every: float):
+        self.total = total
+        self.verbose = verbose
+        self.log_every = log_every
+        self.start = time.time()
+
+        self.scanned = 0
+        self.open_ports = 0
+        self.http_hits = 0
+        self.kept_hits = 0
+        self.current = "initializing"
+        self.controller: Optional[AdaptiveController] = None
+        self.metrics: Optional[ProbeMetrics] = None
+        self._stop = False
+        self._last_print = 0.0
+        self.print_ticks = 0        # printer wakeups; its own CPU time is part of what --profile measures
+        self.print_seconds = 0.0
+        self.print_max = 0.0
+
+    def stop(self) -> None:
+        self._stop = True
+
+    def set_current(self, s: str) -> None:
+        self.current = s
+
+    def bump_scanned(self, n: int = 1) -> None:
+        self.scanned += n
+
+    def bump_open_ports(self, n: int = 1) -> None:
+        self.open_ports += n
+
+    def bump_http_hits(self, n: int = 1) -> None:
+        self.http_hits += n
+
+    def bump_kept_hits(self, n: int = 1) -> None:
+        self.kept_hits += n
+
+    def line(self) -> str:
+        elapsed = time.time() - self.start
+        rate = self.scanned / elapsed if elapsed > 0 else 0.0
+        pct = (self.scanned / self.total * 100.0) if self.total else 0.0
+        adaptive = ""
+        if self.controller is not None:
+            c = self.controller
+            adaptive = f"win:{int(c.window)} to:{c.connect_timeout * 1000:.0f}/{c.probe_timeout * 1000:.0f}ms | "
+        return (
+            f"[{pct:6.2f}%] scanned {self.scanned}/{self.total} "
+            f"({rate:,.0f}/s) | open:{self.open_ports} http:{self.http_hits} kept:{self.kept_hits} | "
+            f"{adaptive}now: {self.current}"
+        )
+
+    async def printer(self) -> None:
+        while not self._stop:
+            t0 = time.perf_counter()
+            now = time.time()
+            if now - self._last_print >= self.log_every:
+                self._last_print = now
+                print(self.line(), end="\r", flush=True)
+            busy = time.perf_counter() - t0
+            self.print_ticks += 1
+            self.print_seconds += busy
+            self.print_max = max(self.print_max, busy)
+            await asyncio.sleep(0.05)
+
+    def printer_summary(self) -> dict:
+        return {"ticks": self.print_ticks, "busy_ms_total": self.print_seconds * 1000.0,
+                "busy_ms_max": self.print_max * 1000.0}
+
+
+def prometheus_text(state: LiveState) -> str:
+    """Live counters and probe metrics in the Prometheus text exposition format (0.0.4)."""
+    p = "localhost_scanner"
+    lines = [
+        f"# HELP {p}_targets Targets (host, port) planned for this scan.",
+        f"# TYPE {p}_targets gauge",
+        f"{p}_targets {state.total}",
+    ]
+    for name, value, text in (
+        ("scanned", state.scanned, "Targets finished."),
+        ("open_ports", state.open_ports, "Ports that accepted a TCP connect in the sweep."),
+        ("http_hits", state.http_hits, "Ports that answered HTTP."),
+        ("kept_hits", state.kept_hits, "Hits that passed the filters."),
+    ):
+        lines += [f"# HELP {p}_{name}_total {text}", f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {value}"]
+
+    m = state.metrics
+    if m is None:
+        return "\n".join(lines) + "\n"
+
+    lines += [f"# HELP {p}_probe_outcomes_total Probe exchanges by how they ended.",
+              f"# TYPE {p}_probe_outcomes_total counter"]
+    lines += [f'{p}_probe_outcomes_total{{outcome="{k}"}} {n}' for k, n in m.outcomes.items()]
+    lines += [f"# HELP {p}_sweep_results_total TCP connect sweep results.",
+              f"# TYPE {p}_sweep_results_total counter"]
+    lines += [f'{p}_sweep_results_total{{result="{k}"}} {n}' for k, n in m.sweep.items()]
+    lines += [f"# HELP {p}_socket_errors_total Socket errors by errno, sweep and probes.",
+              f"# TYPE {p}_socket_errors_total counter"]
+    lines += [f'{p}_socket_errors_total{{errno="{k}"}} {n}' for k, n in m.socket_errors.items()]
+    lines += [f"# HELP {p}_retries_total Probe retries by the transient outcome that triggered them.",
+              f"# TYPE {p}_retries_total counter"]
+    lines += [f'{p}_retries_total{{outcome="{k}"}} {n}' for k, n in m.retried.items()]
+    lines += [f"# HELP {p}_retries_recovered_total Retries that got an HTTP answer.",
+              f"# TYPE {p}_retries_recovered_total counter", f"{p}_retries_recovered_total {m.recovered}"]
+
+    lines += [f"# HELP {p}_phase_seconds Probe time per phase.", f"# TYPE {p}_phase_seconds histogram"]
+    for phase, h in m.phases.items():
+        cumulative = 0
+        for bound, n in zip(h.buckets, h.counts):
+            cumulative += n
+            lines.append(f'{p}_phase_seconds_bucket{{phase="{phase}",le="{bound:g}"}} {cumulative}')
+        lines.append(f'{p}_phase_seconds_bucket{{phase="{phase}",le="+Inf"}} {h.count}')
+        lines.append(f'{p}_phase_seconds_sum{{phase="{phase}"}} {h.sum:.6f}')
+        lines.append(f'{p}_phase_seconds_count{{phase="{phase}"}} {h.count}')
+    return "\n".join(lines) + "\n"
+
+
+class MetricsExporter:
+    """
+    --metrics-file / --metrics-port: keeps a Prometheus text file current (rewritten
+    atomically every `interval` seconds and once more on close) and/or serves
+    GET /metrics on 127.0.0.1:port while the scan runs.
+    """
+
+    def __init__(self, state: LiveState, path: Optional[str] = None, port: Optional[int] = None,
+                 interval: float = 1.0):
+        self.state = state
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._writer: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.port:
+            self._server = await asyncio.start_server(self._on_client, "127.0.0.1", self.port)
+        if self.path:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    def write_file(self) -> None:
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(prometheus_text(self.state))
+        os.replace(tmp, self.path)
+
+    async def _write_loop(self) -> None:
+        while True:
+            self.write_file()
+            await asyncio.sleep(self.interval)
+
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            parts = request.split(b" ", 2)
+            target = parts[1].split(b"?", 1)[0] if len(parts) > 1 else b""
+            if target == b"/metrics":
+                status, body = "200 OK", prometheus_text(self.state).encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"not found; try /metrics\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+            )
+            await writer.drain()
+        except (asyncio.CancelledError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._writer
+            self.write_file()  # final numbers
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+
+# ----------------------------
+# Profiling (--profile)
+# ----------------------------
+
+class LoopMonitor:
+    """
+    --profile: how starved the event loop is during a scan.
+
+    A heartbeat task asks to wake every `interval`; how late it actually wakes is the
+    wait every ready callback had at that moment (parsing and regexes in probes, the
+    progress printer...). Low lag on a slow scan means the time goes to I/O instead.
+    With slow > 0 every callback is timed while the monitor runs, and those taking
+    `slow` seconds or more are counted, with the slowest kept by name. That is what
+    asyncio's debug mode reports too, but debug mode also records a traceback for every
+    callback scheduled, which slows a scan down several times over.
+
+    The timing wraps asyncio.Handle._run, which is process-wide: it is installed by the
+    first running monitor and put back by the last one to stop, and only callbacks of a
+    loop with a running monitor are timed, so overlapping library scans don't interfere.
+    """
+
+    _lock = threading.Lock()
+    _watching: dict = {}  # loop -> monitors timing its callbacks, while any run
+    _original_run = None  # Handle._run from before the first monitor started
+
+    def __init__(self, interval: float = 0.01, slow: float = 0.02, keep: int = 10):
+        self.interval = interval
+        self.slow = slow
+        self.keep = keep
+        self.lags: deque[float] = deque(maxlen=200_000)  # percentiles over the last ~30 min of beats
+        self.beats = 0
+        self.max_lag = 0.0
+        self.slow_count = 0
+        self.slow_seconds = 0.0
+        self.slowest: list[Tuple[float, str]] = []  # min-heap of the `keep` slowest callbacks
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None  # set while timing callbacks
+
+    def start(self) -> None:
+        if self.slow > 0:
+            self._loop = asyncio.get_running_loop()
+            self._watch(self._loop, self)
+        self._task = asyncio.create_task(self._beat())
+
+    @classmethod
+    def _watch(cls, loop: asyncio.AbstractEventLoop, monitor: "LoopMonitor") -> None:
+        with cls._lock:
+            if not cls._watching:
+                cls._original_run = run = asyncio.Handle._run
+                watching, clock = cls._watching, time.perf_counter
+
+                def timed_run(handle):
+                    monitors = watching.get(handle._loop)
+                    if not monitors:
+                        return run(handle)
+                    t0 = clock()
+                    run(handle)
+                    dt = clock() - t0
+                    for m in monitors:
+                        if dt >= m.slow:
+                            m._slow_callback(handle, dt)
+
+                # TimerHandle inherits _run, so this covers call_soon/call_later/task steps alike
+                asyncio.Handle._run = timed_run
+            # replaced, not appended to: timed_run may be reading it from another loop's thread
+            cls._watching[loop] = cls._watching.get(loop, ()) + (monitor,)
+
+    @classmethod
+    def _unwatch(cls, loop: asyncio.AbstractEventLoop, monitor: "LoopMonitor") -> None:
+        with cls._lock:
+            left = tuple(m for m in cls._watching.get(loop, ()) if m is not monitor)
+            if left:
+                cls._watching[loop] = left
+            else:
+                cls._watching.pop(loop, None)
+            if not cls._watching and cls._original_run is not None:
+                asyncio.Handle._run = cls._original_run
+                cls._original_run = None
+
+    async def _beat(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                t = loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - t - self.interval)
+                self.lags.append(lag)
+                self.beats += 1
+                self.max_lag = max(self.max_lag, lag)
+        finally:
+            self._stop_timing()  # also when the loop shuts down with the scan never stopped
+
+    def _stop_timing(self) -> None:
+        if self._loop is not None:
+            self._unwatch(self._loop, self)
+            self._loop = None
+
+    def _slow_callback(self, handle: asyncio.Handle, dt: float) -> None:
+        # name it like asyncio's debug log does: the task for task steps, else the handle
+        task = getattr(handle._callback, "__self__", None)
+        what = repr(task) if isinstance(task, asyncio.Task) else repr(handle)
+        self.slow_count += 1
+        self.slow_seconds += dt
+        item = (dt, what[:300])
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, item)
+        else:
+            heapq.heappushpop(self.slowest, item)
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+        self._stop_timing()
+
+    def summary(self) -> dict:
+        lags = sorted(self.lags)
+        return {
+            "heartbeat_ms": self.interval * 1000.0,
+            "loop_lag_ms": {
+                "beats": self.beats,
+                "p50": quantile(lags, 0.50) * 1000.0,
+                "p90": quantile(lags, 0.90) * 1000.0,
+                "p99": quantile(lags, 0.99) * 1000.0,
+                "max": self.max_lag * 1000.0,
+            },
+            "slow_callbacks": {
+                "threshold_ms": self.slow * 1000.0 if self.slow > 0 else None,
+                "count": self.slow_count,
+                "seconds_total": self.slow_seconds,
+                "slowest": [{"ms": dt * 1000.0, "callback": what} for dt, what in sorted(self.slowest, reverse=True)],
+            },
+        }
+
+
+class ScanProfiler:
+    """
+    --profile-out: cProfile (a pstats file) or a stack sampler around the scan. The sampler
+    reads the loop thread's Python stack every `interval` from a daemon thread and writes
+    folded stacks ("outer;...;inner count" per line, for flamegraph.pl or speedscope);
+    samples ending in the selector's poll are the loop waiting on I/O. Both cover the
+    event-loop thread only, not the --engine raw sweep thread.
+    """
+
+    def __init__(self, kind: str, path: str, interval: float = 0.005):
+        self.kind = kind
+        self.path = path
+        self.interval = interval
+        self.samples = 0
+        self.stacks: dict[str, int] = {}
+        self._prof: Optional[cProfile.Profile] = None
+        self._thread: Optional[threading.Thread] = None
+        self._done = threading.Event()
+
+    def start(self) -> None:
+        if self.kind == "cprofile":
+            self._prof = cProfile.Profile()
+            self._prof.enable()
+        else:
+            self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+            self._thread.start()
+
+    def _sample(self, target: int) -> None:
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self) -> None:
+        if self._prof is not None:
+            self._prof.disable()
+            self._prof.dump_stats(self.path)
+            return
+        self._done.set()
+        if self._thread is not None:
+            self._thread.join()
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, n in sorted(self.stacks.items(), key=lambda x: -x[1]):
+                f.write(f"{stack} {n}\n")
+
+    def summary(self) -> dict:
+        out = {"profiler": self.kind, "output": self.path}
+        if self.kind == "sample":
+            out["samples"] = self.samples
+        return out
+
+
+def profile_line(summary: dict) -> str:
+    """One-line loop lag + slow callback summary for the terminal."""
+    lag = summary["loop_lag_ms"]
+    slow = summary["slow_callbacks"]
+    line = f"loop lag p50/p90/p99/max {lag['p50']:.1f}/{lag['p90']:.1f}/{lag['p99']:.1f}/{lag['max']:.1f}ms"
+    if slow["threshold_ms"] is not None:
+        line += f" | slow callbacks (>{slow['threshold_ms']:g}ms) {slow['count']}, {slow['seconds_total']:.2f}s"
+    printer = summary.get("printer")
+    if printer and printer["ticks"]:
+        line += f" | printer {printer['ticks']} ticks, {printer['busy_ms_total']:.1f}ms busy"
+    return line
+
+
+# ----------------------------
+# Persistent state (incremental rescans)
+# ----------------------------
+
+class StateStore:
+    """
+    SQLite record of the last scans: kept results keyed by
+    (host, port, scheme, path) with status + fingerprint, the open (host, port) set,
+    and when each host last had a full sweep. Used to diff runs and for --incremental.
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS results (
+        host TEXT NOT NULL, port INTEGER NOT NULL, scheme TEXT NOT NULL, path TEXT NOT NULL,
+        status INTEGER, reason TEXT, fingerprint TEXT,
+        first_seen REAL NOT NULL, last_seen REAL NOT NULL,
+        PRIMARY KEY (host, port, scheme, path)
+    );
+    CREATE TABLE IF NOT EXISTS open_ports (
+        host TEXT NOT NULL, port INTEGER NOT NULL, last_seen REAL NOT NULL,
+        PRIMARY KEY (host, port)
+    );
+    CREATE TABLE IF NOT EXISTS sweeps (
+        host TEXT PRIMARY KEY, last_full REAL
+    );
+    CREATE TABLE IF NOT EXISTS port_hits (
+        host TEXT NOT NULL, port INTEGER NOT NULL, runs INTEGER NOT NULL, last_hit REAL NOT NULL,
+        PRIMARY KEY (host, port)
+    );
+    """
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __enter__(self) -> "StateStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def known_open(self) -> list[Tuple[str, int]]:
+        rows = self.db.execute(
+            "SELECT host, port FROM open_ports UNION SELECT host, port FROM results ORDER BY host, port"
+        )
+        return [(host, port) for host, port in rows]
+
+    def last_full_sweeps(self) -> dict[str, float]:
+        return dict(self.db.execute("SELECT host, last_full FROM sweeps"))
+
+    def hit_history(self) -> dict[str, dict[int, int]]:
+        """host -> {port: number of recorded runs that kept a hit there} (for --order priority)."""
+        history: dict[str, dict[int, int]] = {}
+        for host, port, runs in self.db.execute("SELECT host, port, runs FROM port_hits"):
+            history.setdefault(host, {})[port] = runs
+        return history
+
+    def results(self) -> dict[Tuple[str, int, str, str], Tuple[Optional[int], str]]:
+        rows = self.db.execute("SELECT host, port, scheme, path, status, fingerprint FROM results")
+        return {(host, port, scheme, path): (status, fp) for host, port, scheme, path, status, fp in rows}
+
+    def update(
+        self,
+        in_scope,
+        open_targets: Iterable[Tuple[str, int]],
+        hits: Sequence[Hit],
+        swept_hosts: Iterable[str] = (),
+    ) -> list[dict]:
+        """
+        Replace the state of every (host, port) with in_scope(host, port) by this
+        run's results and return the change events relative to what was stored.
+        swept_hosts get their last full sweep time set to now.
+        """
+        now = time.time()
+        old = {k: v for k, v in self.results().items() if in_scope(k[0], k[1])}
+        new = {(h.host, h.port, h.scheme, h.path): h for h in hits}
+        changes = diff_results(old, new)
+
+        with self.db:
+            self.db.executemany(
+                "DELETE FROM results WHERE host = ? AND port = ? AND scheme = ? AND path = ?",
+                [k for k in old if k not in new],
+            )
+            self.db.executemany(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (host, port, scheme, path) DO UPDATE SET "
+                "status = excluded.status, reason = excluded.reason, "
+                "fingerprint = excluded.fingerprint, last_seen = excluded.last_seen",
+                [(h.host, h.port, h.scheme, h.path, h.status, h.reason, h.fingerprint, now, now) for h in hits],
+            )
+
+            open_now = set(open_targets)
+            stale = [t for t in self.known_open() if in_scope(*t) and t not in open_now]
+            self.db.executemany("DELETE FROM open_ports WHERE host = ? AND port = ?", stale)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO open_ports VALUES (?, ?, ?)", [(h, p, now) for h, p in sorted(open_now)]
+            )
+            self.db.executemany("INSERT OR REPLACE INTO sweeps VALUES (?, ?)", ((h, now) for h in swept_hosts))
+        self.record_hits(hits, now)
+        return changes
+
+    def record_hits(self, hits: Sequence[Hit], now: Optional[float] = None) -> None:
+        """Count one more run with kept hits for each (host, port) in hits (--order priority history)."""
+        now = time.time() if now is None else now
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO port_hits VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (host, port) DO UPDATE SET runs = runs + 1, last_hit = excluded.last_hit",
+                [(h, p, now) for h, p in sorted({(h.host, h.port) for h in hits})],
+            )
+
+
+def diff_results(
+    old: dict[Tuple[str, int, str, str], Tuple[Optional[int], str]],
+    new: dict[Tuple[str, int, str, str], Hit],
+) -> list[dict]:
+    """Change events between two result sets: appeared / disappeared / changed (status or fingerprint)."""
+    changes: list[dict] = []
+    for key in sorted(set(old) | set(new), key=lambda k: (host_sort_key(k[0]), k[1:])):
+        host, port, scheme, path = key
+        before = old.get(key)
+        after = new.get(key)
+        if before is None and after is not None:
+            event = "appeared"
+        elif after is None and before is not None:
+            event = "disappeared"
+        elif before is not None and after is not None and before != (after.status, after.fingerprint):
+            event = "changed"
+        else:
+            continue
+        changes.append({
+            "event": event,
+            "host": host,
+            "port": port,
+            "scheme": scheme,
+            "path": path,
+            "status": after.status if after else None,
+            "fingerprint": after.fingerprint if after else None,
+            "previous_status": before[0] if before else None,
+            "previous_fingerprint": before[1] if before else None,
+        })
+    return changes
+
+
+# ----------------------------
+# Interactive wizard
+# ----------------------------
+
+def wizard() -> argparse.Namespace:
+    print("\nLocalhost Port Scanner — interactive setup\n")
+
+    def ask(prompt: str, default: str) -> str:
+        s = input(f"{prompt} [{default}]: ").strip()
+        return s if s else default
+
+    preset = ask("Preset (dev/common/full/custom)", "dev").lower()
+    host = ask("Host(s): names, IPs, CIDRs, @file (comma separated)", "127.0.0.1")
+    targets = parse_targets(host) or ["127.0.0.1"]
+    timeout = float(ask("Timeout seconds per probe", "0.35"))
+    concurrency = int(ask("Concurrency (higher=faster, too high can be noisy)", "600"))
+    max_bytes = int(ask("Max bytes to read per response", "8192"))
+    retries = int(ask("Retries per scheme/path (0 is fine)", "0"))
+    adaptive = ask("Adapt concurrency/timeout to measured RTTs? (y/n)", "n").lower().startswith("y")
+    sweep = ask("TCP connect sweep before HTTP probing? (y/n)", "y").lower().startswith("y")
+
+    if preset == "custom":
+        start = int(ask("Start port", "1"))
+        end = int(ask("End port", "65535"))
+        ranges = [(start, end)]
+    else:
+        ranges = chunked_ranges_from_preset(preset)
+
+    scheme_order = ask("Schemes to try (comma separated: http,https, or auto)", "http,https")
+    schemes = normalize_schemes(scheme_order)
+
+    paths_raw = ask("Paths to probe (comma separated)", "/")
+    paths = [p.strip() for p in paths_raw.split(",") if p.strip()]
+    if not paths:
+        paths = ["/"]
+    keep_alive = False
+    if len(paths) > 1:
+        keep_alive = ask("Probe all paths over one keep-alive connection? (y/n)", "n").lower().startswith("y")
+
+    ignore_classes_raw = ask("Ignore status classes? (e.g. 2,3,4 or blank)", "")
+    ignore_classes = {int(x.strip()) for x in ignore_classes_raw.split(",") if x.strip().isdigit()}
+
+    ignore_codes_raw = ask("Ignore specific status codes? (e.g. 401,404 or blank)", "")
+    ignore_codes = {int(x.strip()) for x in ignore_codes_raw.split(",") if x.strip().isdigit()}
+
+    match_mode = ask("Require content match? (none/substr/regex)", "none").lower()
+    match_substring = None
+    match_regex = None
+    if match_mode == "substr":
+        match_substring = ask("Substring to require (case-sensitive)", "api")
+    elif match_mode == "regex":
+        pat = ask("Regex to require", r'"status"\s*:\s*"ok"')
+        match_regex = pat
+
+    include_headers = ask("Search match in headers too? (y/n)", "y").lower().startswith("y")
+    where = ask('Filter expression? (e.g. status in 2xx and header.server ~ "nginx", blank for none)', "")
+    builtin_tags = ask("Tag hits with the built-in patterns (frameworks, admin panels...)? (y/n)", "n").lower().startswith("y")
+    verbose = ask("Verbose per-hit logging? (y/n)", "n").lower().startswith("y")
+
+    out_json = ask("Write JSON output file? (blank for none)", "")
+    out_csv = ask("Write CSV output file? (blank for none)", "")
+    out_ndjson = ask("Stream hits to an NDJSON file as they are found? (blank for none)", "")
+
+    # Convert into a Namespace that matches argparse fields we use
+    ns = argparse.Namespace(
+        interactive=True,
+        host=targets[0],
+        targets=targets,
+        order=None,
+        seed=None,
+        per_host_concurrency=0,
+        workers=1,
+        shard=None,
+        full_sweep=None,
+        preset=preset,
+        ranges=ranges,
+        start=None,
+        end=None,
+        exclude_ports=set(),
+        schemes=schemes,
+        paths=paths,
+        keep_alive=keep_alive,
+        timeout=timeout,
+        concurrency=concurrency,
+        max_bytes=max_bytes,
+        retries=retries,
+        retry_backoff=0.05,
+        shape="get",
+        record=None,
+        replay=None,
+        profile=False,
+        profile_slow=20.0,
+        profile_out=None,
+        profiler="cprofile",
+        adaptive=adaptive,
+        max_timeout=2.0,
+        sweep=sweep,
+        engine="asyncio",
+        max_rate=0.0,
+        port_share=None,
+        ignore_status_classes=ignore_classes,
+        ignore_status_codes=ignore_codes,
+        match_substring=match_substring,
+        match_regex=match_regex,
+        match_in_headers=include_headers,
+        where=where or None,
+        identify=True,
+        signatures=None,
+        favicon=False,
+        tag_specs=list(BUILTIN_TAGS) if builtin_tags else [],
+        first=0,
+        stop_when_match=False,
+        show=0,
+        verbose=verbose,
+        log_every=0.15,
+        quiet=False,
+        watch=None,
+        events_socket=None,
+        state_db=None,
+        incremental=False,
+        full_every=3600.0,
+        json_out=out_json if out_json else None,
+        ndjson_out=out_ndjson if out_ndjson else None,
+        csv_stream_out=None,
+        stream_only=False,
+        csv_out=out_csv if out_csv else None,
+        metrics_file=None,
+        metrics_port=None,
+    )
+    return ns
+
+
+# ----------------------------
+# Main runner
+# ----------------------------
+
+def install_sigint_event() -> asyncio.Event:
+    """Event that Ctrl-C sets, so scans stop cleanly instead of raising mid-probe."""
+    stop_event = asyncio.Event()
+
+    def _handle_sigint(*_):
+        stop_event.set()
+
+    try:
+        signal.signal(signal.SIGINT, _handle_sigint)
+    except Exception:
+        pass
+    return stop_event
+
+
+@dataclass
+class ScanPlan:
+    space: TargetSpace
+    order: str
+    targets: Iterator[Tuple[str, int]]
+    total: int
+    full_sweep: bool
+    known: list[Tuple[str, int]]
+
+
+def plan_targets(args: argparse.Namespace, store: Optional[StateStore]) -> ScanPlan:
+    """
+    What this run scans, in which order. Deterministic for a given args.seed and
+    store, so every --workers shard computes the same plan and takes its slice.
+    """
+    if args.preset:
+        ranges = chunked_ranges_from_preset(args.preset)
+    else:
+        ranges = [(args.start, args.end)]
+
+    hosts = HostSpace(args.targets)
+    space = TargetSpace(hosts, PortSpace(ranges, set(args.exclude_ports or [])))
+    order = args.order or ("random" if len(hosts) > 1 else "priority")
+    history = store.hit_history() if store and order == "priority" else None
+    targets: Iterator[Tuple[str, int]] = space.iter(order, args.seed, history)
+    total = len(space)
+
+    # Persistent state: recheck known-open targets first; sweep the rest only when a full pass is due
+    full_sweep = True
+    known: list[Tuple[str, int]] = []
+    if store:
+        known = [t for t in store.known_open() if t in space]
+        if args.incremental:
+            full_sweep = args.full_sweep
+            if full_sweep is None:
+                last = store.last_full_sweeps()
+                now = time.time()
+                full_sweep = any(now - last.get(h, 0.0) >= args.full_every for h in hosts)
+            known_set = set(known)
+            if full_sweep:
+                targets = chain(known, (t for t in targets if t not in known_set))
+            else:
+                targets = iter(known)
+                total = len(known)
+
+    if args.shard is not None:
+        k, n = args.shard
+        targets = islice(targets, k, None, n)
+        total = len(range(k, total, n))
+
+    return ScanPlan(space, order, targets, total, full_sweep, known)
+
+
+def record_results(
+    store: StateStore,
+    plan: ScanPlan,
+    open_targets: Sequence[Tuple[str, int]],
+    hits: Sequence[Hit],
+    sweep: bool,
+) -> list[dict]:
+    """Write a finished run into the store; returns the change events."""
+    # Without a sweep, "open" is only known for targets that answered HTTP.
+    seen_open = open_targets if sweep else sorted({(h.host, h.port) for h in hits})
+    if plan.full_sweep:
+        return store.update(lambda h, p: (h, p) in plan.space, seen_open, hits, plan.space.hosts)
+    known_set = set(plan.known)
+    return store.update(lambda h, p: (h, p) in known_set, seen_open, hits)
+
+
+def counts_toward_first(args: argparse.Namespace, hit: Hit) -> bool:
+    """--stop-when-match with --tag rules waits for a tagged hit; otherwise every kept hit counts."""
+    return not (args.stop_when_match and args.tag_specs) or bool(hit.tags)
+
+
+def make_hit(
+    host: str,
+    port: int,
+    r: ProbeResult,
+    fingerprints: Optional[FingerprintDB] = None,
+    fav: Optional[int] = None,
+) -> Hit:
+    """The Hit for a probe result that passed the filters (identified when fingerprints is given)."""
+    product = version = None
+    if fingerprints is not None:
+        product, version = fingerprints.identify(r.headers_text, r.title, r.body, fav)
+    return Hit(
+        host=host,
+        port=port,
+        scheme=r.scheme,
+        path=r.path,
+        status=r.status,
+        reason=r.reason,
+        matched=True,
+        sample=r.snippet,
+        alpn=r.alpn,
+        fingerprint=response_fingerprint(r.status, r.headers_text, r.snippet),
+        tags=list(r.tags),
+        product=product,
+        version=version,
+        favicon_hash=fav,
+    )
+
+
+async def run_scan(
+    args: argparse.Namespace,
+    stats: Optional[dict] = None,
+    tls: Optional[TLSClient] = None,
+    stop_event: Optional[asyncio.Event] = None,
+    state: Optional[LiveState] = None,
+    on_hit: Optional[Callable[[Hit], None]] = None,
+    keep_hits: bool = True,
+) -> list[Hit]:
+    """
+    Scan and return kept hits sorted by (host, port, scheme, path).
+    If a stats dict is passed it is filled with scan-level details for the JSON meta.
+    Pass tls to keep one TLS context/session cache across scans, and stop_event to
+    control cancellation yourself (no SIGINT handler is installed then). A passed
+    state receives the live counters; on_hit is called for each kept hit as it is found.
+    With keep_hits=False hits only go to on_hit and the returned list stays empty.
+    """
+    if args.workers > 1 and args.shard is None:
+        return await run_sharded(args, stats, stop_event=stop_event, on_hit=on_hit, keep_hits=keep_hits, state=state)
+
+    store = StateStore(args.state_db) if args.state_db else None
+    plan = plan_targets(args, store)
+    targets, total = plan.targets, plan.total
+
+    # All keep/drop rules as one predicate
+    hit_filter = HitFilter(
+        args.ignore_status_classes,
+        args.ignore_status_codes,
+        args.match_substring,
+        args.match_regex,
+        args.match_in_headers,
+        args.where,
+    )
+    # --record keeps whole responses, so a replay can change the status rules too
+    recorder = ResponseRecorder(args.record) if args.record else None
+    skip_status = hit_filter.skips_status if hit_filter.prunes_status and not recorder else None
+
+    # Cancellation support
+    if stop_event is None:
+        stop_event = install_sigint_event()
+
+    if state is None:
+        state = LiveState(total=total, verbose=args.verbose, log_every=args.log_every)
+    state.total = total
+    ctrl = AdaptiveController(args.timeout, args.concurrency, args.max_timeout) if args.adaptive else None
+    state.controller = ctrl
+    metrics = state.metrics = state.metrics or ProbeMetrics()
+    printer_task = asyncio.create_task(state.printer()) if not args.quiet else None
+    exporter = MetricsExporter(state, args.metrics_file, args.metrics_port)
+    await exporter.start()
+    monitor = LoopMonitor(slow=args.profile_slow / 1000.0) if args.profile else None
+    if monitor:
+        monitor.start()
+    profiler = ScanProfiler(args.profiler, args.profile_out) if args.profile_out else None
+    if profiler:
+        profiler.start()
+
+    hits: list[Hit] = []
+    hits_lock = asyncio.Lock()
+    tls = tls or TLSClient()
+
+    per_host = HostLimiter(args.per_host_concurrency)
+
+    # --first / --stop-when-match: enough kept hits end the scan early (unlike a stop, not an interruption)
+    first = 1 if args.stop_when_match else args.first
+    first_found = 0
+    enough = asyncio.Event()
+
+    def halted() -> bool:
+        # Workers check this too: a cancellation can get lost in a wait_for() that was just finishing.
+        return stop_event.is_set() or enough.is_set()
+
+    patterns = PatternSet(args.tag_specs) if args.tag_specs else None
+    fingerprints = FingerprintDB.load(args.signatures) if args.identify else None
+    pacer = ConnectPacer(args.max_rate, args.port_share or 0.8)
+    need_full_body = patterns is not None or recorder is not None
+    # Identification works from the snippet-sized start of the body that filters read too
+    reads_body = hit_filter.reads_body or fingerprints is not None
+    shaper = ProbeShaper(probe_shape(args.shape, reads_body, need_full_body))
+    # Past the headers only the snippet is left, and only filters, identification and change
+    # tracking (--state-db, --watch fingerprints) need it to be complete
+    read_body = need_full_body or reads_body or bool(args.state_db or args.watch)
+
+    @contextlib.asynccontextmanager
+    async def slot(host: str):
+        # host cap first, so a busy host doesn't hold global window slots while it waits
+        async with per_host.slot(host):
+            async with (ctrl.slot() if ctrl else contextlib.nullcontext()):
+                yield
+
+    async def scan_port(host: str, port: int) -> None:
+        nonlocal first_found
+        state.set_current(f"probing {host}:{port}")
+        timeout = ctrl.probe_timeout if ctrl else args.timeout
+        t0 = time.perf_counter()
+        async with slot(host):
+            res = await probe_port(
+                host=host,
+                port=port,
+                schemes=args.schemes,
+                paths=args.paths,
+                timeout=timeout,
+                max_bytes=args.max_bytes,
+                retries=args.retries,
+                retry_backoff=args.retry_backoff,
+                shaper=shaper,
+                addrs=addrs_for(host),
+                keep_alive=args.keep_alive,
+                tls=tls,
+                skip_status=skip_status,
+                patterns=patterns,
+                read_body=read_body,
+                metrics=metrics,
+                pacer=pacer,
+            )
+        if ctrl:
+            for r in res:
+                if r.ttfb is not None:
+                    ctrl.record_ttfb(r.ttfb)
+            if not res:
+                # No typed failure here: a probe that used up its timeout budget counts as one.
+                if time.perf_counter() - t0 >= timeout * 0.9:
+                    ctrl.record_timeout()
+                else:
+                    ctrl.record_ok()
+        if not res:
+            return
+
+        state.bump_http_hits(1)
+        if recorder:
+            for r in res:
+                recorder.write(host, port, r)
+
+        # Filter each (scheme,path) hit
+        favicons: dict[str, Optional[int]] = {}
+        for r in res:
+            if not hit_filter.accepts(host, port, r):
+                continue
+
+            fav = None
+            if args.favicon:
+                if r.scheme not in favicons:
+                    icon, _ = await probe_once(
+                        host, port, r.scheme, "/favicon.ico", timeout, 1 << 16, tls, full_body=True, pacer=pacer,
+                        addrs=addrs_for(host),
+                    )
+                    ok = icon is not None and icon.status == 200 and icon.body
+                    favicons[r.scheme] = favicon_hash(icon.body) if ok else None
+                fav = favicons[r.scheme]
+
+            hit = make_hit(host, port, r, fingerprints, fav)
+            async with hits_lock:
+                if enough.is_set():
+                    return
+                if keep_hits or store:
+                    hits.append(hit)
+                state.bump_kept_hits(1)
+                if on_hit is not None:
+                    on_hit(hit)
+                if args.verbose and not args.quiet:
+                    code = hit.status if hit.status is not None else "?"
+                    print(f"\n+ hit {hit.host}:{hit.port} {hit.scheme.upper()} {hit.path} {code} {hit.reason} | {hit.sample}")
+                if first and counts_toward_first(args, hit):
+                    first_found += 1
+                    if first_found >= first:
+                        enough.set()
+
+    # A target whose probe or hit callback raised: the worker moves on to the next target,
+    # and the scan reports these as not scanned (stats["failed_targets"]) instead of stopping.
+    failed_targets: list[Tuple[str, int]] = []
+    target_errors: list[str] = []
+
+    async def guarded(coro: Awaitable[None], host: str, port: int) -> bool:
+        try:
+            await coro
+            return True
+        except Exception as e:
+            failed_targets.append((host, port))
+            if len(target_errors) < 5:
+                target_errors.append(f"{host}:{port}: {e!r}")
+            return False
+
+    async def worker() -> None:
+        # Every worker pulls from the same lazy target iterator. next() never
+        # awaits, so the workers can share it without a lock.
+        for host, port in targets:
+            if halted():
+                return
+            await guarded(scan_port(host, port), host, port)
+            state.bump_scanned(1)
+
+    # Phase 1 (--sweep): bare TCP connects; only open targets are queued for HTTP probing.
+    open_targets: list[Tuple[str, int]] = []
+    open_q: asyncio.Queue[Optional[Tuple[str, int]]] = asyncio.Queue()
+    addr_cache: dict[str, list[Tuple[int, str]]] = {}
+
+    def addrs_for(host: str) -> list[Tuple[int, str]]:
+        try:
+            ip = ipaddress.ip_address(host)
+        except ValueError:
+            if host not in addr_cache:
+                addr_cache[host] = resolve_host(host)
+            return addr_cache[host]
+        return [(socket.AF_INET6 if ip.version == 6 else socket.AF_INET, host)]
+
+    async def sweep_worker() -> None:
+        for host, port in targets:
+            if halted():
+                return
+            if not await guarded(sweep_target(host, port), host, port):
+                state.bump_scanned(1)
+
+    async def sweep_target(host: str, port: int) -> None:
+        state.set_current(f"connect {host}:{port}")
+        t0 = time.perf_counter()
+        async with slot(host):
+            t1 = time.perf_counter()
+            alive = await tcp_alive(
+                addrs_for(host), port, ctrl.connect_timeout if ctrl else args.timeout, pacer, metrics
+            )
+            metrics.observe("sweep", time.perf_counter() - t1)
+        if ctrl:
+            if alive == "timeout":
+                ctrl.record_timeout()
+            elif alive == "error":
+                ctrl.record_error()
+            else:
+                ctrl.record_connect(time.perf_counter() - t0)
+        swept(host, port, alive)
+
+    def swept(host: str, port: int, alive: str) -> None:
+        metrics.sweep[alive] += 1
+        state.bump_scanned(1)
+        if alive == "open":
+            open_targets.append((host, port))
+            state.bump_open_ports(1)
+            open_q.put_nowait((host, port))
+
+    def swept_batch(batch: list) -> None:
+        # --engine raw: runs on the loop, one call per select() round of the sweep thread
+        for host, port, alive, seconds, err in batch:
+            metrics.observe("sweep", seconds)
+            if err:
+                metrics.socket_error(err)
+            swept(host, port, alive)
+
+    # Phase 2: probe workers drain the open-target queue until they see the sentinel.
+    async def probe_worker() -> None:
+        while True:
+            target = await open_q.get()
+            if target is None or halted():
+                return
+            await guarded(scan_port(*target), *target)
+
+    async def sweep_phase(n_probers: int) -> None:
+        if args.engine == "raw":
+            loop = asyncio.get_running_loop()
+            state.set_current("raw connect sweep")
+            await loop.run_in_executor(
+                None, raw_sweep, targets, addrs_for, args.timeout, args.concurrency, args.per_host_concurrency,
+                lambda batch: loop.call_soon_threadsafe(swept_batch, batch),
+                halted, pacer,
+            )
+        else:
+            await asyncio.gather(*(sweep_worker() for _ in range(n_workers)))
+        for _ in range(n_probers):
+            open_q.put_nowait(None)
+
+    # Fixed pool: memory and scheduling cost depend on --concurrency, not on the range size
+    n_workers = max(1, min(args.concurrency, total))
+    if args.sweep:
+        tasks = [asyncio.create_task(sweep_phase(n_workers))]
+        tasks += [asyncio.create_task(probe_worker()) for _ in range(n_workers)]
+    else:
+        tasks = [asyncio.create_task(worker()) for _ in range(n_workers)]
+    pool = asyncio.gather(*tasks)
+    stopper = asyncio.create_task(stop_event.wait())
+    satisfied = asyncio.create_task(enough.wait())
+
+    # Wait; allow early stop
+    await asyncio.wait({pool, stopper, satisfied}, return_when=asyncio.FIRST_COMPLETED)
+
+    # Per-target errors are caught in the workers, so this is a bug or a failed sweep thread:
+    # the rest of the pool can't finish the scan, so it's cancelled and the error re-raised below
+    error = pool.exception() if pool.done() and not pool.cancelled() else None
+    # If stopped (or --first is satisfied, or failed), cancel the in-flight probes
+    if stop_event.is_set() or enough.is_set() or error is not None:
+        for t in tasks:
+            t.cancel()
+    stopper.cancel()
+    satisfied.cancel()
+    await asyncio.gather(*tasks, stopper, satisfied, return_exceptions=True)
+
+    state.stop()
+    await exporter.close()
+    if recorder:
+        recorder.close()
+    if printer_task is not None:
+        await asyncio.sleep(0.05)
+        printer_task.cancel()
+        with contextlib_suppress():
+            await printer_task
+
+        # Final newline so the carriage-return progress line doesn’t eat the summary
+        print()
+    if profiler:
+        profiler.stop()
+    if monitor:
+        await monitor.stop()
+    if error is not None:
+        if store:
+            store.close()
+        raise error
+
+    hits.sort(key=lambda h: (host_sort_key(h.host), h.port, h.scheme, h.path))
+
+    changes: Optional[list[dict]] = None
+    if store:
+        # a shard only reads the store; the parent records the merged run
+        if args.shard is None and not stop_event.is_set() and not failed_targets:
+            if enough.is_set():
+                store.record_hits(hits)  # partial pass: only feed --order priority
+            else:
+                changes = record_results(store, plan, open_targets, hits, args.sweep)
+        store.close()
+        if not keep_hits:
+            hits = []
+
+    if stats is not None:
+        stats["order"] = plan.order
+        stats["sweep"] = bool(args.sweep)
+        stats["engine"] = args.engine
+        if first:
+            stats["first"] = first
+            stats["stopped_early"] = enough.is_set()
+        stats["open_ports"] = (
+            sorted(open_targets, key=lambda t: (host_sort_key(t[0]), t[1])) if args.sweep else None
+        )
+        if failed_targets:
+            stats["failed_targets"] = sorted(failed_targets, key=lambda t: (host_sort_key(t[0]), t[1]))
+            stats["target_errors"] = target_errors
+            stats["lost_targets"] = target_ranges(failed_targets)
+        stats["tls"] = tls.summary()
+        stats["metrics"] = metrics.summary()
+        stats["pacing"] = pacer.summary()
+        stats["shape"] = shaper.summary()
+        if recorder:
+            stats["recorded"] = {"archive": args.record, "responses": recorder.count}
+        if monitor:
+            stats["profile"] = {**monitor.summary(), "printer": state.printer_summary()}
+            if profiler:
+                stats["profile"].update(profiler.summary())
+        if ctrl:
+            stats["adaptive"] = ctrl.summary()
+        if store:
+            stats["incremental"] = bool(args.incremental)
+            stats["full_sweep"] = plan.full_sweep
+            stats["changes"] = changes
+
+    return hits
+
+
+# ----------------------------
+# Multi-process sharding (--workers)
+# ----------------------------
+
+def _shard_main(args: argparse.Namespace, out) -> None:
+    """Entry point of one --workers process: scan args.shard, stream hits and counters to out."""
+    k = args.shard[0]
+    state = LiveState(total=0, verbose=False, log_every=args.log_every)
+
+    def progress() -> tuple:
+        metrics = state.metrics.summary() if state.metrics else None
+        return ("progress", k, state.total, state.scanned, state.open_ports, state.http_hits, state.kept_hits, metrics)
+
+    async def scan() -> dict:
+        stats: dict = {}
+
+        async def report() -> None:
+            while True:
+                out.put(progress())
+                await asyncio.sleep(args.log_every)
+
+        reporter = asyncio.create_task(report())
+        try:
+            # Hit objects don't unpickle in the parent (the class lives in __mp_main__ here), so send dicts
+            await run_scan(args, stats, state=state, on_hit=lambda h: out.put(("hit", asdict(h))), keep_hits=False)
+        finally:
+            reporter.cancel()
+        return stats
+
+    stats = asyncio.run(scan())
+    out.put(progress())
+    out.put(("done", k, stats))
+
+
+def _get_message(q, timeout: float):
+    try:
+        return q.get(timeout=timeout)
+    except queue.Empty:
+        return None
+
+
+def merge_shard_stats(shards: Sequence[dict]) -> dict:
+    """One stats dict from the per-shard ones: lists concatenated, TLS counters summed."""
+    first = shards[0] if shards else {}
+    merged: dict = {"order": first.get("order"), "sweep": first.get("sweep"), "engine": first.get("engine")}
+
+    if first.get("open_ports") is not None:
+        open_targets = [tuple(t) for s in shards for t in s.get("open_ports") or []]
+        merged["open_ports"] = sorted(open_targets, key=lambda t: (host_sort_key(t[0]), t[1]))
+    else:
+        merged["open_ports"] = None
+
+    tls = [s["tls"] for s in shards if s.get("tls")]
+    handshakes = sum(t["handshakes"] for t in tls)
+    resumed = sum(t["resumed"] for t in tls)
+    ms_total = sum(t["handshake_ms_total"] for t in tls)
+    merged["tls"] = {
+        "handshakes": handshakes,
+        "resumed": resumed,
+        "resumption_rate": resumed / handshakes if handshakes else 0.0,
+        "failures": sum(t["failures"] for t in tls),
+        "handshake_ms_avg": ms_total / handshakes if handshakes else 0.0,
+        "handshake_ms_total": ms_total,
+    }
+    merged["metrics"] = ProbeMetrics.merged(s["metrics"] for s in shards if s.get("metrics")).summary()
+    merged["pacing"] = [s["pacing"] for s in shards if s.get("pacing")]  # one pacer per process
+    profiles = [s["profile"] for s in shards if s.get("profile")]
+    if profiles:
+        merged["profile"] = profiles  # one event loop per process
+    shapes = [s["shape"] for s in shards if s.get("shape")]
+    if shapes:
+        merged["shape"] = {
+            "shape": shapes[0]["shape"],
+            "shaped_requests": sum(x["shaped_requests"] for x in shapes),
+            "fallbacks": sum(x["fallbacks"] for x in shapes),
+        }
+    adaptive = [s["adaptive"] for s in shards if s.get("adaptive")]
+    if adaptive:
+        merged["adaptive"] = adaptive  # one controller per process, so per shard
+    return merged
+
+
+def shard_share(limit: int, k: int, n: int) -> int:
+    """
+    Shard k's part of a limit split n ways (0 = unlimited stays 0). The shares add up to
+    the limit, the remainder going to the first shards; every shard gets at least 1, so
+    only a limit below n is exceeded.
+    """
+    if limit <= 0:
+        return 0
+    q, r = divmod(limit, n)
+    return max(1, q + (k < r))
+
+
+def compact_ports(ports: Iterable[int]) -> str:
+    """Sorted ports as ranges: [3000, 3001, 3002, 8080] -> "3000-3002,8080"."""
+    spans: list[list[int]] = []
+    for p in sorted(set(ports)):
+        if spans and p == spans[-1][1] + 1:
+            spans[-1][1] = p
+        else:
+            spans.append([p, p])
+    return ",".join(f"{a}-{b}" if a != b else str(a) for a, b in spans)
+
+
+def target_ranges(targets: Iterable[Tuple[str, int]]) -> dict[str, str]:
+    """host -> compact_ports() of its ports among targets, hosts in display order."""
+    ports: dict[str, list[int]] = {}
+    for host, port in targets:
+        ports.setdefault(host, []).append(port)
+    return {host: compact_ports(ports[host]) for host in sorted(ports, key=host_sort_key)}
+
+
+def shard_targets(args: argparse.Namespace, store: Optional[StateStore], shards: Iterable[int]) -> list[Tuple[str, int]]:
+    """
+    Every target the given shards of args.workers were assigned. args carries the shared
+    seed and full_sweep, so this replans exactly what they saw.
+    """
+    targets: list[Tuple[str, int]] = []
+    for k in shards:
+        child = argparse.Namespace(**vars(args))
+        child.shard = (k, args.workers)
+        targets.extend(plan_targets(child, store).targets)
+    return targets
+
+
+async def run_sharded(
+    args: argparse.Namespace,
+    stats: Optional[dict] = None,
+    stop_event: Optional[asyncio.Event] = None,
+    on_hit: Optional[Callable[[Hit], None]] = None,
+    keep_hits: bool = True,
+    state: Optional[LiveState] = None,
+) -> list[Hit]:
+    """
+    run_scan() split across args.workers processes. Worker k takes every N-th target
+    of the shared plan (same seed, same store snapshot), runs its own event loop with
+    concurrency/N, and streams kept hits and live counters back over a queue. The
+    parent shows progress, writes the store once and returns the same sorted hits.
+    A worker that dies without reporting back is listed in stats["failed_workers"], and
+    the targets it was assigned join the failed ones in stats["lost_targets"]; the scan
+    is then incomplete.
+    """
+    n = args.workers
+    store = StateStore(args.state_db) if args.state_db else None
+    plan = plan_targets(args, store)
+    seed = args.seed if args.seed is not None else random.randrange(1 << 32)
+
+    if stop_event is None:
+        stop_event = install_sigint_event()
+
+    ctx = multiprocessing.get_context("spawn")  # fork + a live event loop don't mix
+    out = ctx.Queue()
+    procs = []
+    for k in range(n):
+        child = argparse.Namespace(**vars(args))
+        child.shard = (k, n)
+        child.seed = seed
+        child.full_sweep = plan.full_sweep
+        child.concurrency = max(1, -(-args.concurrency // n))
+        child.per_host_concurrency = shard_share(args.per_host_concurrency, k, n)
+        child.max_rate = args.max_rate / n
+        child.port_share = 0.8 / n  # all processes draw client ports from the same range
+        child.quiet = True
+        child.metrics_file = child.metrics_port = None  # the parent exports the merged numbers
+        p = ctx.Process(target=_shard_main, args=(child, out), daemon=True)
+        p.start()
+        procs.append(p)
+
+    if state is None:
+        state = LiveState(total=plan.total, verbose=args.verbose, log_every=args.log_every)
+    state.total = plan.total
+    state.set_current(f"{n} workers")
+    state.metrics = ProbeMetrics()
+    printer_task = asyncio.create_task(state.printer()) if not args.quiet else None
+    exporter = MetricsExporter(state, args.metrics_file, args.metrics_port)
+    await exporter.start()
+
+    loop = asyncio.get_running_loop()
+    hits: list[Hit] = []
+    counters: dict[int, tuple] = {}
+    shard_metrics: dict[int, dict] = {}
+    shard_stats: list[dict] = []
+    finished: set[int] = set()
+    failed: list[int] = []
+    failed_targets: list[Tuple[str, int]] = []
+    target_errors: list[str] = []
+    first = 1 if args.stop_when_match else args.first
+    first_found = 0
+    signalled = False
+    while len(finished) < n:
+        if (stop_event.is_set() or (first and first_found >= first)) and not signalled:
+            # Ctrl-C already reached the workers (same process group); this covers other stop sources
+            signalled = True
+            for p in procs:
+                if p.is_alive():
+                    os.kill(p.pid, signal.SIGINT)
+
+        msg = await loop.run_in_executor(None, _get_message, out, 0.1)
+        if msg is None:
+            for k, p in enumerate(procs):
+                if k not in finished and p.exitcode not in (None, 0):
+                    finished.add(k)
+                    failed.append(k)
+            continue
+
+        kind = msg[0]
+        if kind == "hit":
+            if first and first_found >= first:
+                continue  # shards still finishing after --first was met
+            hit = Hit(**msg[1])
+            if first and counts_toward_first(args, hit):
+                first_found += 1
+            if keep_hits or store:
+                hits.append(hit)
+            if on_hit is not None:
+                try:
+                    on_hit(hit)
+                except Exception as e:  # as in run_scan(): the target is reported, the scan goes on
+                    failed_targets.append((hit.host, hit.port))
+                    if len(target_errors) < 5:
+                        target_errors.append(f"{hit.host}:{hit.port}: {e!r}")
+            if args.verbose and not args.quiet:
+                code = hit.status if hit.status is not None else "?"
+                print(f"\n+ hit {hit.host}:{hit.port} {hit.scheme.upper()} {hit.path} {code} {hit.reason} | {hit.sample}")
+        elif kind == "progress":
+            counters[msg[1]] = msg[2:7]
+            state.total, state.scanned, state.open_ports, state.http_hits, state.kept_hits = (
+                sum(c[i] for c in counters.values()) for i in range(5)
+            )
+            if msg[7] is not None:
+                shard_metrics[msg[1]] = msg[7]
+                state.metrics = ProbeMetrics.merged(shard_metrics.values())
+        elif kind == "done":
+            finished.add(msg[1])
+            shard_stats.append(msg[2])
+
+    for p in procs:
+        p.join()
+
+    state.stop()
+    await exporter.close()
+    if printer_task is not None:
+        await asyncio.sleep(0.05)
+        printer_task.cancel()
+        with contextlib_suppress():
+            await printer_task
+        print()
+
+    hits.sort(key=lambda h: (host_sort_key(h.host), h.port, h.scheme, h.path))
+
+    merged = merge_shard_stats(shard_stats)
+    early = bool(first) and first_found >= first
+    failed_targets += [tuple(t) for s in shard_stats for t in s.get("failed_targets") or []]
+    target_errors += [e for s in shard_stats for e in s.get("target_errors") or []]
+    lost_targets = list(failed_targets)
+    if failed:
+        failed.sort()
+        planned = argparse.Namespace(**vars(args))
+        planned.seed, planned.full_sweep = seed, plan.full_sweep
+        lost_targets += shard_targets(planned, store, failed)
+    changes: Optional[list[dict]] = None
+    if store:
+        if not stop_event.is_set() and not lost_targets:
+            if early:
+                store.record_hits(hits)
+            else:
+                changes = record_results(store, plan, merged["open_ports"] or [], hits, args.sweep)
+        store.close()
+        if not keep_hits:
+            hits = []
+
+    if stats is not None:
+        stats.update(merged)
+        stats["workers"] = n
+        if first:
+            stats["first"] = first
+            stats["stopped_early"] = early
+        if failed:
+            stats["failed_workers"] = failed
+        if failed_targets:
+            stats["failed_targets"] = sorted(set(failed_targets), key=lambda t: (host_sort_key(t[0]), t[1]))
+            stats["target_errors"] = target_errors[:5]
+        if lost_targets:
+            stats["lost_targets"] = target_ranges(lost_targets)
+        if store:
+            stats["incremental"] = bool(args.incremental)
+            stats["full_sweep"] = plan.full_sweep
+            stats["changes"] = changes
+
+    return hits
 
 
 # ----------------------------
-# Networking: async probe
+# Record / replay (--record, --replay)
 # ----------------------------
 
-async def probe_once(
-    host: str,
-    port: int,
-    scheme: str,
-    path: str,
-    timeout: float,
-    max_bytes: int,
-) -> Optional[Tuple[Optional[int], str, str, str]]:
-    """
-    Returns (status, reason, headers_text, body_text_snippet) if HTTP-like response; else None.
-    """
-    ssl_ctx = None
-    if scheme == "https":
-        import ssl
-        ssl_ctx = ssl.create_default_context()
-        # dev certs are often self-signed; don't bail scanning because of cert chain
-        ssl_ctx.check_hostname = False
-        ssl_ctx.verify_mode = ssl.CERT_NONE
+# Archive layout: ARCHIVE_MAGIC, then records. Each record is _RECORD (port, scheme code,
+# ttfb seconds or NaN, then the lengths of host, path, alpn and raw) followed by those four
+# byte strings. raw is the response as the probe read it: headers, blank line, body prefix.
+ARCHIVE_MAGIC = b"LPSREC1\n"
+_RECORD = struct.Struct("<HBxfHHHI")
+_SCHEME_CODES = {"http": 0, "https": 1}
 
-    req = (
-        f"GET {path} HTTP/1.1\r\n"
-        f"Host: {host}:{port}\r\n"
-        f"User-Agent: localhost-port-scanner/2.0\r\n"
-        f"Accept: */*\r\n"
-        f"Connection: close\r\n\r\n"
-    ).encode("utf-8", "ignore")
 
+def is_archive(path: str) -> bool:
     try:
-        reader, writer = await asyncio.wait_for(
-            asyncio.open_connection(host=host, port=port, ssl=ssl_ctx),
-            timeout=timeout,
-        )
-        writer.write(req)
-        await asyncio.wait_for(writer.drain(), timeout=timeout)
-
-        raw = b""
-        # Read up to max_bytes (enough to parse headers + some body)
-        while len(raw) < max_bytes:
-            chunk = await asyncio.wait_for(reader.read(2048), timeout=timeout)
-            if not chunk:
-                break
-            raw += chunk
+        with open(path, "rb") as f:
+            return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
 
-        try:
-            writer.close()
-            await writer.wait_closed()
-        except Exception:
-            pass
 
-        if not raw:
-            return None
+def archive_records(buf) -> Iterator[Tuple[Tuple[str, int, str, str], Optional[str], Optional[float], int, int]]:
+    """
+    ((host, port, scheme, path), alpn, ttfb, raw_start, end) for each complete record of an
+    archive held in buf (bytes or an mmap). A record cut short at the tail (a scan killed
+    mid-write) ends the iteration. Raises ValueError if buf isn't an archive.
+    """
+    if buf[: len(ARCHIVE_MAGIC)] != ARCHIVE_MAGIC:
+        raise ValueError("not a --record archive")
+    pos, size = len(ARCHIVE_MAGIC), len(buf)
+    while pos + _RECORD.size <= size:
+        port, code, ttfb, n_host, n_path, n_alpn, n_raw = _RECORD.unpack_from(buf, pos)
+        a = pos + _RECORD.size
+        b = a + n_host
+        c = b + n_path
+        d = c + n_alpn
+        end = d + n_raw
+        if end > size:
+            break
+        key = (buf[a:b].decode("utf-8"), port, "https" if code else "http", buf[b:c].decode("utf-8"))
+        yield key, buf[c:d].decode("ascii") or None, None if ttfb != ttfb else ttfb, d, end
+        pos = end
 
-        status, reason, headers_b, body_b = parse_http_response(raw)
-        if status is None:
-            return None
 
-        headers_text = headers_b.decode("latin-1", "replace")
-        body_text = body_b.decode("utf-8", "replace")
+class ResponseRecorder:
+    """
+    --record: appends every HTTP response a scan reads to an archive, creating it if needed.
+    An existing archive is cut back to its last complete record first, so a killed scan
+    doesn't leave a torn record in the middle of the file.
+    """
 
-        # small snippet for display
-        snippet = " ".join(body_text.strip().split())
-        snippet = snippet[:160]
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "r+b") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                end = len(ARCHIVE_MAGIC)
+                for *_, end in archive_records(mm):
+                    pass
+            if end < os.path.getsize(path):
+                os.truncate(path, end)
+        self.f = open(path, "ab")
+        if self.f.tell() == 0:
+            self.f.write(ARCHIVE_MAGIC)
 
-        return status, reason, headers_text, snippet
+    def write(self, host: str, port: int, r: ProbeResult) -> None:
+        h, p, a = host.encode("utf-8"), r.path.encode("utf-8"), (r.alpn or "").encode("ascii")
+        # headers_text is the latin-1 decoding of the header bytes, so this gives them back unchanged
+        raw = r.headers_text.encode("latin-1") + b"\r\n\r\n" + r.body
+        ttfb = r.ttfb if r.ttfb is not None else float("nan")
+        self.f.write(_RECORD.pack(port, _SCHEME_CODES[r.scheme], ttfb, len(h), len(p), len(a), len(raw)))
+        self.f.write(h + p + a + raw)
+        self.count += 1
 
-    except Exception:
-        return None
+    def close(self) -> None:
+        self.f.close()
 
 
-async def probe_port(
-    host: str,
-    port: int,
-    schemes: Sequence[str],
-    paths: Sequence[str],
-    timeout: float,
-    max_bytes: int,
-    retries: int,
-) -> list[Tuple[str, str, Optional[int], str, str, str]]:
+def run_replay(
+    args: argparse.Namespace,
+    stats: Optional[dict] = None,
+    on_hit: Optional[Callable[[Hit], None]] = None,
+    keep_hits: bool = True,
+) -> list[Hit]:
     """
-    Try schemes and paths. Returns list of successful HTTP hits for this port:
-    (scheme, path, status, reason, headers_text, body_snippet)
+    --replay: run_scan()'s filters, tags and identification over a --record archive instead
+    of the network, and return the kept hits the same way. A (host, port, scheme, path)
+    recorded more than once (appended runs) is replayed from its last record.
+    Target, port, scheme and path options don't apply; the archive decides what is there.
     """
-    results = []
-    for scheme in schemes:
-        for path in paths:
-            attempt = 0
-            while True:
-                resp = await probe_once(host, port, scheme, path, timeout, max_bytes)
-                if resp is not None:
-                    status, reason, headers_text, snippet = resp
-                    results.append((scheme, path, status, reason, headers_text, snippet))
-                    break
-                attempt += 1
-                if attempt > retries:
+    hit_filter = HitFilter(
+        args.ignore_status_classes,
+        args.ignore_status_codes,
+        args.match_substring,
+        args.match_regex,
+        args.match_in_headers,
+        args.where,
+    )
+    patterns = PatternSet(args.tag_specs) if args.tag_specs else None
+    fingerprints = FingerprintDB.load(args.signatures) if args.identify else None
+    first = 1 if args.stop_when_match else args.first
+    first_found = 0
+
+    hits: list[Hit] = []
+    records = responses = 0
+    with open(args.replay, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        latest: dict[Tuple[str, int, str, str], tuple] = {}
+        for key, alpn, ttfb, start, end in archive_records(mm):
+            latest[key] = (alpn, ttfb, start, end)
+            records += 1
+
+        for (host, port, scheme, path), (alpn, ttfb, start, end) in latest.items():
+            raw = mm[start:end]
+            status, reason, headers_b, body_b = parse_http_response(raw)
+            if status is None:
+                continue
+            responses += 1
+            tags = patterns.search(raw) if patterns else []
+            r = summarize_response(scheme, path, status, reason, headers_b, body_b, alpn, ttfb, tags)
+            if not hit_filter.accepts(host, port, r):
+                continue
+            hit = make_hit(host, port, r, fingerprints)
+            if keep_hits:
+                hits.append(hit)
+            if on_hit is not None:
+                on_hit(hit)
+            if first and counts_toward_first(args, hit):
+                first_found += 1
+                if first_found >= first:
                     break
-    return results
+
+    hits.sort(key=lambda h: (host_sort_key(h.host), h.port, h.scheme, h.path))
+    if stats is not None:
+        stats["replay"] = {"archive": args.replay, "records": records, "responses": responses}
+        if first:
+            stats["first"] = first
+            stats["stopped_early"] = first_found >= first
+    return hits
 
 
 # ----------------------------
-# Live progress/logging
+# Library API
 # ----------------------------
 
-class LiveState:
-    def __init__(self, total: int, verbose: bool, log_every: float):
-        self.total = total
-        self.verbose = verbose
-        self.log_every = log_every
-        self.start = time.time()
+@dataclass
+class ScanConfig:
+    """
+    Typed scan settings for scan(); field names and defaults follow the CLI flags.
+    targets takes names, IPs, CIDRs and @hostfiles like --targets; ports is "start-end"
+    unless preset ("dev", "common", "full") is set; tags are --tag specs.
+    """
 
-        self.scanned = 0
-        self.http_hits = 0
-        self.kept_hits = 0
-        self.current = "initializing"
-        self._stop = False
-        self._last_print = 0.0
+    targets: Sequence[str] = ("127.0.0.1",)
+    ports: str = "1-65535"
+    preset: Optional[str] = None
+    exclude: Iterable[int] = ()
+    order: Optional[str] = None
+    seed: Optional[int] = None
+    per_host_concurrency: int = 0
 
-    def stop(self) -> None:
-        self._stop = True
+    schemes: Sequence[str] = ("http", "https")
+    paths: Sequence[str] = ("/",)
+    keep_alive: bool = False
+    timeout: float = 0.35
+    concurrency: int = 600
+    max_bytes: int = 8192
+    retries: int = 0
+    retry_backoff: float = 0.05
+    shape: str = "get"
+    record: Optional[str] = None
+    profile: bool = False
+    profile_slow: float = 20.0
+    adaptive: bool = False
+    max_timeout: float = 2.0
+    workers: int = 1
+    sweep: bool = True
+    engine: str = "asyncio"
+    max_rate: float = 0.0
 
-    def set_current(self, s: str) -> None:
-        self.current = s
+    ignore_status_classes: Iterable[int] = ()
+    ignore_status_codes: Iterable[int] = ()
+    match_substring: Optional[str] = None
+    match_regex: Optional[str] = None
+    match_in_headers: bool = False
+    where: Optional[str] = None
+    identify: bool = True
+    signatures: Optional[str] = None
+    favicon: bool = False
+    tags: Sequence[str] = ()
+    builtin_tags: bool = False
 
-    def bump_scanned(self, n: int = 1) -> None:
-        self.scanned += n
+    first: int = 0
+    stop_when_match: bool = False
 
-    def bump_http_hits(self, n: int = 1) -> None:
-        self.http_hits += n
+    state_db: Optional[str] = None
+    incremental: bool = False
+    full_every: float = 3600.0
+    metrics_file: Optional[str] = None
+    metrics_port: Optional[int] = None
+    progress_every: float = 0.5
 
-    def bump_kept_hits(self, n: int = 1) -> None:
-        self.kept_hits += n
+    def to_namespace(self) -> argparse.Namespace:
+        """The normalized Namespace run_scan() expects. Raises ValueError (or re.error/OSError) on bad settings."""
+        if self.workers < 1:
+            raise ValueError("workers must be >= 1")
+        if self.incremental and not self.state_db:
+            raise ValueError("incremental needs state_db")
+        if self.match_substring is not None and self.match_regex is not None:
+            raise ValueError("match_substring and match_regex are exclusive")
+        if self.engine not in ("asyncio", "raw"):
+            raise ValueError(f"engine must be asyncio or raw, not {self.engine!r}")
+        if self.engine == "raw" and (not self.sweep or self.adaptive):
+            raise ValueError("engine raw needs sweep and doesn't support adaptive")
+        if self.order not in (None, "priority", "sequential", "random"):
+            raise ValueError(f"order must be priority, sequential or random, not {self.order!r}")
+        if self.first < 0:
+            raise ValueError("first must be >= 0")
+        if self.max_rate < 0:
+            raise ValueError("max_rate must be >= 0")
+        if self.retries < 0 or self.retry_backoff < 0:
+            raise ValueError("retries and retry_backoff must be >= 0")
+        if self.shape not in ("get", "auto"):
+            raise ValueError(f"shape must be get or auto, not {self.shape!r}")
+        if self.record and self.workers > 1:
+            raise ValueError("record can't be combined with workers > 1")
+        if self.profile_slow < 0:
+            raise ValueError("profile_slow must be >= 0")
+        if (self.first or self.stop_when_match) and self.incremental:
+            raise ValueError("first/stop_when_match can't be combined with incremental")
 
-    def line(self) -> str:
-        elapsed = time.time() - self.start
-        rate = self.scanned / elapsed if elapsed > 0 else 0.0
-        pct = (self.scanned / self.total * 100.0) if self.total else 0.0
-        return (
-            f"[{pct:6.2f}%] scanned {self.scanned}/{self.total} "
-            f"({rate:,.0f}/s) | http:{self.http_hits} kept:{self.kept_hits} | "
-            f"now: {self.current}"
+        targets = parse_targets(",".join(self.targets))
+        if not targets:
+            raise ValueError("targets is empty")
+        start = end = None
+        if not self.preset:
+            a, _, b = self.ports.partition("-")
+            start, end = int(a), int(b or a)
+
+        tag_specs = [parse_tag_spec(x) for x in self.tags] + (list(BUILTIN_TAGS) if self.builtin_tags else [])
+        PatternSet(tag_specs)
+        ignore_classes, ignore_codes = set(self.ignore_status_classes), set(self.ignore_status_codes)
+        HitFilter(ignore_classes, ignore_codes, self.match_substring, self.match_regex, self.match_in_headers,
+                  self.where)
+        if self.signatures:
+            FingerprintDB.load(self.signatures)
+        if self.stop_when_match and not (self.match_substring or self.match_regex or self.where or tag_specs):
+            raise ValueError("stop_when_match needs match_substring, match_regex, where or tags")
+
+        return argparse.Namespace(
+            interactive=False,
+            host=targets[0],
+            targets=targets,
+            order=self.order,
+            seed=self.seed,
+            per_host_concurrency=self.per_host_concurrency,
+            workers=self.workers,
+            shard=None,
+            full_sweep=None,
+            preset=self.preset,
+            start=start,
+            end=end,
+            exclude_ports=set(self.exclude),
+            schemes=normalize_schemes(",".join(self.schemes)),
+            paths=[p for p in self.paths if p] or ["/"],
+            keep_alive=self.keep_alive,
+            timeout=self.timeout,
+            concurrency=self.concurrency,
+            max_bytes=self.max_bytes,
+            retries=self.retries,
+            retry_backoff=self.retry_backoff,
+            shape=self.shape,
+            record=self.record,
+            replay=None,
+            profile=self.profile,
+            profile_slow=self.profile_slow,
+            profile_out=None,
+            profiler="cprofile",
+            adaptive=self.adaptive,
+            max_timeout=self.max_timeout,
+            sweep=self.sweep,
+            engine=self.engine,
+            max_rate=self.max_rate,
+            port_share=None,
+            ignore_status_classes=ignore_classes,
+            ignore_status_codes=ignore_codes,
+            match_substring=self.match_substring,
+            match_regex=self.match_regex,
+            match_in_headers=self.match_in_headers,
+            where=self.where,
+            identify=self.identify,
+            signatures=self.signatures,
+            favicon=self.favicon,
+            tag_specs=tag_specs,
+            first=self.first,
+            stop_when_match=self.stop_when_match,
+            verbose=False,
+            log_every=self.progress_every,
+            quiet=True,
+            watch=None,
+            state_db=self.state_db,
+            incremental=self.incremental,
+            full_every=self.full_every,
+            metrics_file=self.metrics_file,
+            metrics_port=self.metrics_port,
         )
 
-    async def printer(self) -> None:
-        while not self._stop:
-            now = time.time()
-            if now - self._last_print >= self.log_every:
-                self._last_print = now
-                print(self.line(), end="\r", flush=True)
-            await asyncio.sleep(0.05)
 
+@dataclass
+class ScanProgress:
+    total: int
+    scanned: int
+    open_ports: int
+    http_hits: int
+    kept_hits: int
+    elapsed: float
 
-# ----------------------------
-# Interactive wizard
-# ----------------------------
+    @classmethod
+    def of(cls, state: LiveState) -> "ScanProgress":
+        return cls(state.total, state.scanned, state.open_ports, state.http_hits, state.kept_hits,
+                   time.time() - state.start)
 
-def wizard() -> argparse.Namespace:
-    print("\nLocalhost Port Scanner — interactive setup\n")
 
-    def ask(prompt: str, default: str) -> str:
-        s = input(f"{prompt} [{default}]: ").strip()
-        return s if s else default
+class ScanIncomplete(RuntimeError):
+    """
+    Raised by scan() after the hits when part of the target space went unscanned: a
+    worker process died, or probing a target (or the hit callback) raised.
+    """
 
-    preset = ask("Preset (dev/common/full/custom)", "dev").lower()
-    host = ask("Host", "127.0.0.1")
-    timeout = float(ask("Timeout seconds per probe", "0.35"))
-    concurrency = int(ask("Concurrency (higher=faster, too high can be noisy)", "600"))
-    max_bytes = int(ask("Max bytes to read per response", "8192"))
-    retries = int(ask("Retries per scheme/path (0 is fine)", "0"))
+    def __init__(self, failed_workers: Sequence[int], lost_targets: dict[str, str], errors: Sequence[str] = ()):
+        self.failed_workers = list(failed_workers)
+        self.lost_targets = lost_targets
+        self.errors = list(errors)
+        where = "; ".join(f"{host}:{ports}" for host, ports in lost_targets.items())
+        super().__init__(f"{lost_reason(self.failed_workers, self.errors)}; not scanned: {where}")
 
-    if preset == "custom":
-        start = int(ask("Start port", "1"))
-        end = int(ask("End port", "65535"))
-        ranges = [(start, end)]
-    else:
-        ranges = chunked_ranges_from_preset(preset)
 
-    scheme_order = ask("Schemes to try (comma separated: http,https)", "http,https")
-    schemes = [s.strip().lower() for s in scheme_order.split(",") if s.strip() in ("http", "https")]
-    if not schemes:
-        schemes = ["http", "https"]
+async def scan(
+    config: ScanConfig,
+    progress: Optional[Callable[[ScanProgress], None]] = None,
+    stop_event: Optional[asyncio.Event] = None,
+    stats: Optional[dict] = None,
+) -> AsyncIterator[Hit]:
+    """
+    Embeddable scan: `async for hit in scan(ScanConfig(ports="3000-9999")): ...`
 
-    paths_raw = ask("Paths to probe (comma separated)", "/")
-    paths = [p.strip() for p in paths_raw.split(",") if p.strip()]
-    if not paths:
-        paths = ["/"]
+    Yields kept hits as they are found (discovery order, not sorted). Nothing is printed
+    and no signal handler is installed. The scan stops when stop_event is set, when the
+    consuming task is cancelled, or when the generator is closed (wrap it in
+    contextlib.aclosing() to close it right away after a break). progress is called
+    with a ScanProgress every config.progress_every seconds and once at the end.
+    A passed stats dict is filled like the CLI's JSON meta once the scan ends.
+    If targets go unscanned (a workers > 1 process dies, a probe or the on-hit consumer
+    raises), ScanIncomplete is raised once the other hits are yielded.
+    """
+    args = config.to_namespace()
+    if stats is None:
+        stats = {}
+    stop_event = stop_event or asyncio.Event()
+    state = LiveState(total=0, verbose=False, log_every=config.progress_every)
+    found: asyncio.Queue[Optional[Hit]] = asyncio.Queue()
 
-    ignore_classes_raw = ask("Ignore status classes? (e.g. 2,3,4 or blank)", "")
-    ignore_classes = {int(x.strip()) for x in ignore_classes_raw.split(",") if x.strip().isdigit()}
+    async def report() -> None:
+        while True:
+            progress(ScanProgress.of(state))
+            await asyncio.sleep(config.progress_every)
 
-    ignore_codes_raw = ask("Ignore specific status codes? (e.g. 401,404 or blank)", "")
-    ignore_codes = {int(x.strip()) for x in ignore_codes_raw.split(",") if x.strip().isdigit()}
+    task = asyncio.create_task(run_scan(
+        args, stats, stop_event=stop_event, state=state, on_hit=found.put_nowait, keep_hits=False
+    ))
+    task.add_done_callback(lambda _: found.put_nowait(None))
+    reporter = asyncio.create_task(report()) if progress else None
+    try:
+        while True:
+            hit = await found.get()
+            if hit is None:
+                break
+            yield hit
+        await task  # surface scan errors
+        if stats.get("lost_targets"):
+            raise ScanIncomplete(stats.get("failed_workers") or [], stats["lost_targets"], stats.get("target_errors") or [])
+    finally:
+        if not task.done():
+            stop_event.set()
+        await asyncio.gather(task, return_exceptions=True)
+        if reporter is not None:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+            progress(ScanProgress.of(state))
 
-    match_mode = ask("Require content match? (none/substr/regex)", "none").lower()
-    match_substring = None
-    match_regex = None
-    if match_mode == "substr":
-        match_substring = ask("Substring to require (case-sensitive)", "api")
-    elif match_mode == "regex":
-        pat = ask("Regex to require", r'"status"\s*:\s*"ok"')
-        match_regex = pat
 
-    include_headers = ask("Search match in headers too? (y/n)", "y").lower().startswith("y")
-    verbose = ask("Verbose per-hit logging? (y/n)", "n").lower().startswith("y")
+# ----------------------------
+# Watch mode
+# ----------------------------
 
-    out_json = ask("Write JSON output file? (blank for none)", "")
-    out_csv = ask("Write CSV output file? (blank for none)", "")
+class EventSink:
+    """
+    Change events as NDJSON: one JSON object per line on stdout, or broadcast to
+    every client connected to a local Unix socket (e.g. `socat - UNIX-CONNECT:PATH`).
+    """
 
-    # Convert into a Namespace that matches argparse fields we use
-    ns = argparse.Namespace(
-        interactive=True,
-        host=host,
-        preset=preset,
-        ranges=ranges,
-        start=None,
-        end=None,
-        exclude_ports=set(),
-        schemes=schemes,
-        paths=paths,
-        timeout=timeout,
-        concurrency=concurrency,
-        max_bytes=max_bytes,
-        retries=retries,
-        ignore_status_classes=ignore_classes,
-        ignore_status_codes=ignore_codes,
-        match_substring=match_substring,
-        match_regex=match_regex,
-        match_in_headers=include_headers,
-        show=0,
-        verbose=verbose,
-        log_every=0.15,
-        json_out=out_json if out_json else None,
-        csv_out=out_csv if out_csv else None,
-    )
-    return ns
+    def __init__(self, socket_path: Optional[str] = None):
+        self.socket_path = socket_path
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._clients: set[asyncio.StreamWriter] = set()
 
+    async def start(self) -> None:
+        if not self.socket_path:
+            return
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+        self._server = await asyncio.start_unix_server(self._on_client, path=self.socket_path)
 
-# ----------------------------
-# Main runner
-# ----------------------------
+    async def _on_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        try:
+            await reader.read()  # we never expect input; EOF means the client left
+        except (asyncio.CancelledError, ConnectionError):
+            pass  # shutting down or client gone
+        finally:
+            self._clients.discard(writer)
+            writer.close()
 
-async def run_scan(args: argparse.Namespace) -> list[Hit]:
-    # Build ranges
-    if args.preset:
-        ranges = chunked_ranges_from_preset(args.preset)
-    else:
-        ranges = [(args.start, args.end)]
+    def emit(self, event: dict) -> None:
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        if not self.socket_path:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+            return
+        data = line.encode("utf-8")
+        for w in list(self._clients):
+            if w.is_closing():
+                self._clients.discard(w)
+            else:
+                w.write(data)
 
-    exclude = set(args.exclude_ports or [])
-    ports = iter_ports(ranges, exclude)
+    async def close(self) -> None:
+        if self._server is None:
+            return
+        for w in list(self._clients):
+            w.close()
+        self._server.close()
+        await self._server.wait_closed()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
 
-    # Compile regex if provided
-    match_regex = re.compile(args.match_regex) if args.match_regex else None
 
-    # Cancellation support
-    stop_event = asyncio.Event()
+async def watch(args: argparse.Namespace) -> None:
+    """
+    --watch: rescan every args.watch seconds in one process and loop, keeping the
+    TLS context and session cache across runs, and emit only appear/disappear/change
+    events. With --state-db the diff is against the store (survives restarts);
+    otherwise against the previous cycle in memory.
+    """
+    stop_event = install_sigint_event()
+    tls = TLSClient()
+    sink = EventSink(args.events_socket)
+    await sink.start()
 
-    def _handle_sigint(*_):
-        stop_event.set()
+    # One exporter and counter set across cycles, so /metrics stays up and counters only grow
+    state = LiveState(total=0, verbose=False, log_every=args.log_every)
+    state.metrics = ProbeMetrics()
+    exporter = MetricsExporter(state, args.metrics_file, args.metrics_port)
+    await exporter.start()
+    scan_args = argparse.Namespace(**vars(args))
+    scan_args.metrics_file = scan_args.metrics_port = None
 
+    previous: dict[Tuple[str, int, str, str], Tuple[Optional[int], str]] = {}
+    cycle = 0
     try:
-        signal.signal(signal.SIGINT, _handle_sigint)
-    except Exception:
-        pass
+        while not stop_event.is_set():
+            started = time.time()
+            stats: dict = {}
+            hits = await run_scan(scan_args, stats, tls=tls, stop_event=stop_event, state=state)
+            if stop_event.is_set():
+                break
 
-    state = LiveState(total=len(ports), verbose=args.verbose, log_every=args.log_every)
-    printer_task = asyncio.create_task(state.printer())
+            current = {(h.host, h.port, h.scheme, h.path): h for h in hits}
+            if stats.get("lost_targets"):
+                # A partial cycle would report everything in the lost shards as gone; skip its diff
+                warn_lost_targets(stats)
+                changes = []
+            elif args.state_db:
+                changes = stats.get("changes") or []
+            else:
+                changes = diff_results(previous, current)
+                previous = {k: (h.status, h.fingerprint) for k, h in current.items()}
 
-    sem = asyncio.Semaphore(args.concurrency)
-    hits: list[Hit] = []
-    hits_lock = asyncio.Lock()
+            for c in changes:
+                hit = current.get((c["host"], c["port"], c["scheme"], c["path"]))
+                sink.emit({
+                    "ts": time.time(),
+                    "cycle": cycle,
+                    **c,
+                    "reason": hit.reason if hit else None,
+                    "sample": hit.sample if hit else None,
+                })
+            cycle += 1
 
-    async def worker(port: int) -> None:
-        if stop_event.is_set():
-            return
-        async with sem:
-            state.set_current(f"probing :{port}")
-            res = await probe_port(
-                host=args.host,
-                port=port,
-                schemes=args.schemes,
-                paths=args.paths,
-                timeout=args.timeout,
-                max_bytes=args.max_bytes,
-                retries=args.retries,
-            )
-            state.bump_scanned(1)
+            delay = max(0.0, args.watch - (time.time() - started))
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(stop_event.wait(), timeout=delay)
+    finally:
+        await exporter.close()
+        await sink.close()
 
-            if not res:
-                return
 
-            state.bump_http_hits(1)
+def lost_reason(failed_workers: Sequence[int], errors: Sequence[str]) -> str:
+    """Why targets went unscanned, for warn_lost_targets() and ScanIncomplete."""
+    reasons = []
+    if failed_workers:
+        reasons.append(f"worker(s) {list(failed_workers)} died")
+    if errors:
+        reasons.append(f"probing raised ({errors[0]}{', ...' if len(errors) > 1 else ''})")
+    return "; ".join(reasons)
 
-            # Filter each (scheme,path) hit
-            for scheme, path, status, reason, headers_text, snippet in res:
-                # Status filters
-                if status_ignored(status, set(args.ignore_status_classes), set(args.ignore_status_codes)):
-                    continue
 
-                # Content match
-                hay = ""
-                if args.match_in_headers:
-                    hay = headers_text + "\n\n" + snippet
-                else:
-                    hay = snippet
-                ok = content_matches(hay, args.match_substring, match_regex)
-
-                if not ok:
-                    continue
-
-                hit = Hit(
-                    port=port,
-                    scheme=scheme,
-                    path=path,
-                    status=status,
-                    reason=reason,
-                    matched=ok,
-                    sample=snippet,
-                )
-                async with hits_lock:
-                    hits.append(hit)
-                    state.bump_kept_hits(1)
-                    if args.verbose:
-                        code = hit.status if hit.status is not None else "?"
-                        print(f"\n+ hit {hit.port} {hit.scheme.upper()} {hit.path} {code} {hit.reason} | {hit.sample}")
+def warn_lost_targets(stats: dict) -> None:
+    """stderr note for a scan that left targets unscanned (see run_scan(), run_sharded())."""
+    why = lost_reason(stats.get("failed_workers") or [], stats.get("target_errors") or [])
+    print(f"warning: {why}; these targets were not (fully) scanned:", file=sys.stderr)
+    for host, ports in stats["lost_targets"].items():
+        print(f"  {host}: {ports}", file=sys.stderr)
 
-    # Schedule tasks
-    tasks = [asyncio.create_task(worker(p)) for p in ports]
 
-    # Wait; allow early stop
-    while tasks and not stop_event.is_set():
-        done, pending = await asyncio.wait(tasks, timeout=0.2, return_when=asyncio.FIRST_COMPLETED)
-        tasks = list(pending)
+def format_change(c: dict, show_host: bool = False) -> str:
+    mark = {"appeared": "+", "disappeared": "-", "changed": "~"}[c["event"]]
+    code = c["status"] if c["status"] is not None else c["previous_status"]
+    if c["event"] == "changed" and c["status"] != c["previous_status"]:
+        code = f"{c['previous_status']}->{c['status']}"
+    where = f"{c['host']}:{c['port']}" if show_host else f"{c['port']:5d}"
+    return f"{mark} {where}  {c['scheme'].upper():5s}  {c['path']:18s}  {code}  ({c['event']})"
 
-    # If stopped, cancel pending
-    if stop_event.is_set():
-        for t in tasks:
-            t.cancel()
-        await asyncio.gather(*tasks, return_exceptions=True)
 
-    state.stop()
-    await asyncio.sleep(0.05)
-    printer_task.cancel()
-    with contextlib_suppress():
-        await printer_task
+# new columns go at the end, so readers that index columns keep working
+CSV_FIELDS = ["port", "scheme", "path", "status", "reason", "matched", "sample", "alpn", "fingerprint", "tags",
+              "product", "version", "favicon_hash", "host"]
 
-    # Final newline so the carriage-return progress line doesn’t eat the summary
-    print()
 
-    hits.sort(key=lambda h: (h.port, h.scheme, h.path))
-    return hits
+def csv_row(hit: Hit) -> dict:
+    row = asdict(hit)
+    row["tags"] = ";".join(hit.tags)
+    return row
+
+
+class HitStream:
+    """
+    Kept hits written and flushed the moment they pass the filters, so an interrupted
+    scan keeps what it found and consumers can tail the files. NDJSON lines are
+    {"type": "hit", ...Hit fields}, closed by one {"type": "summary", "meta": {...}}.
+    """
+
+    def __init__(self, ndjson_path: Optional[str] = None, csv_path: Optional[str] = None):
+        self.count = 0
+        self._ndjson = open(ndjson_path, "w", encoding="utf-8") if ndjson_path else None
+        self._csv_file = open(csv_path, "w", newline="", encoding="utf-8") if csv_path else None
+        self._csv = None
+        if self._csv_file:
+            self._csv = csv.DictWriter(self._csv_file, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+            self._csv_file.flush()
+
+    def write(self, hit: Hit) -> None:
+        self.count += 1
+        row = asdict(hit)
+        if self._ndjson:
+            self._ndjson.write(json.dumps({"type": "hit", **row}, separators=(",", ":")) + "\n")
+            self._ndjson.flush()
+        if self._csv:
+            self._csv.writerow(csv_row(hit))
+            self._csv_file.flush()
+
+    def summary(self, meta: dict) -> None:
+        if self._ndjson:
+            self._ndjson.write(json.dumps({"type": "summary", "meta": meta}, separators=(",", ":")) + "\n")
+            self._ndjson.flush()
+
+    def close(self) -> None:
+        for f in (self._ndjson, self._csv_file):
+            if f:
+                f.close()
 
 
 def write_json(path: str, hits: list[Hit], meta: dict) -> None:
@@ -499,12 +4729,19 @@ def write_json(path: str, hits: list[Hit], meta: dict) -> None:
 
 
 def write_csv(path: str, hits: list[Hit]) -> None:
-    fieldnames = ["port", "scheme", "path", "status", "reason", "matched", "sample"]
     with open(path, "w", newline="", encoding="utf-8") as f:
-        w = csv.DictWriter(f, fieldnames=fieldnames)
+        w = csv.DictWriter(f, fieldnames=CSV_FIELDS)
         w.writeheader()
         for h in hits:
-            w.writerow(asdict(h))
+            w.writerow(csv_row(h))
+
+
+def normalize_schemes(raw: str) -> list[str]:
+    """Comma list -> ordered schemes. "auto" sniffs the scheme per port and replaces the list."""
+    schemes = [s.strip().lower() for s in raw.split(",") if s.strip().lower() in ("http", "https", "auto")]
+    if "auto" in schemes:
+        return ["auto"]
+    return schemes or ["http", "https"]
 
 
 def parse_args(argv: Sequence[str]) -> argparse.Namespace:
@@ -512,6 +4749,14 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
 
     ap.add_argument("--interactive", action="store_true", help="Run the interactive setup wizard.")
     ap.add_argument("--host", default="127.0.0.1", help="Host to scan (default: 127.0.0.1)")
+    ap.add_argument("--targets", default=None,
+                    help='Hosts, IPs, CIDR blocks and @hostfiles, comma separated (e.g. "10.0.0.0/24,db1,@hosts.txt"). Overrides --host.')
+    ap.add_argument("--order", choices=["priority", "sequential", "random"], default=None,
+                    help="Target order (default: random for several hosts, priority for one). priority: the host's "
+                         "past hit ports (--state-db), then common HTTP ports, then the rest ascending.")
+    ap.add_argument("--per-host-concurrency", type=int, default=0,
+                    help="Max concurrent connects/probes per host on top of --concurrency (0 = no cap).")
+    ap.add_argument("--seed", type=int, default=None, help="Seed for --order random (default: new order each run).")
 
     preset = ap.add_mutually_exclusive_group()
     preset.add_argument("--preset", choices=["dev", "common", "full"], help="Preset port ranges.")
@@ -519,13 +4764,37 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
 
     ap.add_argument("--exclude", default="", help="Comma-separated ports to exclude (e.g. 22,25,3306)")
 
-    ap.add_argument("--schemes", default="http,https", help="Schemes to try in order: http,https")
+    ap.add_argument("--schemes", default="http,https", help="Schemes to try in order: http,https (or auto: detect per port on one connection)")
     ap.add_argument("--paths", default="/", help='Comma-separated paths to probe (e.g. "/,/api/health,/healthz")')
+    ap.add_argument("--keep-alive", action="store_true",
+                    help="Send all paths over one keep-alive connection per scheme (falls back per path if the server closes).")
 
     ap.add_argument("--timeout", type=float, default=0.35, help="Per-probe timeout seconds (default: 0.35)")
     ap.add_argument("--concurrency", type=int, default=600, help="Concurrent probes (default: 600)")
     ap.add_argument("--max-bytes", type=int, default=8192, help="Max bytes to read per response (default: 8192)")
-    ap.add_argument("--retries", type=int, default=0, help="Retries per scheme/path (default: 0)")
+    ap.add_argument("--retries", type=int, default=0,
+                    help="Retries per scheme/path after a timeout, reset or local error; refused, TLS and "
+                         "non-HTTP answers are final (default: 0)")
+    ap.add_argument("--retry-backoff", type=float, default=0.05, metavar="SECONDS",
+                    help="Base of the jittered exponential delay before each retry (default: 0.05)")
+    ap.add_argument("--shape", choices=["get", "auto"], default="get",
+                    help="Request shape: get (default), or auto: HEAD when no rule reads the body, a ranged GET "
+                         "when only the snippet is read (filters, identification); tags and --record keep GET. "
+                         "Ports answering 405/501 fall back to GET. Single-request probes only (not --keep-alive "
+                         "or --schemes auto).")
+    ap.add_argument("--adaptive", action="store_true",
+                    help="AIMD: --concurrency becomes the max window, --timeout the starting timeout; both adapt to RTT/timeouts.")
+    ap.add_argument("--max-timeout", type=float, default=2.0, help="Upper bound for adaptive timeouts (default: 2.0)")
+    ap.add_argument("--workers", type=int, default=1,
+                    help="Processes to shard the targets across, each with its own event loop (default: 1).")
+    ap.add_argument("--no-sweep", dest="sweep", action="store_false",
+                    help="Skip the TCP connect sweep and send HTTP probes to every port.")
+    ap.add_argument("--engine", choices=["asyncio", "raw"], default="asyncio",
+                    help="Connect sweep engine: asyncio (default) or raw (non-blocking sockets on one epoll/kqueue "
+                         "selector in a thread; fastest when most ports are closed).")
+    ap.add_argument("--max-rate", type=float, default=0.0, metavar="N",
+                    help="Cap new connections at N per second (0 = no cap). Client ports held open or in "
+                         "TIME_WAIT are always kept under 80%% of the ephemeral range.")
 
     ap.add_argument("--ignore-status-classes", default="", help="Comma classes to ignore (e.g. 2,3,4)")
     ap.add_argument("--ignore-status-codes", default="", help="Comma codes to ignore (e.g. 401,404)")
@@ -535,14 +4804,112 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
     match.add_argument("--match-regex", default=None, help="Require regex match in response.")
 
     ap.add_argument("--match-in-headers", action="store_true", help="Include headers in match search.")
+    ap.add_argument("--where", default=None, metavar="EXPR", help=WHERE_HELP)
+    ap.add_argument("--no-identify", dest="identify", action="store_false",
+                    help="Skip service identification (product/version); with no body filter either, "
+                         "probes stop reading at the end of the headers.")
+    ap.add_argument("--signatures", default=None, metavar="FILE",
+                    help="JSON list of extra fingerprint signatures (same schema as BUILTIN_SIGNATURES).")
+    ap.add_argument("--favicon", action="store_true",
+                    help="Fetch /favicon.ico per hit port and record its hash (also matched against signatures).")
+    ap.add_argument("--tag", dest="tags", action="append", default=[], metavar="NAME=LITERAL|NAME~REGEX",
+                    help="Tag hits whose response (headers + body read) contains the pattern. Repeatable.")
+    ap.add_argument("--tags-file", default=None, help="File with one tag spec per line (# comments).")
+    ap.add_argument("--builtin-tags", action="store_true",
+                    help="Add the built-in tags (frameworks, dev servers, health JSON, admin panels).")
     ap.add_argument("--verbose", action="store_true", help="Print each kept hit as it’s found.")
     ap.add_argument("--log-every", type=float, default=0.15, help="Progress refresh seconds (default: 0.15)")
 
+    ap.add_argument("--quiet", action="store_true", help="No progress line or per-hit prints during the scan.")
+    ap.add_argument("--watch", type=float, default=None, metavar="INTERVAL",
+                    help="Keep running: rescan every INTERVAL seconds and emit NDJSON change events.")
+    ap.add_argument("--events-socket", default=None, metavar="PATH",
+                    help="With --watch: serve events on this Unix socket instead of stdout.")
+    ap.add_argument("--state-db", default=None,
+                    help="SQLite file holding the last results per host; enables change reports.")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Recheck previously open ports first; sweep everything else only every --full-every seconds.")
+    ap.add_argument("--full-every", type=float, default=3600.0,
+                    help="Seconds between full sweeps in --incremental mode (default: 3600)")
+
+    ap.add_argument("--first", type=int, default=0, metavar="N",
+                    help="End the scan once N hits passed the filters (pairs well with the default priority order).")
+    ap.add_argument("--stop-when-match", action="store_true",
+                    help="End the scan at the first hit matching --match-substring/--match-regex/--where "
+                         "(with --tag rules: the first tagged hit).")
     ap.add_argument("--show", type=int, default=0, help="Show first N hits (0 = show all).")
     ap.add_argument("--json-out", default=None, help="Write hits + meta to a JSON file.")
     ap.add_argument("--csv-out", default=None, help="Write hits to a CSV file.")
+    ap.add_argument("--ndjson-out", default=None,
+                    help="Stream each kept hit as an NDJSON line as it is found; a summary line with meta closes the file.")
+    ap.add_argument("--csv-stream-out", default=None, help="Stream kept hits to a CSV file as they are found (discovery order).")
+    ap.add_argument("--stream-only", action="store_true",
+                    help="Don't keep hits in memory: no table/--json-out/--csv-out, only the streamed outputs.")
+    ap.add_argument("--record", default=None, metavar="FILE",
+                    help="Append every HTTP response read (headers + body prefix) to an archive for --replay.")
+    ap.add_argument("--replay", default=None, metavar="FILE",
+                    help="No network: run the filters, tags, identification and outputs over a --record archive.")
+    ap.add_argument("--profile", action="store_true",
+                    help="Measure event-loop lag with a 10 ms heartbeat and collect slow callbacks; "
+                         "percentiles go to the summary and meta.")
+    ap.add_argument("--profile-slow", type=float, default=20.0, metavar="MS",
+                    help="--profile slow-callback threshold in ms (default: 20; 0 = lag only).")
+    ap.add_argument("--profile-out", default=None, metavar="FILE",
+                    help="Also profile the scan into FILE (implies --profile); see --profiler.")
+    ap.add_argument("--profiler", choices=["cprofile", "sample"], default="cprofile",
+                    help="--profile-out format: cprofile (pstats) or sample (folded stacks every 5 ms, "
+                         "for flamegraph.pl/speedscope).")
+    ap.add_argument("--metrics-file", default=None, metavar="PATH",
+                    help="Keep a Prometheus text-format file of live counters and phase histograms (rewritten every second).")
+    ap.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+                    help="Serve the same metrics on http://127.0.0.1:PORT/metrics while scanning.")
 
     ns = ap.parse_args(argv)
+    if ns.incremental and not ns.state_db:
+        ap.error("--incremental needs --state-db")
+    if ns.events_socket and not ns.watch:
+        ap.error("--events-socket needs --watch")
+    if ns.events_socket and not hasattr(asyncio, "start_unix_server"):
+        ap.error("--events-socket needs Unix domain socket support")
+    if ns.stream_only and not (ns.ndjson_out or ns.csv_stream_out):
+        ap.error("--stream-only needs --ndjson-out or --csv-stream-out")
+    if ns.stream_only and (ns.json_out or ns.csv_out or ns.state_db or ns.watch):
+        ap.error("--stream-only can't be combined with --json-out, --csv-out, --state-db or --watch")
+    if ns.workers < 1:
+        ap.error("--workers must be >= 1")
+    if ns.engine == "raw" and (not ns.sweep or ns.adaptive):
+        ap.error("--engine raw is a sweep engine: it needs the sweep and doesn't support --adaptive")
+    if ns.max_rate < 0:
+        ap.error("--max-rate must be >= 0")
+    if ns.retries < 0 or ns.retry_backoff < 0:
+        ap.error("--retries and --retry-backoff must be >= 0")
+    if ns.record and ns.workers > 1:
+        ap.error("--record writes one archive from one process; it can't be combined with --workers")
+    if ns.replay and (ns.record or ns.watch or ns.state_db or ns.workers > 1):
+        ap.error("--replay reads an archive; it can't be combined with --record, --watch, --state-db or --workers")
+    if ns.profile_out:
+        ns.profile = True
+    if ns.profile_slow < 0:
+        ap.error("--profile-slow must be >= 0")
+    if ns.profile and ns.replay:
+        ap.error("--profile watches the event loop, which --replay doesn't use")
+    if ns.profile_out and ns.workers > 1:
+        ap.error("--profile-out profiles one process; use --profile with --workers")
+    if ns.replay and not is_archive(ns.replay):
+        ap.error(f"--replay: {ns.replay} is not a readable --record archive")
+    if ns.record and os.path.isfile(ns.record) and os.path.getsize(ns.record) and not is_archive(ns.record):
+        ap.error(f"--record: {ns.record} exists and is not an archive")
+    if ns.metrics_port is not None and not 0 < ns.metrics_port < 65536:
+        ap.error("--metrics-port must be 1-65535")
+    if ns.first < 0:
+        ap.error("--first must be >= 0")
+    if (ns.first or ns.stop_when_match) and (ns.watch or ns.incremental):
+        ap.error("--first/--stop-when-match end a scan early, which --watch/--incremental can't use")
+    if ns.watch is not None and ns.watch <= 0:
+        ap.error("--watch INTERVAL must be > 0")
+    if ns.watch:
+        # a daemon has no progress line; with no socket, stdout carries the NDJSON events
+        ns.quiet = True
 
     # If no args besides script name, prefer interactive
     if (len(argv) == 0):
@@ -551,6 +4918,39 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
     if ns.interactive:
         return wizard()
 
+    ns.shard, ns.full_sweep = None, None  # set per process by --workers
+    ns.port_share = None  # --workers splits the ephemeral-port budget between processes
+
+    specs = list(ns.tags)
+    if ns.tags_file:
+        with open(ns.tags_file, encoding="utf-8") as f:
+            specs += [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+    try:
+        ns.tag_specs = [parse_tag_spec(x) for x in specs]
+        ns.tag_specs += BUILTIN_TAGS if ns.builtin_tags else []
+        PatternSet(ns.tag_specs)
+    except (ValueError, re.error) as e:
+        ap.error(f"--tag: {e}")
+    if ns.stop_when_match and not (ns.match_substring or ns.match_regex or ns.where or ns.tag_specs):
+        ap.error("--stop-when-match needs --match-substring, --match-regex, --where or --tag")
+
+    # Normalize ignore sets before --where is checked against them below
+    ns.ignore_status_classes = {int(x.strip()) for x in ns.ignore_status_classes.split(",") if x.strip().isdigit()}
+    ns.ignore_status_codes = {int(x.strip()) for x in ns.ignore_status_codes.split(",") if x.strip().isdigit()}
+    try:
+        HitFilter(ns.ignore_status_classes, ns.ignore_status_codes, ns.match_substring, ns.match_regex,
+                  ns.match_in_headers, ns.where)
+    except (ValueError, re.error) as e:
+        ap.error(f"--where/--match-regex: {e}")
+    if ns.signatures:
+        try:
+            FingerprintDB.load(ns.signatures)
+        except (OSError, ValueError, TypeError, KeyError, re.error) as e:
+            ap.error(f"--signatures: {e}")
+    ns.targets = parse_targets(ns.targets) if ns.targets else [ns.host]
+    if not ns.targets:
+        ap.error("--targets is empty")
+
     # Normalize ranges
     if ns.preset:
         ns.preset = ns.preset
@@ -571,17 +4971,11 @@ def parse_args(argv: Sequence[str]) -> argparse.Namespace:
                 ns.exclude_ports.add(int(part))
 
     # Normalize schemes/paths
-    ns.schemes = [s.strip().lower() for s in ns.schemes.split(",") if s.strip().lower() in ("http", "https")]
-    if not ns.schemes:
-        ns.schemes = ["http", "https"]
+    ns.schemes = normalize_schemes(ns.schemes)
     ns.paths = [p.strip() for p in ns.paths.split(",") if p.strip()]
     if not ns.paths:
         ns.paths = ["/"]
 
-    # Status ignore sets
-    ns.ignore_status_classes = {int(x.strip()) for x in ns.ignore_status_classes.split(",") if x.strip().isdigit()}
-    ns.ignore_status_codes = {int(x.strip()) for x in ns.ignore_status_codes.split(",") if x.strip().isdigit()}
-
     return ns
 
 
@@ -595,42 +4989,89 @@ class contextlib_suppress:
 def main() -> None:
     args = parse_args(sys.argv[1:])
 
+    if args.watch:
+        try:
+            asyncio.run(watch(args))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    stream = HitStream(args.ndjson_out, args.csv_stream_out) if args.ndjson_out or args.csv_stream_out else None
     t0 = time.time()
+    stats: dict = {}
     try:
-        hits = asyncio.run(run_scan(args))
+        if args.replay:
+            hits = run_replay(args, stats, on_hit=stream.write if stream else None, keep_hits=not args.stream_only)
+        else:
+            hits = asyncio.run(run_scan(
+                args, stats, on_hit=stream.write if stream else None, keep_hits=not args.stream_only
+            ))
     except KeyboardInterrupt:
         print("\nStopped.")
+        if stream:
+            stream.close()
         return
 
     dur = time.time() - t0
-    total = len(hits)
+    total = stream.count if args.stream_only else len(hits)
 
     # Summary
-    print(f"Scan finished in {dur:.2f}s")
+    if args.replay:
+        replay = stats["replay"]
+        print(f"Replayed {replay['responses']} responses ({replay['records']} records) in {dur:.2f}s")
+    else:
+        print(f"Scan finished in {dur:.2f}s")
+    if stats.get("metrics"):
+        print(metrics_line(stats["metrics"]))
+    if isinstance(stats.get("profile"), dict):
+        print(profile_line(stats["profile"]))
+        if stats["profile"].get("output"):
+            print(f"Wrote profile: {stats['profile']['output']}")
     print(f"HTTP/HTTPS ports that passed filters: {total}\n")
 
-    to_show = hits if args.show == 0 else hits[: args.show]
-    for h in to_show:
-        code = str(h.status) if h.status is not None else "?"
-        snippet = f" | {h.sample}" if h.sample else ""
-        print(f"{h.port:5d}  {h.scheme.upper():5s}  {h.path:18s}  {code:>3s}  {h.reason}{snippet}")
+    single_host = len(args.targets) == 1 and "/" not in args.targets[0]
+    show_host = not single_host or len({h.host for h in hits}) > 1
 
-    if args.show and total > args.show:
-        print(f"\n...and {total - args.show} more")
+    changes = stats.get("changes")
+    if changes is not None:
+        print(f"Changes since last run: {len(changes)}")
+        for c in changes:
+            print(format_change(c, show_host))
+        print()
+
+    # --incremental reports only what changed; the full table is for regular runs
+    if not args.incremental and not args.stream_only:
+        to_show = hits if args.show == 0 else hits[: args.show]
+        for h in to_show:
+            code = str(h.status) if h.status is not None else "?"
+            snippet = f" | {h.sample}" if h.sample else ""
+            where = f"{h.host}:{h.port}" if show_host else f"{h.port:5d}"
+            tags = f" [{','.join(h.tags)}]" if h.tags else ""
+            product = f" ({h.product}{' ' + h.version if h.version else ''})" if h.product else ""
+            print(f"{where}  {h.scheme.upper():5s}  {h.path:18s}  {code:>3s}  {h.reason}{product}{tags}{snippet}")
+
+        if args.show and total > args.show:
+            print(f"\n...and {total - args.show} more")
 
     meta = {
-        "host": args.host,
+        **({"host": args.targets[0]} if single_host else {}),  # as before --targets, for existing readers
+        "targets": list(args.targets),
         "schemes": list(args.schemes),
         "paths": list(args.paths),
+        "keep_alive": bool(args.keep_alive),
         "timeout": args.timeout,
         "concurrency": args.concurrency,
         "max_bytes": args.max_bytes,
         "retries": args.retries,
+        "retry_backoff": args.retry_backoff,
+        **stats,
         "ignore_status_classes": sorted(list(args.ignore_status_classes)),
         "ignore_status_codes": sorted(list(args.ignore_status_codes)),
         "match_substring": args.match_substring,
         "match_regex": args.match_regex,
         "match_in_headers": bool(args.match_in_headers),
+        "where": args.where,
+        "tags": list(dict.fromkeys(name for name, _, _ in args.tag_specs)),
         "duration_seconds": dur,
         "hits": total,
         "timestamp_unix": time.time(),
@@ -644,6 +5085,17 @@ def main() -> None:
         write_csv(args.csv_out, hits)
         print(f"Wrote CSV: {args.csv_out}")
 
+    if stream:
+        stream.summary(meta)
+        stream.close()
+        for path in (args.ndjson_out, args.csv_stream_out):
+            if path:
+                print(f"Streamed {stream.count} hits: {path}")
+
+    if stats.get("lost_targets"):
+        warn_lost_targets(stats)
+        sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
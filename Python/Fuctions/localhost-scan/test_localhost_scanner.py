@@ -0,0 +1,1128 @@
+"""
+Tests for "localhost scanner.py" (stdlib only; run with python -m pytest or python -m unittest).
+
+The script's file name has a space in it, so it is loaded through importlib.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import errno
+import importlib.util
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import threading
+import time
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+_spec = importlib.util.spec_from_file_location("localhost_scanner", os.path.join(HERE, "localhost scanner.py"))
+ls = importlib.util.module_from_spec(_spec)
+sys.modules[_spec.name] = ls
+_spec.loader.exec_module(ls)
+
+
+def closed_port() -> int:
+    """A loopback port nothing listens on (bound, then released)."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def has_ipv6_loopback() -> bool:
+    try:
+        with socket.socket(socket.AF_INET6) as s:
+            s.bind(("::1", 0))
+        return True
+    except OSError:
+        return False
+
+
+# ----------------------------
+# Failure classification
+# ----------------------------
+
+class ClassifyFailureTests(unittest.TestCase):
+    def test_outcomes(self):
+        cases = [
+            (asyncio.TimeoutError(), "timeout"),
+            (ConnectionRefusedError(), "refused"),
+            (ConnectionResetError(), "reset"),
+            (BrokenPipeError(), "reset"),
+            (asyncio.IncompleteReadError(b"", 10), "reset"),
+            (ls.ssl.SSLError(1, "bad handshake"), "tls"),
+            (OSError("Multiple exceptions: ..."), "error"),
+            (ValueError(), "error"),
+        ]
+        for exc, outcome in cases:
+            with self.subTest(exc=exc):
+                self.assertEqual(ls.classify_failure(exc), outcome)
+                self.assertIn(outcome, ls.OUTCOMES)
+
+    def test_only_transient_outcomes_are_retried(self):
+        self.assertEqual(set(ls.TRANSIENT_OUTCOMES), {"timeout", "reset", "error"})
+
+
+class RefusedTests(unittest.TestCase):
+    @unittest.skipUnless(has_ipv6_loopback(), "no ::1")
+    def test_all_addresses_refused_is_refused(self):
+        port = closed_port()
+        addrs = [(socket.AF_INET6, "::1"), (socket.AF_INET, "127.0.0.1")]
+        metrics = ls.ProbeMetrics()
+        res, outcome = asyncio.run(ls.probe_once("localhost", port, "http", "/", 1.0, 4096, metrics=metrics, addrs=addrs))
+        self.assertIsNone(res)
+        self.assertEqual(outcome, "refused")
+        self.assertEqual(metrics.outcomes["refused"], 1)
+        self.assertEqual(metrics.outcomes["error"], 0)
+
+    @unittest.skipUnless(has_ipv6_loopback(), "no ::1")
+    def test_refused_port_is_not_retried(self):
+        port = closed_port()
+        addrs = [(socket.AF_INET6, "::1"), (socket.AF_INET, "127.0.0.1")]
+        metrics = ls.ProbeMetrics()
+        hits = asyncio.run(ls.probe_port(
+            "localhost", port, ["http", "https"], ["/", "/health"], 1.0, 4096, retries=3,
+            metrics=metrics, retry_backoff=0, addrs=addrs,
+        ))
+        self.assertEqual(hits, [])
+        self.assertEqual(sum(metrics.retried.values()), 0)
+        self.assertEqual(metrics.outcomes["refused"], 1)
+
+
+# ----------------------------
+# Target order
+# ----------------------------
+
+class CyclicPermutationTests(unittest.TestCase):
+    def test_full_period(self):
+        for n in (1, 2, 3, 7, 8, 9, 1000, 65535, 65536):
+            for seed in (0, 1, 12345):
+                with self.subTest(n=n, seed=seed):
+                    got = list(ls.cyclic_permutation(n, seed))
+                    self.assertEqual(len(got), n)
+                    self.assertEqual(set(got), set(range(n)))
+
+    def test_seeded_and_scrambled(self):
+        self.assertEqual(list(ls.cyclic_permutation(500, 7)), list(ls.cyclic_permutation(500, 7)))
+        self.assertNotEqual(list(ls.cyclic_permutation(500, 7)), list(range(500)))
+        self.assertEqual(list(ls.cyclic_permutation(0, 1)), [])
+
+
+class PriorityOrderTests(unittest.TestCase):
+    def test_history_then_common_then_the_rest(self):
+        space = ls.TargetSpace(ls.HostSpace(["a", "b"]), ls.PortSpace([(2999, 3001), (8079, 8080)], set()))
+        history = {"a": {3001: 1, 2999: 4}, "c": {3000: 9}}  # c isn't scanned
+        self.assertEqual(list(space.iter("priority", history=history)), [
+            ("a", 2999), ("b", 8080),  # rank 0: a's best past hit; b has none, so the top common port
+            ("a", 3001), ("b", 3000),
+            ("a", 8080), ("b", 3001),
+            ("a", 3000),  # a's 3001 came from its history already
+            ("b", 2999), ("a", 8079), ("b", 8079),  # the rest, in sequential order
+        ])
+
+
+# ----------------------------
+# Filters (--where)
+# ----------------------------
+
+def result(status=200, reason="OK", headers="HTTP/1.1 200 OK\r\nServer: nginx/1.25", snippet="hello world",
+           **kw) -> "ls.ProbeResult":
+    return ls.ProbeResult("http", kw.pop("path", "/"), status, reason, headers, snippet, **kw)
+
+
+class WhereTests(unittest.TestCase):
+    def accepts(self, where: str, r=None, port: int = 8080, **kw) -> bool:
+        return ls.HitFilter(where=where, **kw).accepts("127.0.0.1", port, r or result())
+
+    def test_expressions(self):
+        true = [
+            "status == 200",
+            "status in 2xx",
+            "status in 200..299",
+            "status in (200, 204)",
+            "status not in 4xx and port >= 8000",
+            'header.server ~ "nginx"',
+            'body ~ "hel+o" and not path == "/x"',
+            '(status == 404 or port == 8080) and scheme == "http"',
+            'headers ~ "(?i)server: NGINX"',
+        ]
+        false = [
+            "status != 200",
+            "status >= 300",
+            'header.server ~ "apache"',
+            'header.x-missing == "1"',
+            'not (status == 200 or port == 1)',
+        ]
+        for where in true:
+            with self.subTest(where=where):
+                self.assertTrue(self.accepts(where))
+        for where in false:
+            with self.subTest(where=where):
+                self.assertFalse(self.accepts(where))
+
+    def test_status_rules_prune_before_the_body(self):
+        f = ls.HitFilter(where="status in 2xx")
+        self.assertTrue(f.prunes_status)
+        self.assertTrue(f.skips_status(404))
+        self.assertFalse(f.skips_status(204))
+        self.assertFalse(f.reads_body)
+        self.assertTrue(ls.HitFilter(where='body ~ "x"').reads_body)
+
+    def test_combined_with_status_options(self):
+        self.assertFalse(self.accepts("port == 8080", ignore_codes=[200]))
+        self.assertFalse(self.accepts("port == 8080", result(status=503, reason="Unavailable"), ignore_classes=[5]))
+        self.assertTrue(self.accepts("port == 8080", ignore_classes=[4, 5]))
+
+    def test_errors(self):
+        for bad in ("nope == 1", "status ==", "status == 200 and", 'status == "ok"', "status ~ 2xx",
+                    "status == 200 )", 'tag > "x"'):
+            with self.subTest(where=bad):
+                with self.assertRaises(ValueError):
+                    ls.HitFilter(where=bad)
+
+
+# ----------------------------
+# Identification helpers
+# ----------------------------
+
+class Murmur3Tests(unittest.TestCase):
+    def test_reference_values(self):
+        # MurmurHash3_x86_32 test vectors, signed like mmh3.hash()
+        self.assertEqual(ls.murmur3_32(b""), 0)
+        self.assertEqual(ls.murmur3_32(b"", seed=1), 0x514E28B7)
+        self.assertEqual(ls.murmur3_32(b"", seed=0xFFFFFFFF), 0x81F16F39 - (1 << 32))
+        self.assertEqual(ls.murmur3_32(b"\x00\x00\x00\x00"), 0x2362F9DE)
+        self.assertEqual(ls.murmur3_32(b"aaaa", seed=0x9747B28C), 0x5A97808A)
+        self.assertEqual(ls.murmur3_32(b"abc", seed=0x9747B28C), 0xC84A62DD - (1 << 32))
+        self.assertEqual(ls.murmur3_32(b"Hello, world!", seed=0x9747B28C), 0x24884CBA)
+        self.assertEqual(ls.murmur3_32(b"The quick brown fox jumps over the lazy dog", seed=0x9747B28C), 0x2FA826CD)
+
+    def test_favicon_hash_uses_wrapped_base64(self):
+        icon = bytes(range(256)) * 2  # long enough for several 76-column lines
+        wrapped = ls.base64.encodebytes(icon)
+        self.assertIn(b"\n", wrapped[:-1])
+        self.assertEqual(ls.favicon_hash(icon), ls.murmur3_32(wrapped))
+        self.assertNotEqual(ls.favicon_hash(icon), ls.murmur3_32(ls.base64.b64encode(icon)))
+
+
+# ----------------------------
+# Reading responses
+# ----------------------------
+
+SSE_HEAD = b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n"
+
+
+async def serve_once(handler, probe):
+    """Runs probe(port) against a one-off loopback server whose connections go to handler(reader, writer)."""
+    server = await asyncio.start_server(handler, "127.0.0.1", 0)
+    try:
+        return await probe(server.sockets[0].getsockname()[1])
+    finally:
+        server.close()
+
+
+async def sse(reader, writer):
+    await reader.readuntil(b"\r\n\r\n")
+    writer.write(SSE_HEAD + b"data: tick\n\n")
+    await writer.drain()
+    await asyncio.sleep(5)  # the stream stays open
+    writer.close()
+
+
+def feed_all(buf: "ls.ResponseBuffer", chunks) -> int:
+    """Feeds chunks until the buffer says stop; returns how many it took."""
+    for i, chunk in enumerate(chunks, 1):
+        if buf.feed(chunk):
+            return i
+    return len(chunks)
+
+
+class ResponseBufferTests(unittest.TestCase):
+    def test_headers_split_across_chunks(self):
+        buf = ls.ResponseBuffer(4096)
+        chunks = [b"HTTP/1.1 20", b"0 OK\r\nContent-Le", b"ngth: 5\r\n\r", b"\nhel", b"lo", b"never read"]
+        self.assertEqual(feed_all(buf, chunks), 5)  # stops once Content-Length is reached
+        self.assertEqual(buf.parts(), (200, "OK", b"HTTP/1.1 200 OK\r\nContent-Length: 5", b"hello"))
+
+    def test_not_http_stops_at_once(self):
+        buf = ls.ResponseBuffer(4096)
+        self.assertTrue(buf.feed(b"SSH-2.0-OpenSSH_9.6\r\n"))
+        self.assertIsNone(buf.parts()[0])
+
+    def test_skipped_status_stops_at_headers(self):
+        buf = ls.ResponseBuffer(4096, skip_status=lambda st: st >= 400)
+        self.assertTrue(buf.feed(b"HTTP/1.1 404 Not Found\r\n\r\n"))
+        self.assertEqual(buf.status, 404)
+
+    def test_snippet_is_enough_without_length(self):
+        buf = ls.ResponseBuffer(1 << 20)
+        words = [b"word%d " % i for i in range(400)]
+        taken = feed_all(buf, [b"HTTP/1.0 200 OK\r\n\r\n"] + words)
+        self.assertLess(taken, 100)
+
+    def test_tags_and_full_body_read_on(self):
+        words = [b"word%d " % i for i in range(400)] + [b"needle"]
+        tagged = ls.ResponseBuffer(1 << 20, patterns=ls.PatternSet([("n", "needle", False)]))
+        self.assertEqual(feed_all(tagged, [b"HTTP/1.0 200 OK\r\n\r\n"] + words), 402)
+        self.assertEqual(tagged.tags(), ["n"])
+        full = ls.ResponseBuffer(1 << 20, full_body=True)
+        self.assertFalse(any(full.feed(c) for c in [b"HTTP/1.0 200 OK\r\n\r\n"] + words))
+
+    def test_max_bytes_caps_the_read(self):
+        buf = ls.ResponseBuffer(64, full_body=True)
+        self.assertTrue(buf.feed(b"HTTP/1.1 200 OK\r\n\r\n" + b"x" * 100))
+
+
+class ResponseFramerTests(unittest.TestCase):
+    def read_all(self, wire: bytes, max_bytes: int = 4096, chunk: int = 7) -> list:
+        async def go():
+            reader = asyncio.StreamReader()
+            for i in range(0, len(wire), chunk):  # framing must not depend on read boundaries
+                reader.feed_data(wire[i:i + chunk])
+            reader.feed_eof()
+            framer = ls.ResponseFramer(reader, 1.0, max_bytes)
+            out = []
+            while True:
+                resp = await framer.read_response()
+                if resp is None:
+                    return out
+                out.append(resp)
+                if not resp[4]:
+                    return out
+        return asyncio.run(go())
+
+    def test_content_length_and_chunked_on_one_connection(self):
+        wire = (
+            b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello"
+            b"HTTP/1.1 404 Not Found\r\nTransfer-Encoding: chunked\r\n\r\n"
+            b"4;ext=1\r\nnope\r\n3\r\n!!!\r\n0\r\nX-Trailer: y\r\n\r\n"
+            b"HTTP/1.1 204 No Content\r\n\r\n"
+            b"HTTP/1.1 200 OK\r\nConnection: close\r\n\r\nuntil eof"
+        )
+        got = [(st, reason, body, reusable) for st, reason, _, body, reusable in self.read_all(wire)]
+        self.assertEqual(got, [
+            (200, "OK", b"hello", True),
+            (404, "Not Found", b"nope!!!", True),
+            (204, "No Content", b"", True),
+            (200, "OK", b"until eof", False),
+        ])
+
+    def test_body_is_capped_but_drained(self):
+        wire = (
+            b"HTTP/1.1 200 OK\r\nContent-Length: 100\r\n\r\n" + b"a" * 100
+            + b"HTTP/1.1 201 Created\r\nContent-Length: 2\r\n\r\nok"
+        )
+        got = self.read_all(wire, max_bytes=10)
+        self.assertEqual([(r[0], r[3]) for r in got], [(200, b"a" * 10), (201, b"ok")])
+
+    def test_http_1_0_and_garbage(self):
+        got = self.read_all(b"HTTP/1.0 200 OK\r\nContent-Length: 2\r\n\r\nok")
+        self.assertFalse(got[0][4])  # 1.0 without keep-alive closes
+        self.assertEqual(self.read_all(b"SSH-2.0-OpenSSH\r\n\r\n"), [])
+
+
+class ReadTests(unittest.TestCase):
+    def test_streaming_body_is_a_hit(self):
+        async def probe(port):
+            return await ls.probe_once("127.0.0.1", port, "http", "/events", 0.3, 4096)
+
+        res, outcome = asyncio.run(serve_once(sse, probe))
+        self.assertEqual(outcome, "http")
+        self.assertEqual(res.status, 200)
+        self.assertEqual(res.snippet, "data: tick")
+
+    def test_headers_only_when_body_unused(self):
+        async def slow_body(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\n")
+            await writer.drain()
+            await asyncio.sleep(1.0)
+            writer.write(b"later")
+            writer.close()
+
+        async def probe(port):
+            loop = asyncio.get_running_loop()
+            t0 = loop.time()
+            res = await ls.probe_once("127.0.0.1", port, "http", "/", 5.0, 4096, read_body=False)
+            return res, loop.time() - t0
+
+        (res, outcome), took = asyncio.run(serve_once(slow_body, probe))
+        self.assertEqual((outcome, res.status), ("http", 200))
+        self.assertLess(took, 0.5)
+
+    def test_probe_shape(self):
+        self.assertEqual(ls.probe_shape("auto", reads_body=False, need_full_body=False), "head")
+        self.assertEqual(ls.probe_shape("auto", reads_body=True, need_full_body=False), "range")
+        self.assertEqual(ls.probe_shape("auto", reads_body=True, need_full_body=True), "get")
+        self.assertEqual(ls.probe_shape("get", reads_body=False, need_full_body=False), "get")
+
+    def test_ranged_206_is_filtered_as_200(self):
+        async def ranged(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 206 Partial Content\r\nContent-Range: bytes 0-1/10\r\nContent-Length: 2\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        async def probe(port):
+            shaper = ls.ProbeShaper("range")
+            return await ls.probe_once("127.0.0.1", port, "http", "/", 2.0, 4096, shaper=shaper)
+
+        res, _ = asyncio.run(serve_once(ranged, probe))
+        self.assertEqual((res.status, res.reason), (206, "Partial Content"))
+        self.assertEqual(res.filter_status, 200)
+        self.assertTrue(ls.HitFilter(where="status == 200").accepts("127.0.0.1", 1, res))
+        self.assertFalse(ls.HitFilter(ignore_codes=[200]).accepts("127.0.0.1", 1, res))
+        res.ranged = False  # a 206 nobody asked for is judged as is
+        self.assertFalse(ls.HitFilter(where="status == 200").accepts("127.0.0.1", 1, res))
+
+    def test_identify_from_snippet_read(self):
+        async def vite(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            body = b'<!doctype html><html><head><script type="module" src="/@vite/client"></script>' + b"<p>lorem ipsum</p>" * 500
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n" % len(body) + body[:1000])
+            await writer.drain()
+            await asyncio.sleep(1.0)
+            writer.write(body[1000:])
+            writer.close()
+
+        async def probe(port):
+            return await ls.probe_once("127.0.0.1", port, "http", "/", 5.0, 1 << 16)
+
+        res, _ = asyncio.run(serve_once(vite, probe))
+        self.assertEqual(len(res.body), 1000)  # stopped once the snippet was complete
+        self.assertEqual(ls.make_hit("127.0.0.1", 0, res, ls.FingerprintDB.load()).product, "Vite dev server")
+
+
+# ----------------------------
+# Record / replay
+# ----------------------------
+
+class RecordReplayTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "scan.lpsrec")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def record(self, results) -> None:
+        rec = ls.ResponseRecorder(self.path)
+        for host, port, r in results:
+            rec.write(host, port, r)
+        rec.close()
+
+    def replay(self, *argv) -> list:
+        return ls.run_replay(ls.parse_args(["--replay", self.path, *argv]))
+
+    def probe(self, scheme, path, status, reason, body, **kw) -> "ls.ProbeResult":
+        head = f"HTTP/1.1 {status} {reason}\r\nServer: nginx/1.25.3\r\nContent-Type: text/html".encode()
+        return ls.summarize_response(scheme, path, status, reason, head, body, **kw)
+
+    def test_round_trip(self):
+        body = "<title>Grafana</title> caf\u00e9 \u2713".encode("utf-8") + bytes(range(256))
+        self.record([
+            ("127.0.0.1", 3000, self.probe("http", "/", 200, "OK", body, ttfb=0.0125)),
+            ("::1", 8443, self.probe("https", "/health", 503, "Service Unavailable", b"down", alpn="h2")),
+            ("localhost", 65535, self.probe("http", "/caf\u00e9", 200, "OK", b"")),
+        ])
+        with open(self.path, "rb") as f:
+            recs = list(ls.archive_records(f.read()))
+        self.assertEqual([(k, alpn) for k, alpn, *_ in recs], [
+            (("127.0.0.1", 3000, "http", "/"), None),
+            (("::1", 8443, "https", "/health"), "h2"),
+            (("localhost", 65535, "http", "/caf\u00e9"), None),
+        ])
+        self.assertAlmostEqual(recs[0][2], 0.0125, places=6)
+        self.assertIsNone(recs[1][2])
+
+        hits = {(h.host, h.port): h for h in self.replay()}
+        self.assertEqual(len(hits), 3)
+        h = hits[("127.0.0.1", 3000)]
+        self.assertEqual((h.status, h.reason, h.product), (200, "OK", "Grafana"))
+        self.assertEqual((hits[("::1", 8443)].product, hits[("::1", 8443)].version), ("nginx", "1.25.3"))
+        self.assertEqual(h.sample, self.probe("http", "/", 200, "OK", body).snippet)
+        self.assertEqual(hits[("::1", 8443)].alpn, "h2")
+        self.assertEqual([(h.host, h.port) for h in self.replay("--where", "status in 2xx")],
+                         [("127.0.0.1", 3000), ("localhost", 65535)])
+
+    def test_append_keeps_latest_and_drops_torn_tail(self):
+        self.record([("127.0.0.1", 80, self.probe("http", "/", 500, "Oops", b"old"))])
+        with open(self.path, "ab") as f:
+            f.write(ls._RECORD.pack(80, 0, 0.0, 9, 1, 0, 1000) + b"127.0.0.1/partial")  # killed mid-write
+        self.record([("127.0.0.1", 80, self.probe("http", "/", 200, "OK", b"new"))])
+        with open(self.path, "rb") as f:
+            self.assertEqual(len(list(ls.archive_records(f.read()))), 2)
+        (hit,) = self.replay()
+        self.assertEqual((hit.status, hit.sample), (200, "new"))
+
+    def test_not_an_archive(self):
+        with open(self.path, "wb") as f:
+            f.write(b"HTTP/1.1 200 OK\r\n\r\n")
+        self.assertFalse(ls.is_archive(self.path))
+        with self.assertRaises(ValueError):
+            list(ls.archive_records(b"nope"))
+
+
+# ----------------------------
+# Tags (--tag)
+# ----------------------------
+
+class PatternSetTests(unittest.TestCase):
+    def tags(self, specs, data: bytes) -> list:
+        return ls.PatternSet([ls.parse_tag_spec(s) for s in specs]).search(data)
+
+    def test_backreference(self):
+        specs = ["""q~(["'])ok\\1"""]
+        self.assertEqual(self.tags(specs, b'{"ok"}'), ["q"])
+        self.assertEqual(self.tags(specs, b"{\"ok'}"), [])
+
+    def test_same_group_name_in_two_tags(self):
+        specs = ["a~(?P<v>alpha)", "b~(?P<v>beta)"]
+        self.assertEqual(self.tags(specs, b"beta alpha"), ["a", "b"])
+        self.assertEqual(self.tags(specs, b"beta"), ["b"])
+
+    def test_literals_and_flags(self):
+        specs = ["lit=Hello", "ci~(?i)hello", "multi~^second"]
+        self.assertEqual(self.tags(specs, b"HELLO\nsecond"), ["ci"])
+        self.assertEqual(self.tags(specs, b"Hello"), ["lit", "ci"])
+
+    def test_bad_regex_is_rejected(self):
+        with self.assertRaises(ls.re.error):
+            ls.PatternSet([ls.parse_tag_spec("x~(unclosed")])
+
+
+# ----------------------------
+# Adaptive mode and connection pacing
+# ----------------------------
+
+class AdaptiveControllerTests(unittest.TestCase):
+    def test_window_grows_then_halves(self):
+        ctrl = ls.AdaptiveController(1.0, max_window=64, max_timeout=5.0)
+        self.assertEqual(ctrl.window, 16)
+        for _ in range(32):
+            ctrl.record_connect(0.001)
+        self.assertEqual((ctrl.window, ctrl.increases), (24, 1))
+        self.assertEqual(ctrl.connect_timeout, ctrl.min_timeout)  # 4 x 1ms, clamped
+        for _ in range(32):
+            ctrl.record_timeout()
+        self.assertEqual((ctrl.window, ctrl.decreases), (16, 1))  # halved, but not below min_window
+
+    def test_steady_loss_is_not_congestion(self):
+        ctrl = ls.AdaptiveController(1.0, max_window=64, max_timeout=5.0)
+        for _ in range(4):  # a host that drops half its closed ports, every epoch alike
+            for i in range(32):
+                if i % 2:
+                    ctrl.record_timeout()
+                else:
+                    ctrl.record_connect(0.001)
+        self.assertEqual(ctrl.decreases, 0)
+        self.assertEqual(ctrl.window, 40)  # epochs of 32, then one of 40 under way
+
+    def test_slot_holds_the_window(self):
+        ctrl = ls.AdaptiveController(1.0, max_window=16, max_timeout=5.0)
+        peak = [0]
+
+        async def one():
+            async with ctrl.slot():
+                peak[0] = max(peak[0], ctrl._in_flight)
+                await asyncio.sleep(0.001)
+
+        async def go():
+            await asyncio.gather(*(one() for _ in range(100)))
+
+        asyncio.run(go())
+        self.assertEqual(peak[0], 16)
+
+
+class ConnectPacerTests(unittest.TestCase):
+    def test_rate_cap(self):
+        pacer = ls.ConnectPacer(max_rate=5)
+        self.assertEqual([pacer.take() for _ in range(5)], [0.0] * 5)  # a one-second burst
+        self.assertAlmostEqual(pacer.take(), 0.2, delta=0.05)
+        self.assertEqual(ls.ConnectPacer().take(), 0.0)  # no cap
+
+    def test_held_ports_wait_for_time_wait(self):
+        pacer = ls.ConnectPacer()
+        pacer.open = pacer.limit
+        self.assertGreater(pacer.room(), 0)  # every held port is an open connection
+        pacer.release(graceful=True)  # that one goes to TIME_WAIT, still held
+        self.assertAlmostEqual(pacer.room(), ls.TIME_WAIT_SECONDS, delta=1)
+        pacer.time_wait[0] -= ls.TIME_WAIT_SECONDS  # ...until TIME_WAIT is over
+        self.assertEqual(pacer.room(), 0.0)
+
+    def test_acquire_waits_for_a_release(self):
+        pacer = ls.ConnectPacer()
+
+        async def go():
+            for _ in range(pacer.limit):
+                await pacer.acquire()
+            later = asyncio.get_running_loop().call_later(0.05, pacer.release, False)
+            await asyncio.wait_for(pacer.acquire(), 5)
+            later.cancel()
+
+        asyncio.run(go())
+        summary = pacer.summary()
+        self.assertEqual((summary["waits"], summary["peak_held"], summary["rst_closes"]), (1, pacer.limit, 1))
+        self.assertGreater(summary["waited_seconds"], 0)
+
+
+# ----------------------------
+# Scan runner (run_scan)
+# ----------------------------
+
+OK_RESPONSE = b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok"
+
+
+async def answer_ok(reader, writer):
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        writer.write(OK_RESPONSE)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def http_servers(count: int, handler=answer_ok) -> tuple:
+    """count stand-in servers on nearby free loopback ports -> (servers, sorted ports)."""
+    first = await asyncio.start_server(handler, "127.0.0.1", 0)
+    servers = [first]
+    port = first.sockets[0].getsockname()[1]
+    while len(servers) < count:
+        port += 1
+        try:
+            servers.append(await asyncio.start_server(handler, "127.0.0.1", port))
+        except OSError:
+            continue
+    return servers, sorted(s.sockets[0].getsockname()[1] for s in servers)
+
+
+def scan_args(lo: int, hi: int, *extra: str):
+    return ls.parse_args(["--range", f"{lo}-{hi}", "--quiet", "--no-identify", "--order", "sequential",
+                          "--schemes", "http", "--timeout", "1", *extra])
+
+
+def run_scan(count: int, *extra: str, handler=answer_ok, **kw) -> tuple:
+    """run_scan() over a range holding count stand-ins -> (ports, hits, stats)."""
+    async def go():
+        servers, ports = await http_servers(count, handler)
+        try:
+            stats: dict = {}
+            hits = await ls.run_scan(scan_args(ports[0], ports[-1], *extra), stats, stop_event=asyncio.Event(), **kw)
+            return ports, hits, stats
+        finally:
+            for server in servers:
+                server.close()
+    return asyncio.run(go())
+
+
+def keepalive_handler(log: list):
+    """A server answering every request on a connection; log gets "connect" and each path."""
+    async def handler(reader, writer):
+        log.append("connect")
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                path = head.split(b" ", 2)[1]
+                log.append(path.decode())
+                writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n%s" % (len(path), path))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handler
+
+
+def status_handler(status: list):
+    """A server answering status[0], so a test can change it between scans."""
+    async def handler(reader, writer):
+        try:
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 %d X\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok" % status[0])
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+    return handler
+
+
+async def eventually(check, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not check():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        await asyncio.sleep(0.02)
+
+
+class RunScanTests(unittest.TestCase):
+    def test_keep_alive_sends_every_path_on_one_connection(self):
+        for schemes in ("http", "auto"):
+            with self.subTest(schemes=schemes):
+                log: list[str] = []
+                ports, hits, stats = run_scan(1, "--no-sweep", "--keep-alive", "--paths", "/,/a,/b",
+                                              "--schemes", schemes, handler=keepalive_handler(log))
+                self.assertEqual(log, ["connect", "/", "/a", "/b"])
+                self.assertEqual([(h.scheme, h.path, h.sample) for h in hits],
+                                 [("http", "/", "/"), ("http", "/a", "/a"), ("http", "/b", "/b")])
+
+    def test_without_keep_alive_each_path_connects(self):
+        log: list[str] = []
+        run_scan(1, "--no-sweep", "--paths", "/,/a", handler=keepalive_handler(log))
+        self.assertEqual(log.count("connect"), 2)
+
+    def test_raw_engine_finds_the_same_ports(self):
+        for engine in ("asyncio", "raw"):
+            with self.subTest(engine=engine):
+                ports, hits, stats = run_scan(3, "--engine", engine)
+                self.assertEqual([h.port for h in hits], ports)
+                self.assertEqual(stats["engine"], engine)
+                self.assertEqual(stats["open_ports"], [("127.0.0.1", p) for p in ports])
+                self.assertEqual(stats["metrics"]["sweep"]["open"], 3)
+
+    def test_first_stops_early(self):
+        for mode in ([], ["--no-sweep"]):
+            with self.subTest(mode=mode):
+                ports, hits, stats = run_scan(3, "--first", "1", "--concurrency", "1", *mode)
+                self.assertEqual([h.port for h in hits], ports[:1])  # sequential order
+                self.assertTrue(stats["stopped_early"])
+
+    def test_first_takes_past_hits_first_with_priority_order(self):
+        async def go(db):
+            servers, ports = await http_servers(3)
+            try:
+                # one earlier scan saw only the last port
+                await ls.run_scan(scan_args(ports[-1], ports[-1], "--state-db", db), {}, stop_event=asyncio.Event())
+                stats: dict = {}
+                hits = await ls.run_scan(
+                    scan_args(ports[0], ports[-1], "--state-db", db, "--order", "priority", "--first", "1",
+                              "--concurrency", "1"),
+                    stats, stop_event=asyncio.Event(),
+                )
+                return ports, hits, stats
+            finally:
+                for server in servers:
+                    server.close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ports, hits, stats = asyncio.run(go(os.path.join(tmp, "state.db")))
+        self.assertEqual([h.port for h in hits], ports[-1:])
+        self.assertEqual((stats["order"], stats["stopped_early"]), ("priority", True))
+
+    def test_stop_event_ends_the_scan(self):
+        async def go():
+            servers, ports = await http_servers(1)
+            stop = asyncio.Event()
+            try:
+                stats: dict = {}
+                # a big range with --no-sweep: probing it all would take far longer than the stop
+                scan = asyncio.create_task(ls.run_scan(scan_args(ports[0], ports[0] + 20000, "--no-sweep"), stats,
+                                                       stop_event=stop, on_hit=lambda hit: stop.set()))
+                hits = await asyncio.wait_for(scan, 10)
+                left = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+                return ports, hits, left
+            finally:
+                servers[0].close()
+
+        ports, hits, left = asyncio.run(go())
+        self.assertEqual([h.port for h in hits], ports)
+        self.assertEqual(left, [])
+
+    def test_state_db_reports_changes(self):
+        status = [200]
+
+        async def go(db):
+            servers, ports = await http_servers(2, status_handler(status))
+            args = scan_args(ports[0], ports[-1], "--state-db", db)
+            reports = []
+            try:
+                for step in range(3):
+                    if step == 1:
+                        status[0] = 500
+                    elif step == 2:
+                        servers[1].close()
+                        await servers[1].wait_closed()
+                    stats: dict = {}
+                    await ls.run_scan(args, stats, stop_event=asyncio.Event())
+                    reports.append([(c["event"], c["port"], c["status"]) for c in stats["changes"]])
+                return ports, reports
+            finally:
+                servers[0].close()
+
+        with tempfile.TemporaryDirectory() as tmp:
+            ports, reports = asyncio.run(go(os.path.join(tmp, "state.db")))
+        self.assertEqual(reports, [
+            [("appeared", ports[0], 200), ("appeared", ports[1], 200)],
+            [("changed", ports[0], 500), ("changed", ports[1], 500)],
+            [("disappeared", ports[1], None)],
+        ])
+
+    def test_watch_emits_change_events(self):
+        async def go():
+            servers, ports = await http_servers(2)
+            stop = asyncio.Event()
+            out = io.StringIO()
+
+            def events():
+                return [json.loads(line) for line in out.getvalue().splitlines()]
+
+            args = scan_args(ports[0], ports[-1], "--watch", "0.05")
+            with mock.patch.object(ls, "install_sigint_event", lambda: stop), mock.patch("sys.stdout", out):
+                watcher = asyncio.create_task(ls.watch(args))
+                try:
+                    await eventually(lambda: len(events()) == 2)
+                    servers[1].close()
+                    await servers[1].wait_closed()
+                    await eventually(lambda: len(events()) == 3)
+                finally:
+                    stop.set()
+                    await watcher
+                    servers[0].close()
+            return ports, events()
+
+        ports, events = asyncio.run(go())
+        self.assertEqual([(e["event"], e["port"], e["cycle"]) for e in events[:2]],
+                         [("appeared", ports[0], 0), ("appeared", ports[1], 0)])
+        self.assertEqual((events[2]["event"], events[2]["port"]), ("disappeared", ports[1]))
+        self.assertGreater(events[2]["cycle"], 0)
+
+
+class RunScanErrorTests(unittest.TestCase):
+    def test_hit_callback_error_loses_only_that_target(self):
+        for mode in ([], ["--no-sweep"]):
+            with self.subTest(mode=mode):
+                calls = []
+
+                def on_hit(hit):
+                    calls.append(hit.port)
+                    if len(calls) == 1:
+                        raise OSError(28, "No space left on device")
+
+                ports, hits, stats = run_scan(2, *mode, on_hit=on_hit)
+                self.assertEqual(sorted(calls), ports)  # the scan went on after the failure
+                self.assertEqual(stats["failed_targets"], [("127.0.0.1", calls[0])])
+                self.assertEqual(stats["lost_targets"], {"127.0.0.1": str(calls[0])})
+                self.assertIn("No space left", stats["target_errors"][0])
+
+    def test_probe_error_skips_only_that_port(self):
+        probe_port = ls.probe_port
+        broken: list[int] = []
+
+        async def flaky(host, port, *a, **kw):
+            if not broken:
+                broken.append(port)
+                raise RuntimeError("boom")
+            return await probe_port(host, port, *a, **kw)
+
+        with mock.patch.object(ls, "probe_port", flaky):
+            ports, hits, stats = run_scan(3, "--no-sweep")
+        self.assertEqual(sorted([h.port for h in hits] + broken), ports)
+        self.assertEqual(stats["failed_targets"], [("127.0.0.1", broken[0])])
+
+    def test_pool_error_cancels_workers_and_raises(self):
+        def broken_sweep(*a, **kw):
+            raise RuntimeError("sweep thread died")
+
+        async def go():
+            servers, ports = await http_servers(1)
+            try:
+                with self.assertRaisesRegex(RuntimeError, "sweep thread died"):
+                    await ls.run_scan(scan_args(ports[0], ports[0] + 50, "--engine", "raw"), {},
+                                      stop_event=asyncio.Event())
+                return [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            finally:
+                servers[0].close()
+
+        with mock.patch.object(ls, "raw_sweep", broken_sweep):
+            self.assertEqual(asyncio.run(go()), [])
+
+    def test_library_scan_yields_then_raises(self):
+        probe_port = ls.probe_port
+
+        async def flaky(host, port, *a, **kw):
+            if port == ports[0]:
+                raise RuntimeError("boom")
+            return await probe_port(host, port, *a, **kw)
+
+        async def go():
+            servers, found = await http_servers(2)
+            ports.extend(found)
+            got = []
+            try:
+                with self.assertRaises(ls.ScanIncomplete) as cm:
+                    async for hit in ls.scan(ls.ScanConfig(ports=f"{found[0]}-{found[1]}", identify=False)):
+                        got.append(hit.port)
+                return got, cm.exception
+            finally:
+                for server in servers:
+                    server.close()
+
+        ports: list[int] = []
+        with mock.patch.object(ls, "probe_port", flaky):
+            got, exc = asyncio.run(go())
+        self.assertEqual(got, [ports[1]])
+        self.assertEqual(exc.lost_targets, {"127.0.0.1": str(ports[0])})
+        self.assertIn("boom", str(exc))
+
+
+def exhausted_sockets(count: int, after: int = 0):
+    """Patch socket.socket so count new stream sockets (after the next `after`) fail with EMFILE, as under a low ulimit -n."""
+    made = [0]
+
+    class Exhausted(socket.socket):
+        def __init__(self, family=-1, type=-1, proto=-1, fileno=None):
+            if type == socket.SOCK_STREAM and fileno is None:  # accepted sockets come with a fileno
+                made[0] += 1
+                if after < made[0] <= after + count:
+                    raise OSError(errno.EMFILE, os.strerror(errno.EMFILE))
+            super().__init__(family, type, proto, fileno)
+
+    return mock.patch.object(ls.socket, "socket", Exhausted)
+
+
+class SweepResourceTests(unittest.TestCase):
+    def test_socket_creation_failure_is_an_error_result(self):
+        async def go():
+            with exhausted_sockets(2):  # inside the loop: its own self-pipe is a socket too
+                return await ls.tcp_alive([(socket.AF_INET, "127.0.0.1")], closed_port(), 1)
+
+        self.assertEqual(asyncio.run(go()), "error")
+
+    def test_socket_creation_failure_gives_back_the_pacer_slot(self):
+        pacer = ls.ConnectPacer()
+
+        async def go():
+            addrs = [(socket.AF_INET, "127.0.0.1")]
+            with exhausted_sockets(pacer.limit):  # a leak per failure would stall the last call
+                for _ in range(pacer.limit + 1):
+                    await asyncio.wait_for(ls.tcp_alive(addrs, closed_port(), 1, pacer), 5)
+
+        asyncio.run(go())
+        self.assertEqual(pacer.open, 0)
+        self.assertEqual(pacer.summary()["waits"], 0)
+
+    def test_sweep_goes_on_past_exhausted_fds(self):
+        async def go():
+            servers, ports = await http_servers(1)
+            try:
+                stats: dict = {}
+                with exhausted_sockets(5):
+                    hits = await ls.run_scan(scan_args(ports[0] - 10, ports[0]), stats, stop_event=asyncio.Event())
+                return ports, hits, stats
+            finally:
+                servers[0].close()
+
+        ports, hits, stats = asyncio.run(go())
+        self.assertEqual([h.port for h in hits], ports)
+        self.assertEqual(stats["metrics"]["sweep"]["error"], 5)
+        self.assertEqual(sum(stats["metrics"]["sweep"].values()), 11)  # every port was swept
+        self.assertNotIn("failed_targets", stats)
+        self.assertEqual(stats["metrics"]["socket_errors"], {"EMFILE": 5})  # the 5 refusals aren't errors
+
+    def test_refused_is_not_a_socket_error(self):
+        for engine in ("asyncio", "raw"):
+            with self.subTest(engine=engine):
+                lo = closed_port()
+                stats: dict = {}
+                asyncio.run(ls.run_scan(scan_args(lo, lo + 49, "--engine", engine), stats, stop_event=asyncio.Event()))
+                self.assertNotIn("ECONNREFUSED", stats["metrics"]["socket_errors"])
+                self.assertGreater(stats["metrics"]["sweep"]["closed"], 0)
+
+    def test_socket_creation_failure_shrinks_the_adaptive_window(self):
+        async def go():
+            lo = closed_port()
+            stats: dict = {}
+            with exhausted_sockets(64, after=64):  # two clean epochs, then two epochs of EMFILE
+                await ls.run_scan(scan_args(lo, lo + 159, "--adaptive", "--concurrency", "64"), stats,
+                                  stop_event=asyncio.Event())
+            return stats["adaptive"]
+
+        adaptive = asyncio.run(go())
+        self.assertEqual(adaptive["errors"], 64)
+        self.assertGreaterEqual(adaptive["decreases"], 1)
+
+
+# ----------------------------
+# Output files
+# ----------------------------
+
+class OutputTests(unittest.TestCase):
+    def cli_outputs(self, *argv: str) -> tuple:
+        """Run the CLI over one closed port -> (JSON meta, CSV header)."""
+        port = closed_port()
+        with tempfile.TemporaryDirectory() as tmp:
+            json_path, csv_path = os.path.join(tmp, "out.json"), os.path.join(tmp, "out.csv")
+            subprocess.run([sys.executable, os.path.join(HERE, "localhost scanner.py"), "--range", f"{port}-{port}",
+                            "--quiet", "--json-out", json_path, "--csv-out", csv_path, *argv],
+                           check=True, capture_output=True, timeout=60)
+            with open(json_path, encoding="utf-8") as f:
+                meta = json.load(f)["meta"]
+            with open(csv_path, encoding="utf-8") as f:
+                header = f.readline().strip().split(",")
+        return meta, header
+
+    def test_single_host_keeps_meta_host(self):
+        meta, header = self.cli_outputs("--host", "127.0.0.1")
+        self.assertEqual(meta["host"], "127.0.0.1")
+        self.assertEqual(meta["targets"], ["127.0.0.1"])
+        self.assertEqual(header[:2], ["port", "scheme"])  # the columns scripts index stay put
+        self.assertEqual(header[-1], "host")
+
+    def test_several_targets_have_no_meta_host(self):
+        for targets in ("127.0.0.1,localhost", "127.0.0.0/31"):
+            with self.subTest(targets=targets):
+                meta, _ = self.cli_outputs("--targets", targets)
+                self.assertNotIn("host", meta)
+                self.assertEqual(meta["targets"], targets.split(","))
+
+
+# ----------------------------
+# Profiling (--profile)
+# ----------------------------
+
+class LoopMonitorTests(unittest.TestCase):
+    @staticmethod
+    async def slow_callback(seconds: float = 0.03) -> None:
+        done = asyncio.Event()
+        asyncio.get_running_loop().call_soon(lambda: (time.sleep(seconds), done.set()))
+        await done.wait()
+
+    def test_overlapping_monitors_restore_on_the_last_stop(self):
+        original = asyncio.Handle._run
+
+        async def go():
+            first, second = ls.LoopMonitor(slow=0.02), ls.LoopMonitor(slow=0.02)
+            first.start()
+            second.start()
+            await first.stop()  # stopped out of order: the second still times callbacks
+            self.assertIsNot(asyncio.Handle._run, original)
+            await self.slow_callback()
+            await second.stop()
+            return first, second
+
+        first, second = asyncio.run(go())
+        self.assertIs(asyncio.Handle._run, original)
+        self.assertEqual((first.slow_count, second.slow_count), (0, 1))
+
+    def test_only_the_monitored_loop_is_timed(self):
+        original = asyncio.Handle._run
+        started, finish = threading.Event(), threading.Event()
+        counts: list[int] = []
+
+        async def monitored():
+            monitor = ls.LoopMonitor(slow=0.02)
+            monitor.start()
+            started.set()
+            while not finish.is_set():
+                await asyncio.sleep(0.01)
+            await monitor.stop()
+            counts.append(monitor.slow_count)
+
+        thread = threading.Thread(target=asyncio.run, args=(monitored(),))
+        thread.start()
+        started.wait(5)
+        asyncio.run(self.slow_callback())  # another loop, no monitor of its own
+        finish.set()
+        thread.join(5)
+        self.assertEqual(counts, [0])
+        self.assertIs(asyncio.Handle._run, original)
+
+    def test_unstopped_monitor_restores_when_its_loop_ends(self):
+        original = asyncio.Handle._run
+
+        async def go():
+            ls.LoopMonitor(slow=0.02).start()
+            await asyncio.sleep(0)
+
+        asyncio.run(go())
+        self.assertIs(asyncio.Handle._run, original)
+
+
+# ----------------------------
+# Sharding (--workers)
+# ----------------------------
+
+# Run as a script so the spawned workers can re-import it; shard 1 dies before reporting.
+# The scanner's path comes from the environment: main() replaces sys.argv, which the workers inherit.
+CRASHING_SHARD = textwrap.dedent("""
+    import asyncio, importlib.util, os, sys
+    spec = importlib.util.spec_from_file_location("localhost_scanner", os.environ["SCANNER_PATH"])
+    ls = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = ls
+    spec.loader.exec_module(ls)
+    shard_main = ls._shard_main
+
+    def crashing_shard_main(args, out):
+        if args.shard[0] == 1:
+            os._exit(7)
+        shard_main(args, out)
+
+    ls._shard_main = crashing_shard_main
+
+    async def library(ports):
+        try:
+            async for _ in ls.scan(ls.ScanConfig(ports=ports, workers=2, seed=1, sweep=False, order="sequential")):
+                pass
+        except ls.ScanIncomplete as e:
+            print("incomplete", e.failed_workers, e.lost_targets)
+
+    if __name__ == "__main__":
+        if sys.argv[1] == "cli":
+            sys.argv = ["scanner", "--range", sys.argv[2], "--workers", "2", "--seed", "1",
+                        "--order", "sequential", "--no-sweep", "--quiet"]
+            ls.main()
+        else:
+            asyncio.run(library(sys.argv[2]))
+""")
+
+
+class ShardTests(unittest.TestCase):
+    def test_compact_ports(self):
+        self.assertEqual(ls.compact_ports([8080, 3001, 3000, 3002, 3002]), "3000-3002,8080")
+        self.assertEqual(ls.compact_ports([]), "")
+
+    def run_crashing(self, mode: str, ports: str) -> subprocess.CompletedProcess:
+        with tempfile.TemporaryDirectory() as tmp:
+            script = os.path.join(tmp, "crash.py")
+            with open(script, "w") as f:
+                f.write(CRASHING_SHARD)
+            return subprocess.run(
+                [sys.executable, script, mode, ports], capture_output=True, text=True, timeout=60,
+                env={**os.environ, "SCANNER_PATH": os.path.join(HERE, "localhost scanner.py")},
+            )
+
+    def test_shard_share(self):
+        self.assertEqual([ls.shard_share(10, k, 4) for k in range(4)], [3, 3, 2, 2])
+        self.assertEqual([ls.shard_share(8, k, 4) for k in range(4)], [2, 2, 2, 2])
+        self.assertEqual([ls.shard_share(2, k, 4) for k in range(4)], [1, 1, 1, 1])  # never 0: that's unlimited
+        self.assertEqual([ls.shard_share(0, k, 4) for k in range(4)], [0, 0, 0, 0])
+
+    def test_merged_stats_keep_the_engine(self):
+        shard = {"order": "random", "sweep": True, "engine": "raw", "open_ports": None}
+        self.assertEqual(ls.merge_shard_stats([shard, dict(shard)])["engine"], "raw")
+
+    def test_cli_reports_lost_shard_and_fails(self):
+        port = closed_port()
+        proc = self.run_crashing("cli", f"{port}-{port + 3}")
+        self.assertEqual(proc.returncode, 1, proc.stderr)
+        self.assertIn("worker(s) [1] died", proc.stderr)
+        self.assertIn(f"127.0.0.1: {port + 1},{port + 3}", proc.stderr)
+
+    def test_library_raises_scan_incomplete(self):
+        port = closed_port()
+        proc = self.run_crashing("library", f"{port}-{port + 3}")
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertIn(f"incomplete [1] {{'127.0.0.1': '{port + 1},{port + 3}'}}", proc.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()